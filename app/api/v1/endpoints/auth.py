@@ -3,7 +3,8 @@ from datetime import timedelta
 from fastapi import (APIRouter, Depends, HTTPException, Request, Response,
                      status)
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core import deps, security
 from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES
@@ -14,26 +15,41 @@ from app.utils.jwt_utils import create_access_token
 router = APIRouter()
 
 
+def raise_hashing_busy():
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+
 @router.post("/login")
 async def login(
     request: Request,
     response: Response,
     username: str,
     password: str,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_db),
 ):
     """
     Login endpoint: Verifies user credentials and sets user_id in session.
     """
     # Find the user by username
-    user = db.query(UserModel).filter(UserModel.username == username).first()
+    result = await db.execute(select(UserModel).where(UserModel.username == username))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
         )
-    # Verify the password
-    if not security.verify_password(password, user.hashed_password):
+    # Verify the password (bcrypt runs in a process pool, off the event loop)
+    try:
+        verified = await security.verify_password_async(
+            username, password, user.hashed_password
+        )
+    except security.PasswordHashingBusy:
+        raise_hashing_busy()
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
@@ -57,9 +73,10 @@ async def login(
 
 
 @router.post("/register", response_model=User)
-async def register(*, db: Session = Depends(deps.get_db), user_in: UserCreate):
+async def register(*, db: AsyncSession = Depends(deps.get_db), user_in: UserCreate):
     # Check if user already exists
-    existing_user = db.query(UserModel).filter(UserModel.email == user_in.email).first()
+    result = await db.execute(select(UserModel).where(UserModel.email == user_in.email))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -67,7 +84,10 @@ async def register(*, db: Session = Depends(deps.get_db), user_in: UserCreate):
         )
 
     # Hash the password before storing it
-    hashed_password = security.get_password_hash(user_in.password)
+    try:
+        hashed_password = await security.get_password_hash_async(user_in.password)
+    except security.PasswordHashingBusy:
+        raise_hashing_busy()
 
     # Create the user
     new_user = UserModel(
@@ -78,8 +98,8 @@ async def register(*, db: Session = Depends(deps.get_db), user_in: UserCreate):
     )
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
     return new_user
 
@@ -1,22 +1,27 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api.v1.pagination import PageParams, ndjson_response, set_next_cursor
 from app.core import deps
+from app.core.principals import Principal
 from app.models.cluster import Cluster as DBCluster
-from app.models.user import User
-from app.schemas.cluster import Cluster, ClusterCreate
+from app.models.cluster_usage import ClusterUsage
+from app.models.deployment import DeploymentStatus
+from app.scheduler.usage import usage_rows
+from app.schemas.cluster import Cluster, ClusterCreate, ClusterUtilization, StatusUsage
 
 router = APIRouter()
 
 
 @router.post("/", response_model=Cluster)
-def create_cluster(
+async def create_cluster(
     *,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_db),
     cluster_in: ClusterCreate,
-    current_user: User = Depends(deps.get_current_user),
+    current_user: Principal = Depends(deps.get_current_user),
 ):
     """
     Create a new cluster.
@@ -40,25 +45,77 @@ def create_cluster(
     )
 
     db.add(cluster)
-    db.commit()
-    db.refresh(cluster)
+    await db.flush()
+    # Zeroed usage counters, maintained by every deployment status change
+    await db.execute(insert(ClusterUsage), usage_rows(cluster.id))
+    await db.commit()
+    await db.refresh(cluster)
 
     return cluster
 
 
 @router.get("/", response_model=List[Cluster])
-def list_clusters(
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_user),
+async def list_clusters(
+    response: Response,
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: Principal = Depends(deps.get_current_user),
+    page: PageParams = Depends(),
 ):
-    clusters = (
-        db.query(DBCluster)
-        .filter(DBCluster.organization_id == current_user.organization_id)
-        .all()
+    """
+    List the organization's clusters, one keyset page at a time.
+    """
+    statement = page.apply(
+        select(DBCluster).where(DBCluster.organization_id == current_user.organization_id),
+        DBCluster.id,
     )
-    if not clusters:
+    if page.stream:
+        return ndjson_response(statement, Cluster)
+
+    result = await db.execute(statement)
+    clusters = result.scalars().all()
+    if not clusters and page.after_id is None:
         raise HTTPException(
             status_code=404, detail="No clusters found for this organization"
         )
 
+    set_next_cursor(response, clusters, page)
     return clusters
+
+
+@router.get("/{cluster_id}/utilization", response_model=ClusterUtilization)
+async def get_cluster_utilization(
+    cluster_id: int,
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: Principal = Depends(deps.get_current_user),
+):
+    """
+    Per-status deployment counts and resource totals of a cluster.
+
+    Served from the cluster's usage counters by primary key; the deployments
+    table is not read.
+    """
+    cluster = await db.get(DBCluster, cluster_id)
+    if not cluster:
+        raise HTTPException(status_code=404, detail="Cluster not found")
+    if current_user.organization_id != cluster.organization_id:
+        raise HTTPException(
+            status_code=403,
+            detail="User does not have permission to view this cluster",
+        )
+
+    result = await db.execute(
+        select(ClusterUsage).where(ClusterUsage.cluster_id == cluster_id)
+    )
+    by_status = {status: StatusUsage() for status in DeploymentStatus}
+    for usage in result.scalars():
+        by_status[usage.status] = StatusUsage.model_validate(usage)
+    return ClusterUtilization(
+        cluster_id=cluster.id,
+        cpu_limit=cluster.cpu_limit,
+        ram_limit=cluster.ram_limit,
+        gpu_limit=cluster.gpu_limit,
+        cpu_available=cluster.cpu_available,
+        ram_available=cluster.ram_available,
+        gpu_available=cluster.gpu_available,
+        by_status=by_status,
+    )
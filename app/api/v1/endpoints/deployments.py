@@ -1,34 +1,46 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api.v1.pagination import PageParams, ndjson_response, set_next_cursor
+from app.api.v1.status_stream import event_stream_response
 from app.core import deps
+from app.core.cluster_limits import cluster_limits_cache, limit_error
+from app.core.config import settings
+from app.core.principals import Principal
 from app.models.cluster import Cluster as DBCluster
 from app.models.deployment import Deployment as DBDeployment
 from app.models.deployment import DeploymentStatus
-from app.models.user import User
-from app.queue.producer import \
-    publish_deployment_task  # Import the producer function
-from app.schemas.deployment import Deployment, DeploymentCreate
+from app.queue.events import stage_status_events
+from app.queue.outbox import dispatch_messages, stage_messages
+from app.queue.topology import CAPACITY_FREED
+from app.scheduler.capacity import demand_of
+from app.scheduler.release import HOLDING_STATUSES, end_deployment, release_capacity
+from app.scheduler.usage import usage_transition
+from app.schemas.deployment import (
+    Deployment,
+    DeploymentBulkItem,
+    DeploymentBulkResult,
+    DeploymentCreate,
+)
 
 router = APIRouter()
 
 
 @router.post("/", response_model=Deployment)
-def create_deployment(
+async def create_deployment(
     *,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_db),
     deployment_in: DeploymentCreate,
-    current_user: User = Depends(deps.get_current_user),
+    current_user: Principal = Depends(deps.get_current_user),
 ):
     """
     Create a new deployment and schedule it.
     """
     # Check if the specified cluster exists
-    cluster = (
-        db.query(DBCluster).filter(DBCluster.id == deployment_in.cluster_id).first()
-    )
+    cluster = await db.get(DBCluster, deployment_in.cluster_id)
     if not cluster:
         raise HTTPException(status_code=404, detail="Cluster not found")
 
@@ -38,20 +50,9 @@ def create_deployment(
             status_code=403,
             detail="User does not have permission to create a deployment in this cluster",
         )
-    if cluster.cpu_limit < deployment_in.cpu_required:
-        raise HTTPException(
-            status_code=400, detail="Insufficient CPU resources in the cluster"
-        )
-    if cluster.ram_limit < deployment_in.ram_required:
-        raise HTTPException(
-            status_code=400, detail="Insufficient RAM resources in the cluster"
-        )
-    if cluster.gpu_limit < deployment_in.gpu_required:
-        raise HTTPException(
-            status_code=400, detail="Insufficient GPU resources in the cluster"
-        )
-
-    db.commit()
+    error = limit_error(cluster, deployment_in)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
 
     # Create the deployment record
     deployment = DBDeployment(
@@ -60,51 +61,211 @@ def create_deployment(
         cpu_required=deployment_in.cpu_required,
         ram_required=deployment_in.ram_required,
         gpu_required=deployment_in.gpu_required,
+        replicas=deployment_in.replicas,
         priority=deployment_in.priority,
         cluster_id=deployment_in.cluster_id,
         status=DeploymentStatus.PENDING,  # Initial status is PENDING
     )
-
     db.add(deployment)
-    db.commit()
-    db.refresh(deployment)
+    await db.flush()
 
-    # Publish deployment task to the queue (if applicable)
-    publish_deployment_task(deployment_id=deployment.id, priority=deployment.priority)
+    # Queue the deployment task in the same transaction
+    messages = [{"deployment_id": deployment.id, "priority": deployment.priority}]
+    await stage_messages(db, messages)
+    for statement in usage_transition([deployment], None, DeploymentStatus.PENDING):
+        await db.execute(statement)
+    await db.commit()
+    await db.refresh(deployment)
+    dispatch_messages(messages)
 
     return deployment
 
 
-@router.get("/", response_model=List[Deployment])
-def list_deployments(
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_user),
+@router.post("/bulk", response_model=DeploymentBulkResult)
+async def create_deployments_bulk(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    deployments_in: List[DeploymentCreate],
+    current_user: Principal = Depends(deps.get_current_user),
 ):
     """
-    List all deployments that the user has access to.
+    Create many deployments at once and schedule them.
+
+    Each item is validated like ``POST /deployments/`` against cached
+    cluster limits. Items that pass are inserted with one multi-row INSERT,
+    queued with one outbox INSERT and committed together; the relay then
+    publishes them in batches (an in-process scheduler gets them directly
+    after the commit). Returns one result per item, in order, with
+    either the new deployment id or the reason it was rejected.
     """
-    # Fetch all clusters associated with the user's organization
-    clusters = (
-        db.query(DBCluster)
-        .filter(DBCluster.organization_id == current_user.organization_id)
-        .all()
+    if len(deployments_in) > settings.BULK_DEPLOYMENTS_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.BULK_DEPLOYMENTS_MAX_ITEMS} deployments per request",
+        )
+
+    clusters = await cluster_limits_cache.get_many(
+        db, {deployment_in.cluster_id for deployment_in in deployments_in}
     )
+    results, accepted = [], []
+    for index, deployment_in in enumerate(deployments_in):
+        cluster = clusters.get(deployment_in.cluster_id)
+        if cluster is None:
+            error = "Cluster not found"
+        elif current_user.organization_id != cluster.organization_id:
+            error = "User does not have permission to create a deployment in this cluster"
+        else:
+            error = limit_error(cluster, deployment_in)
+        results.append(DeploymentBulkItem(index=index, error=error))
+        if error is None:
+            accepted.append((index, deployment_in))
 
-    if not clusters:
-        raise HTTPException(
-            status_code=404, detail="No clusters found for your organization"
+    if accepted:
+        rows = [
+            {**deployment_in.model_dump(), "status": DeploymentStatus.PENDING}
+            for _, deployment_in in accepted
+        ]
+        inserted = await db.execute(
+            insert(DBDeployment).returning(DBDeployment.id, sort_by_parameter_order=True),
+            rows,
         )
+        ids = inserted.scalars().all()
+        messages = [
+            {"deployment_id": deployment_id, "priority": deployment_in.priority}
+            for deployment_id, (_, deployment_in) in zip(ids, accepted)
+        ]
+        await stage_messages(db, messages)
+        submitted = [deployment_in for _, deployment_in in accepted]
+        for statement in usage_transition(submitted, None, DeploymentStatus.PENDING):
+            await db.execute(statement)
+        await db.commit()
+        dispatch_messages(messages)
+        for deployment_id, (index, _) in zip(ids, accepted):
+            results[index].id = deployment_id
+
+    return DeploymentBulkResult(created=len(accepted), results=results)
+
 
-    # Fetch all deployments in these clusters
-    deployments = (
-        db.query(DBDeployment)
-        .filter(DBDeployment.cluster_id.in_([cluster.id for cluster in clusters]))
-        .all()
+@router.get("/", response_model=List[Deployment])
+async def list_deployments(
+    response: Response,
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: Principal = Depends(deps.get_current_user),
+    page: PageParams = Depends(),
+    status: Optional[DeploymentStatus] = None,
+    cluster_id: Optional[int] = None,
+    priority: Optional[int] = None,
+):
+    """
+    List the deployments that the user has access to, one keyset page at a time.
+
+    Results can be narrowed by ``status``, ``cluster_id`` and ``priority``.
+    """
+    # Deployments in any of the organization's clusters, in a single query
+    org_clusters = select(DBCluster.id).where(
+        DBCluster.organization_id == current_user.organization_id
     )
+    statement = select(DBDeployment).where(DBDeployment.cluster_id.in_(org_clusters))
+    if status is not None:
+        statement = statement.where(DBDeployment.status == status)
+    if cluster_id is not None:
+        statement = statement.where(DBDeployment.cluster_id == cluster_id)
+    if priority is not None:
+        statement = statement.where(DBDeployment.priority == priority)
+    statement = page.apply(statement, DBDeployment.id)
+    if page.stream:
+        return ndjson_response(statement, Deployment)
 
-    if not deployments:
+    result = await db.execute(statement)
+    deployments = result.scalars().all()
+
+    if not deployments and page.after_id is None:
+        has_clusters = (await db.execute(org_clusters.limit(1))).first()
+        if not has_clusters:
+            raise HTTPException(
+                status_code=404, detail="No clusters found for your organization"
+            )
         raise HTTPException(
             status_code=404, detail="No deployments found for your clusters"
         )
 
+    set_next_cursor(response, deployments, page)
     return deployments
+
+
+@router.get("/events")
+async def stream_deployment_events(
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: Principal = Depends(deps.get_current_user),
+    cluster_id: Optional[int] = None,
+):
+    """
+    Stream the status changes of the organization's deployments as Server-Sent Events.
+
+    Replaces polling the list: subscribe, list once, then apply the
+    ``status`` events as they come. ``cluster_id`` narrows the stream to one
+    cluster. Changes made by the scheduler, preemption and termination are
+    sent once committed.
+    """
+    if cluster_id is not None:
+        clusters = await cluster_limits_cache.get_many(db, {cluster_id})
+        if cluster_id not in clusters:
+            raise HTTPException(status_code=404, detail="Cluster not found")
+        if current_user.organization_id != clusters[cluster_id].organization_id:
+            raise HTTPException(
+                status_code=403,
+                detail="User does not have permission to view this cluster",
+            )
+    # The stream can stay open for hours; do not hold a connection for it
+    await db.close()
+    return event_stream_response(current_user.organization_id, cluster_id)
+
+
+@router.post("/{deployment_id}/terminate", response_model=Deployment)
+async def terminate_deployment(
+    deployment_id: int,
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: Principal = Depends(deps.get_current_user),
+):
+    """
+    Terminate a deployment and give its resources back to the cluster.
+
+    A pending deployment is simply never scheduled. A running one releases its
+    resources, and a capacity-freed event is queued in the same transaction
+    so the scheduler admits the cluster's waiting deployments that now fit.
+    """
+    deployment = await db.get(DBDeployment, deployment_id)
+    if not deployment:
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    cluster = await db.get(DBCluster, deployment.cluster_id)
+    if not cluster or current_user.organization_id != cluster.organization_id:
+        raise HTTPException(
+            status_code=403,
+            detail="User does not have permission to terminate this deployment",
+        )
+
+    previous = deployment.status
+    if previous not in (DeploymentStatus.PENDING, *HOLDING_STATUSES):
+        raise HTTPException(
+            status_code=409, detail=f"Deployment is already {previous.value}"
+        )
+    ended = await db.execute(
+        end_deployment(deployment.id, previous, DeploymentStatus.TERMINATED)
+    )
+    if ended.first() is None:
+        # Scheduled, preempted or terminated since it was read
+        raise HTTPException(status_code=409, detail="Deployment status changed, retry")
+
+    for statement in usage_transition([deployment], previous, DeploymentStatus.TERMINATED):
+        await db.execute(statement)
+    stage_status_events(db, [deployment], DeploymentStatus.TERMINATED)
+    messages = []
+    if previous in HOLDING_STATUSES:
+        await db.execute(release_capacity(cluster.id, demand_of(deployment)))
+        messages.append({"deployment_id": deployment.id, "priority": 0, "event": CAPACITY_FREED})
+        await stage_messages(db, messages)
+    await db.commit()
+    await db.refresh(deployment)
+    dispatch_messages(messages)
+
+    return deployment
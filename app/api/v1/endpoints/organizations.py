@@ -1,41 +1,49 @@
 from fastapi import APIRouter, Depends, HTTPException
 from app.core import deps
+from app.core.principals import Principal, principal_cache
 from app.models.organization import Organization as OrganizationModel
 from app.models.user import User
 from app.schemas.organization import Organization, OrganizationCreate
 from app.utils.invite_utils import generate_invite_code, generate_unique_invite_code
 
 router = APIRouter()
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
+async def assign_organization(db: AsyncSession, principal: Principal, organization_id: int):
+    """
+    Move a user into an organization and drop their cached principal.
+    """
+    user = await db.get(User, principal.id)
+    user.organization_id = organization_id
+    await db.commit()
+    principal_cache.invalidate_user(principal.id)
+
 
 @router.post("/", response_model=Organization)
-def create_organization(
+async def create_organization(
     *,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_db),
     organization_in: OrganizationCreate,
-    current_user: User = Depends(deps.get_current_user),
+    current_user: Principal = Depends(deps.get_current_user),
 ):
     """
     Implement organization creation.
     This will create a new organization and associate it with the current user.
     """
     # Check if the user is already part of an organization
-    print(current_user, "CURRENT")
-    print(organization_in, "ORG")
-    invite_code = generate_unique_invite_code(db)
+    invite_code = await generate_unique_invite_code(db)
     if current_user.organization_id:
         raise HTTPException(
             status_code=400, detail="User is already part of an organization"
         )
 
     # Check if organization already exists
-    existing_org = (
-        db.query(OrganizationModel)
-        .filter(OrganizationModel.name == organization_in.name)
-        .first()
+    result = await db.execute(
+        select(OrganizationModel).where(OrganizationModel.name == organization_in.name)
     )
+    existing_org = result.scalars().first()
     if existing_org:
         raise HTTPException(status_code=400, detail="Organization already exists")
 
@@ -48,33 +56,31 @@ def create_organization(
     )
 
     db.add(new_org)
-    db.commit()
-    db.refresh(new_org)
+    await db.commit()
+    await db.refresh(new_org)
 
     # Assign the organization to the current user
-    current_user.organization_id = new_org.id
-    db.commit()
+    await assign_organization(db, current_user, new_org.id)
 
     return new_org
 
 
 @router.post("/{invite_code}/join")
-def join_organization(
+async def join_organization(
     *,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_db),
     invite_code: str,
-    current_user: User = Depends(deps.get_current_user),
+    current_user: Principal = Depends(deps.get_current_user),
 ):
     """
     Implement organization joining logic.
     This will allow a user to join an organization using an invite code.
     """
     # Find the organization using the invite code
-    organization = (
-        db.query(OrganizationModel)
-        .filter(OrganizationModel.invite_code == invite_code)
-        .first()
+    result = await db.execute(
+        select(OrganizationModel).where(OrganizationModel.invite_code == invite_code)
     )
+    organization = result.scalars().first()
 
     if not organization:
         raise HTTPException(status_code=404, detail="Organization not found")
@@ -86,7 +92,6 @@ def join_organization(
         )
 
     # Assign the user to the organization
-    current_user.organization_id = organization.id
-    db.commit()
+    await assign_organization(db, current_user, organization.id)
 
     return {"message": f"Successfully joined the organization {organization.name}"}
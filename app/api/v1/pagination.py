@@ -0,0 +1,75 @@
+from typing import Literal, Optional
+
+from fastapi import Query, Response
+from fastapi.responses import StreamingResponse
+
+from app.core.deps import db_session
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+
+# Header carrying the keyset cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    """
+    Keyset pagination query parameters shared by the list endpoints.
+
+    Rows are returned in ``id`` order. ``after_id`` is the cursor: pass back
+    the ``X-Next-Cursor`` header of the previous page to get the next one.
+    With ``format=ndjson`` the rows after the cursor are streamed instead,
+    without the page size cap unless ``limit`` is given.
+    """
+
+    def __init__(
+        self,
+        after_id: Optional[int] = Query(None, description="Return rows with a larger id"),
+        limit: Optional[int] = Query(None, ge=1, description="Page size"),
+        format: Literal["json", "ndjson"] = Query("json"),
+    ):
+        self.after_id = after_id
+        self.stream = format == "ndjson"
+        if self.stream:
+            self.limit = limit
+        else:
+            self.limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+    def apply(self, statement, id_column):
+        if self.after_id is not None:
+            statement = statement.where(id_column > self.after_id)
+        statement = statement.order_by(id_column)
+        if self.limit is not None:
+            statement = statement.limit(self.limit)
+        return statement
+
+
+def set_next_cursor(response: Response, rows, page: PageParams):
+    """
+    Point the client at the next page when this one came back full.
+    """
+    if rows and len(rows) == page.limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1].id)
+
+
+def ndjson_response(statement, schema):
+    """
+    Stream the rows of ``statement`` as newline-delimited JSON.
+
+    Rows are fetched on a session owned by the stream, opened when the body
+    starts and closed when it ends, since the request's ``get_db`` session
+    may already be closed by then. They come from a server-side cursor in
+    chunks of STREAM_CHUNK_SIZE, so memory stays flat however many rows
+    match.
+    """
+
+    async def rows():
+        async with db_session() as db:
+            result = await db.stream(statement.execution_options(yield_per=STREAM_CHUNK_SIZE))
+            async for chunk in result.scalars().partitions():
+                yield "".join(
+                    schema.model_validate(row).model_dump_json() + "\n" for row in chunk
+                )
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+
+from fastapi.responses import StreamingResponse
+
+from app.core.cluster_limits import cluster_limits_cache
+from app.core.config import settings
+from app.core.deps import db_session
+from app.core.metrics import STATUS_STREAM_EVENTS, STATUS_STREAM_SUBSCRIBERS
+from app.queue.events import status_events
+from app.schemas.deployment import DeploymentStatusEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    One open status stream: the events of an organization, or of one of its
+    clusters, waiting to be sent.
+    """
+
+    def __init__(self, organization_id, cluster_id, max_pending):
+        self.organization_id = organization_id
+        self.cluster_id = cluster_id
+        self.queue = asyncio.Queue(max_pending)
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind: end the stream rather than buffer without bound
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class StatusStream:
+    """
+    In-process fan-out of deployment status changes to stream subscribers.
+
+    Changes arrive from app.queue.events, on any thread. One dispatcher task
+    on the event loop looks up the organization of each change's cluster in
+    the cluster limits cache and hands the change to every subscriber of
+    that organization (and cluster, if the subscriber asked for one). With
+    no subscribers, changes are dropped before reaching the loop.
+    """
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self._subscribers = {}  # organization id -> set of Subscription
+        self._loop = None
+        self._inbox = None
+        self._dispatcher = None
+
+    def publish(self, events):
+        """
+        Queue ``events`` for dispatch; safe to call from any thread.
+        """
+        loop = self._loop
+        if not self._subscribers or loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._inbox.put_nowait, events)
+
+    @contextmanager
+    def subscribe(self, organization_id, cluster_id=None):
+        """
+        Register a subscriber for the duration of the ``with`` block.
+
+        Must be entered on the event loop.
+        """
+        self._ensure_dispatcher()
+        subscription = Subscription(organization_id, cluster_id, self.max_pending)
+        self._subscribers.setdefault(organization_id, set()).add(subscription)
+        STATUS_STREAM_SUBSCRIBERS.inc()
+        try:
+            yield subscription
+        finally:
+            subscribers = self._subscribers[organization_id]
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[organization_id]
+            STATUS_STREAM_SUBSCRIBERS.dec()
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and not self._dispatcher.done():
+            return
+        self._loop, self._inbox = loop, asyncio.Queue()
+        self._dispatcher = loop.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while True:
+            events = await self._inbox.get()
+            try:
+                async with db_session() as db:
+                    clusters = await cluster_limits_cache.get_many(
+                        db, {event["cluster_id"] for event in events}
+                    )
+            except Exception:
+                logger.exception("Failed to resolve the clusters of status events")
+                continue
+            for event in events:
+                cluster = clusters.get(event["cluster_id"])
+                if cluster is None:
+                    continue
+                for subscription in self._subscribers.get(cluster.organization_id, ()):
+                    if subscription.cluster_id in (None, cluster.id):
+                        subscription.offer(event)
+
+
+def event_stream_response(organization_id, cluster_id=None):
+    """
+    Stream the status changes of an organization (or one of its clusters) as
+    Server-Sent Events.
+
+    A ``: subscribed`` comment is sent once the subscription is in place, so
+    a client can list the deployments after it without missing a change.
+    Each change is a ``status`` event whose data is a DeploymentStatusEvent.
+    The stream ends if the client falls too far behind.
+    """
+    keepalive = settings.STATUS_STREAM_KEEPALIVE_SECONDS
+
+    async def events():
+        with status_stream.subscribe(organization_id, cluster_id) as subscription:
+            yield ": subscribed\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # Send whatever else is already queued in the same chunk
+                batch = [event]
+                while batch[-1] is not None and not subscription.queue.empty():
+                    batch.append(subscription.queue.get_nowait())
+                sent = [event for event in batch if event is not None]
+                if sent:
+                    STATUS_STREAM_EVENTS.inc(len(sent))
+                    yield "".join(_status_message(event) for event in sent)
+                if batch[-1] is None:
+                    return
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _status_message(event):
+    return f"event: status\ndata: {DeploymentStatusEvent(**event).model_dump_json()}\n\n"
+
+
+status_stream = StatusStream(max_pending=settings.STATUS_STREAM_MAX_PENDING)
+status_events.add_listener(status_stream.publish)
@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.models.cluster import Cluster
+
+
+@dataclass(frozen=True)
+class ClusterLimits:
+    """
+    The immutable part of a ``Cluster`` row that submissions are validated against.
+    """
+
+    id: int
+    organization_id: int
+    cpu_limit: float
+    ram_limit: float
+    gpu_limit: float
+
+
+def limit_error(cluster, deployment_in):
+    """
+    Return why ``deployment_in`` can never fit ``cluster``, or None if it can.
+
+    Every replica must fit on the cluster at the same time.
+    """
+    replicas = deployment_in.replicas
+    if cluster.cpu_limit < deployment_in.cpu_required * replicas:
+        return "Insufficient CPU resources in the cluster"
+    if cluster.ram_limit < deployment_in.ram_required * replicas:
+        return "Insufficient RAM resources in the cluster"
+    if cluster.gpu_limit < deployment_in.gpu_required * replicas:
+        return "Insufficient GPU resources in the cluster"
+    return None
+
+
+class ClusterLimitsCache:
+    """
+    Bounded LRU of cluster id -> limits and owning organization.
+
+    Limits and ownership do not change after a cluster is created, so the
+    TTL only bounds how long a deleted cluster can linger. Misses are loaded
+    with one query per call, however many clusters are asked for.
+    """
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # cluster id -> (limits, expiry)
+
+    async def get_many(self, db, cluster_ids):
+        """
+        Return {cluster id: ClusterLimits} for the ``cluster_ids`` that exist.
+        """
+        now = time.monotonic()
+        found, missing = {}, set()
+        for cluster_id in cluster_ids:
+            entry = self._entries.get(cluster_id)
+            if entry is not None and entry[1] > now:
+                found[cluster_id] = entry[0]
+                self._entries.move_to_end(cluster_id)
+            else:
+                missing.add(cluster_id)
+
+        if missing:
+            result = await db.execute(
+                select(
+                    Cluster.id,
+                    Cluster.organization_id,
+                    Cluster.cpu_limit,
+                    Cluster.ram_limit,
+                    Cluster.gpu_limit,
+                ).where(Cluster.id.in_(missing))
+            )
+            for row in result:
+                limits = ClusterLimits(*row)
+                found[limits.id] = limits
+                self._put(limits, now)
+        return found
+
+    def invalidate(self, cluster_id):
+        self._entries.pop(cluster_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _put(self, limits, now):
+        if self.ttl <= 0:
+            return
+        self._entries[limits.id] = (limits, now + self.ttl)
+        self._entries.move_to_end(limits.id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+cluster_limits_cache = ClusterLimitsCache(
+    ttl_seconds=settings.CLUSTER_LIMITS_CACHE_TTL_SECONDS,
+    max_entries=settings.CLUSTER_LIMITS_CACHE_MAX_ENTRIES,
+)
@@ -1,28 +1,42 @@
-from typing import Generator, Optional
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Optional
 
 import jwt  # PyJWT
 from fastapi import Depends, HTTPException, Request, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import ALGORITHM, SECRET_KEY
-from app.db.session import SessionLocal
+from app.core.principals import Principal, principal_cache
+from app.db.session import AsyncSessionLocal
 from app.models.user import User
 
 
-def get_db() -> Generator:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> Optional[User]:
+@asynccontextmanager
+async def db_session() -> AsyncGenerator:
+    """
+    A session like ``get_db``'s, for code that outlives the request handler:
+    streaming response bodies and background tasks. Depending on the FastAPI
+    version, ``get_db`` closes its session before the response body is sent.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_current_user(
+    request: Request, db: AsyncSession = Depends(get_db)
+) -> Optional[Principal]:
     """
     Validate the current user from the JWT token in the Authorization header.
 
     This function checks for the presence of a valid JWT token, decodes it to get the user info,
     and raises an HTTPException if the token is invalid or the user is not found in the database.
+    Resolved principals are cached per token, so repeat calls skip the decode and the query.
     """
     # Extract the token from the Authorization header
     auth_header = request.headers.get("Authorization")
@@ -33,6 +47,10 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> Optiona
 
     token = auth_header.split(" ")[1]  # Expecting format: "Bearer <token>"
 
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         # Decode the token to get user data (sub = username or user_id)
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -44,14 +62,17 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> Optiona
             )
 
         # Fetch the user from the database using the decoded username
-        user = db.query(User).filter(User.username == username).first()
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalars().first()
 
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found"
             )
 
-        return user
+        principal = Principal.from_user(user)
+        principal_cache.put(token, principal, token_expiry=payload.get("exp"))
+        return principal
 
     except jwt.ExpiredSignatureError:
         raise HTTPException(
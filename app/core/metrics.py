@@ -0,0 +1,180 @@
+"""
+Prometheus metrics of the API and the consumers.
+
+Each process (API, every consumer) keeps its own prometheus_client registry;
+Prometheus scrapes them separately.
+"""
+import time
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server
+from sqlalchemy import event
+from starlette.routing import NoMatchFound
+
+# Latency buckets in seconds, from sub-millisecond queries to slow requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Queue lag buckets in seconds, up to the longest retry backoff
+LAG_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Scheduler
+SCHEDULING_SECONDS = Histogram(
+    "scheduler_decision_seconds",
+    "Time to take and commit a scheduling decision.",
+    ["path"],
+    buckets=LATENCY_BUCKETS,
+)
+SCHEDULED_DEPLOYMENTS = Counter(
+    "scheduler_deployments_total",
+    "Deployments by scheduling outcome.",
+    ["outcome"],
+)
+PREEMPTIONS = Counter(
+    "scheduler_preemptions_total",
+    "Deployments preempted to make room for more urgent ones.",
+)
+PREEMPTION_ATTEMPTS = Counter(
+    "scheduler_preemption_attempts_total",
+    "Preemption attempts by result.",
+    ["result"],
+)
+SCHEDULING_CONFLICTS = Counter(
+    "scheduler_version_conflicts_total",
+    "Scheduling commits rolled back because a deployment changed concurrently.",
+    ["path"],
+)
+
+# Queue
+QUEUE_LAG_SECONDS = Histogram(
+    "queue_lag_seconds",
+    "Time from publishing a deployment task (or its retry falling due) to its ack.",
+    buckets=LAG_BUCKETS,
+)
+PUBLISHED_MESSAGES = Counter(
+    "queue_published_messages_total",
+    "Deployment task messages published to the queue backend.",
+)
+QUEUE_DEPTH = Gauge(
+    "queue_depth",
+    "Messages waiting in the in-process queue of the embedded scheduler.",
+)
+
+# Database
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds",
+    "Database statement execution time.",
+    ["statement"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# HTTP
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency per endpoint.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Status stream
+STATUS_STREAM_SUBSCRIBERS = Gauge(
+    "status_stream_subscribers",
+    "Open deployment status streams.",
+)
+STATUS_STREAM_EVENTS = Counter(
+    "status_stream_events_total",
+    "Deployment status changes sent to stream subscribers.",
+)
+
+# Header carrying the publish (or retry due) time of a task, in epoch seconds
+PUBLISHED_AT_HEADER = "x-published-at"
+
+
+def observe_queue_lag(properties):
+    """
+    Record the lag of a message whose task was just acknowledged.
+    """
+    headers = getattr(properties, "headers", None) or {}
+    published_at = headers.get(PUBLISHED_AT_HEADER)
+    if published_at is not None:
+        QUEUE_LAG_SECONDS.observe(max(0.0, time.time() - float(published_at)))
+
+
+def instrument_engine(engine):
+    """
+    Time every statement executed on ``engine`` (a sync Engine, or the
+    ``sync_engine`` of an async one) into DB_QUERY_SECONDS.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+        if verb not in ("select", "insert", "update", "delete", "with"):
+            verb = "other"
+        DB_QUERY_SECONDS.labels(statement=verb).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        # after_cursor_execute does not run for failed statements
+        started = context.connection.info.get("query_started") if context.connection else None
+        if started:
+            started.pop()
+
+
+def _route_template(scope):
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    # Routes of an included router keep the path they were declared with; ask
+    # the app for the full one, with each parameter rendered as its template
+    params = {name: f"{{{name}}}" for name in route.param_convertors}
+    try:
+        return scope["router"].url_path_for(route.name, **params)
+    except NoMatchFound:
+        return route.path_format
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every HTTP request.
+
+    Requests are labelled with the matched route template
+    (``/api/v1/deployments/{deployment_id}``) rather than the raw path, so the
+    number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(
+                method=scope["method"],
+                route=_route_template(scope),
+                status=status[0],
+            ).observe(time.perf_counter() - started)
+
+
+def start_metrics_server(port, registry=REGISTRY):
+    """
+    Serve ``registry`` at ``http://0.0.0.0:port/metrics`` from a daemon thread.
+
+    For processes without an HTTP server of their own, such as the consumers.
+    """
+    return start_http_server(port, registry=registry)
@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    The authenticated user as seen by request handlers.
+
+    A detached snapshot of the ``User`` row: handlers that need to change the
+    user load the row by ``id`` and invalidate the cache afterwards.
+    """
+
+    id: int
+    username: str
+    organization_id: Optional[int]
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            username=user.username,
+            organization_id=user.organization_id,
+            is_active=user.is_active,
+        )
+
+
+class PrincipalCache:
+    """
+    Bounded LRU of bearer token -> resolved principal.
+
+    A hit skips both the JWT decode and the user lookup. Entries live for at
+    most ``ttl_seconds`` and never past the token's own expiry. Invalidation
+    is per process, so the TTL also bounds how stale other workers can be.
+    """
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # token -> (principal, expiry)
+        self._tokens_by_user = {}  # user id -> set of cached tokens
+
+    def get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        principal, expiry = entry
+        if expiry <= time.time():
+            self._remove(token)
+            return None
+        self._entries.move_to_end(token)
+        return principal
+
+    def put(self, token, principal, token_expiry=None):
+        if self.ttl <= 0:
+            return
+        expiry = time.time() + self.ttl
+        if token_expiry is not None:
+            expiry = min(expiry, token_expiry)
+        self._remove(token)
+        self._entries[token] = (principal, expiry)
+        self._tokens_by_user.setdefault(principal.id, set()).add(token)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """
+        Forget every cached token of a user, e.g. after their organization changed.
+        """
+        for token in self._tokens_by_user.pop(user_id, ()):
+            self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].id]
+
+
+principal_cache = PrincipalCache(
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES,
+)
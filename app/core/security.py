@@ -1,8 +1,25 @@
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 from passlib.context import CryptContext
 
+from app.core.config import settings
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+class PasswordHashingBusy(Exception):
+    """
+    Raised when too many hash/verify calls are already waiting for the pool.
+    """
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     TODO: Implement password verification using bcrypt
@@ -19,3 +36,111 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
     """
     return pwd_context.hash(password)
+
+
+class CredentialCache:
+    """
+    Short-lived memory of successful password verifications.
+
+    Entries are keyed on an HMAC of (username, password, stored hash) under a
+    per-process random key, so neither the password nor a reusable digest of
+    it is kept, and changing the password invalidates the entry.
+    """
+
+    def __init__(self, ttl_seconds, max_entries=10_000):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()  # digest -> expiry (monotonic)
+
+    def _digest(self, username, password, hashed_password):
+        message = "\0".join((username, password, hashed_password)).encode()
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def hit(self, username, password, hashed_password):
+        digest = self._digest(username, password, hashed_password)
+        expiry = self._entries.get(digest)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del self._entries[digest]
+            return False
+        return True
+
+    def add(self, username, password, hashed_password):
+        digest = self._digest(username, password, hashed_password)
+        self._entries[digest] = time.monotonic() + self.ttl
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_executor = None
+_pending = 0
+credential_cache = (
+    CredentialCache(settings.CREDENTIAL_CACHE_TTL_SECONDS)
+    if settings.CREDENTIAL_CACHE_TTL_SECONDS > 0
+    else None
+)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Spawned, not forked: a fork of the running API would copy its
+        # threads' locks (logging, the relay, the DB pools) in whatever state
+        # they happen to be in, and can deadlock the child.
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    """
+    Stop the password hashing pool, if it was started.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def _run_in_pool(fn, *args):
+    """
+    Run a bcrypt call in the process pool without blocking the event loop.
+
+    At most PASSWORD_HASH_MAX_PENDING calls may be queued or running at once;
+    beyond that PasswordHashingBusy is raised so callers can shed load.
+    """
+    global _pending
+    if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise PasswordHashingBusy()
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def verify_password_async(username: str, plain_password: str, hashed_password: str) -> bool:
+    """
+    Verify a password off the event loop, consulting the credential cache first.
+    """
+    if credential_cache is not None and credential_cache.hit(
+        username, plain_password, hashed_password
+    ):
+        return True
+    verified = await _run_in_pool(verify_password, plain_password, hashed_password)
+    if verified and credential_cache is not None:
+        credential_cache.add(username, plain_password, hashed_password)
+    return verified
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    Hash a password off the event loop.
+    """
+    return await _run_in_pool(get_password_hash, password)
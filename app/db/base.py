@@ -1,7 +1,10 @@
 # Import base classes for SQLAlchemy
 from app.db.base_class import Base
 from app.models.cluster import Cluster  # noqa
+from app.models.cluster_usage import ClusterUsage  # noqa
 from app.models.deployment import Deployment  # noqa
 from app.models.organization import Organization  # noqa
+from app.models.outbox import OutboxMessage  # noqa
+from app.models.queue_message import QueueMessage  # noqa
 # Import all models here for Alembic
 from app.models.user import User  # noqa
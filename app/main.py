@@ -1,21 +1,56 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy import create_engine
 from app.api.v1.api import api_router
 from app.core.config import settings
+from app.core.log import configure_logging
+from app.core.metrics import MetricsMiddleware
+from app.core.security import shutdown_executor
 from app.db.base import Base
-from app.db.session import engine
+from app.db.session import SessionLocal, engine
+from app.queue.backends import get_queue_backend
+from app.queue.events import status_events
+from app.queue.outbox import relay
+from app.scheduler.embedded import EmbeddedScheduler
+from app.scheduler.usage import backfill_cluster_usage
 from dotenv import load_dotenv
 import os
 
 # Load environment variables
 load_dotenv()
+configure_logging()
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Seed usage counters for clusters created before they existed
+with SessionLocal() as db:
+    backfill_cluster_usage(db)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Publish queued deployment tasks from a background thread
+    if settings.OUTBOX_RELAY_IN_API:
+        relay.start()
+    # With the in-process queue backend, deployments are scheduled right here
+    scheduler = EmbeddedScheduler().start() if get_queue_backend().in_process else None
+    # Receive the workers' deployment status changes for the status stream
+    status_events.listen()
+    yield
+    status_events.stop()
+    if scheduler is not None:
+        scheduler.stop()
+    relay.stop()
+    shutdown_executor()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Cluster Management API",
     description="Technical Assessment API for managing organizations, clusters, and deployments.",
     version="1.0.0",
@@ -35,6 +70,8 @@ app.add_middleware(
     session_cookie=os.getenv("SESSION_COOKIE_NAME"),
     max_age=int(os.getenv("SESSION_MAX_AGE")),
 )
+# Outermost, so the latency covers the other middleware too
+app.add_middleware(MetricsMiddleware)
 
 # Include API router
 app.include_router(api_router, prefix="/api/v1")
@@ -45,6 +82,11 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -9,7 +9,7 @@ from app.models.organization import Organization
 class Cluster(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    organization_id = Column(Integer, ForeignKey("organization.id"))
+    organization_id = Column(Integer, ForeignKey("organization.id"), index=True)
 
     # Resource limits
     cpu_limit = Column(Float)
@@ -20,7 +20,11 @@ class Cluster(Base):
     cpu_available = Column(Float)
     ram_available = Column(Float)
     gpu_available = Column(Float)
+    # Row version, bumped by every reservation and release as well as by ORM writes
+    version = Column(Integer, nullable=False, server_default="1")
 
     # Relationships
     organization = relationship("Organization", back_populates="clusters")
     deployments = relationship("Deployment", back_populates="cluster")
+
+    __mapper_args__ = {"version_id_col": version}
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Enum, Float, ForeignKey, Integer
+
+from app.db.base_class import Base
+from app.models.deployment import DeploymentStatus
+
+
+class ClusterUsage(Base):
+    """
+    Running totals of a cluster's deployments in one status.
+
+    One row per (cluster, status), created with the cluster and moved by
+    delta UPDATEs on every status transition (see app.scheduler.usage), so
+    reading a cluster's utilization never aggregates ``Deployment`` rows.
+    """
+
+    cluster_id = Column(Integer, ForeignKey("cluster.id"), primary_key=True)
+    status = Column(Enum(DeploymentStatus), primary_key=True)
+    deployments = Column(Integer, nullable=False, default=0)
+
+    # Summed resource requirements
+    cpu = Column(Float, nullable=False, default=0)
+    ram = Column(Float, nullable=False, default=0)
+    gpu = Column(Float, nullable=False, default=0)
@@ -1,6 +1,7 @@
 import enum
+from datetime import datetime
 
-from sqlalchemy import Column, Enum, Float, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -11,6 +12,8 @@ class DeploymentStatus(enum.Enum):
     RUNNING = "running"
     FAILED = "failed"
     COMPLETED = "completed"
+    # Ended by the user; its resources went back to the cluster
+    TERMINATED = "terminated"
 
 
 class Deployment(Base):
@@ -20,11 +23,38 @@ class Deployment(Base):
     docker_image = Column(String)
     status = Column(Enum(DeploymentStatus))
     priority = Column(Integer, default=0)
-
-    # Resource requirements
+    # Scheduling attempts that found no room; matched against the task message
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Bumped by every write; ORM flushes compare-and-swap on it, so a status
+    # change made from a stale read fails instead of overwriting a newer one
+    version = Column(Integer, nullable=False, server_default="1")
+
+    # Resource requirements, per replica
     cpu_required = Column(Float)
     ram_required = Column(Float)
     gpu_required = Column(Float)
+    # Replicas are placed together on the cluster, all or nothing
+    replicas = Column(Integer, nullable=False, default=1, server_default="1")
 
     # Relationships
     cluster = relationship("Cluster", back_populates="deployments")
+
+    __table_args__ = (
+        # Preemption looks up a cluster's running deployments below a priority
+        Index("ix_deployment_cluster_status_priority", cluster_id, status, priority),
+        # Keyset pages of a cluster's deployments
+        Index("ix_deployment_cluster_id_id", cluster_id, id),
+        # Pending work per cluster in scheduling order; only PENDING rows are indexed
+        Index(
+            "ix_deployment_pending",
+            cluster_id,
+            priority,
+            created_at,
+            id,
+            postgresql_where=status == DeploymentStatus.PENDING,
+            sqlite_where=status == DeploymentStatus.PENDING,
+        ),
+    )
+
+    __mapper_args__ = {"version_id_col": version}
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+from app.db.base_class import Base
+
+
+class OutboxMessage(Base):
+    """
+    Deployment task waiting to be published to the broker.
+
+    Written in the same transaction as its deployment and published later by
+    the outbox relay, which deletes it once the broker has taken it, so the
+    table only ever holds unsent messages.
+    ``event`` is None for scheduling tasks; otherwise the message announces
+    an event about the deployment (see app.queue.topology).
+    """
+
+    id = Column(Integer, primary_key=True, index=True)
+    deployment_id = Column(Integer, ForeignKey("deployment.id"))
+    priority = Column(Integer, default=0)
+    event = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text
+
+from app.db.base_class import Base
+
+
+class QueueMessage(Base):
+    """
+    Task message of the table queue backend (app.queue.backends.TableQueueBackend).
+
+    A message is ready once ``available_at`` has passed. Claiming it pushes
+    ``available_at`` out by the lease, acking deletes it, and a retry is a new
+    row that becomes available after the retry delay. ``priority`` follows
+    the deployment priority: lower numbers are delivered first.
+    """
+
+    id = Column(Integer, primary_key=True, index=True)
+    queue = Column(String, nullable=False)
+    priority = Column(Integer, nullable=False, default=0)
+    body = Column(Text, nullable=False)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # When the message first became available; the queue lag is measured from it
+    enqueued_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Consumers claim the most urgent ready messages of one queue
+    __table_args__ = (Index("ix_queuemessage_ready", "queue", "priority", "id"),)
@@ -0,0 +1,576 @@
+"""
+Queue backends carrying deployment task messages to the scheduler.
+
+The outbox relay publishes through a backend and ``worker.main`` consumes
+through one; QUEUE_BACKEND picks which. Whatever the backend, the consumer
+sees the same channel interface as with RabbitMQ: deliveries of
+``(method, properties, body)`` and ``basic_ack`` / ``basic_nack`` /
+``basic_publish``, including the retry and dead-letter routing keys of
+app.queue.topology.
+"""
+import fcntl
+import functools
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pika
+from pika.exceptions import AMQPError
+from pika.spec import Basic
+from sqlalchemy import delete, func, insert, select, update
+
+from app.core.config import settings
+from app.core.metrics import PUBLISHED_AT_HEADER, PUBLISHED_MESSAGES, QUEUE_DEPTH
+from app.db.session import SessionLocal
+from app.models.deployment import Deployment, DeploymentStatus
+from app.models.queue_message import QueueMessage
+from app.queue.local import PriorityTaskQueue
+from app.queue.producer import publisher as default_publisher
+from app.queue.topology import (
+    DEPLOYMENT_EVENTS,
+    DEPLOYMENT_QUEUE,
+    declare_events_exchange,
+    is_dead_letter_queue,
+    retry_queue_delay_ms,
+)
+
+logger = logging.getLogger(__name__)
+
+# Longest an idle in-process consumer waits before checking for retries and stop()
+_IDLE_WAIT_SECONDS = 0.5
+# Wait before reconnecting a lost status events listener
+_RECONNECT_SECONDS = 1
+# Status event rows of the table backend are deleted after this long
+_EVENT_RETENTION = timedelta(minutes=5)
+
+
+class QueueBackend:
+    """
+    Transport of deployment task messages between the API and the scheduler.
+
+    ``publish_many`` takes message dicts (``deployment_id``, ``priority`` and
+    optionally ``event`` / ``attempt``). ``consume`` feeds a consumer
+    (``RabbitMQConsumer``) until ``stop`` is called. ``in_process`` backends
+    run the scheduler inside the publishing process, so the API hands them
+    messages directly instead of going through the outbox.
+
+    ``publish_events`` and ``consume_events`` carry deployment status changes
+    (see app.queue.events) from every process to every API process, until
+    ``stop_events`` is called. ``in_process`` backends do not need them.
+
+    ``heartbeat`` keeps an idle publishing connection alive; publishers that
+    can wait a long time between batches call it while they wait.
+    """
+
+    name = None
+    in_process = False
+
+    def publish_many(self, messages):
+        raise NotImplementedError
+
+    def consume(self, consumer):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def publish_events(self, events):
+        raise NotImplementedError
+
+    def consume_events(self, callback):
+        raise NotImplementedError
+
+    def stop_events(self):
+        pass
+
+    def heartbeat(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RabbitMQBackend(QueueBackend):
+    """
+    The RabbitMQ broker: durable priority queue, TTL retry queues and a
+    dead-letter queue (see app.queue.topology).
+    """
+
+    name = "rabbitmq"
+
+    def __init__(self, publisher=None):
+        self.publisher = publisher or default_publisher
+        self._consumer = None
+        self._events_stopped = threading.Event()
+
+    def publish_many(self, messages):
+        self.publisher.publish_many(messages)
+
+    def consume(self, consumer):
+        self._consumer = consumer
+        consumer.start_consuming()
+
+    def stop(self):
+        if self._consumer is not None:
+            self._consumer.stop()
+
+    def publish_events(self, events):
+        self.publisher.publish_events(events)
+
+    def consume_events(self, callback):
+        """
+        Pass every message of the DEPLOYMENT_EVENTS exchange to ``callback``.
+
+        Each call binds its own exclusive queue, so every API process gets
+        every event. A lost connection is reopened; events published while it
+        was down are missed.
+        """
+        self._events_stopped.clear()
+        while not self._events_stopped.is_set():
+            try:
+                connection = pika.BlockingConnection(pika.ConnectionParameters(self.publisher.host))
+            except AMQPError:
+                logger.warning("Cannot connect to the deployment events exchange; retrying")
+                self._events_stopped.wait(_RECONNECT_SECONDS)
+                continue
+            try:
+                channel = connection.channel()
+                declare_events_exchange(channel)
+                queue = channel.queue_declare(queue="", exclusive=True).method.queue
+                channel.queue_bind(queue=queue, exchange=DEPLOYMENT_EVENTS)
+                for method, properties, body in channel.consume(
+                    queue, auto_ack=True, inactivity_timeout=_IDLE_WAIT_SECONDS
+                ):
+                    if self._events_stopped.is_set():
+                        break
+                    if body is not None:
+                        callback(json.loads(body))
+            except AMQPError:
+                logger.warning("Lost the deployment events connection; reconnecting", exc_info=True)
+            finally:
+                if connection.is_open:
+                    connection.close()
+
+    def stop_events(self):
+        self._events_stopped.set()
+
+    def heartbeat(self):
+        self.publisher.heartbeat()
+
+    def close(self):
+        self.publisher.close()
+
+
+class InProcessBackend(QueueBackend):
+    """
+    In-memory priority queue consumed by a scheduler thread of the same process.
+
+    Publishing is a heap push, so a deployment reaches the scheduler with no
+    broker or database round trip. Retries wait in a delay heap for their
+    backoff; dead-lettered messages are dropped (the deployment is already
+    FAILED), and messages nacked with ``requeue`` go back to the queue.
+    Nothing survives a restart, so ``recover`` re-queues the deployments
+    still PENDING in the database; the embedded scheduler
+    (app.scheduler.embedded) calls it on startup.
+
+    Only for a single API process: the queue, its retries and the status
+    events live in that process's memory, so a second one would schedule
+    the same deployments and its stream clients would miss the first one's
+    changes. ``recover`` takes QUEUE_INPROCESS_LOCK_FILE for the life of
+    the process and refuses to run while another process holds it.
+    """
+
+    name = "inprocess"
+    in_process = True
+
+    def __init__(self, session_factory=SessionLocal, lock_file=None):
+        self.session_factory = session_factory
+        self.lock_file = lock_file or settings.QUEUE_INPROCESS_LOCK_FILE
+        self._lock = None
+        self.tasks = PriorityTaskQueue()
+        self._delayed = []  # heap of (due, sequence, priority, message)
+        self._delayed_lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._tags = itertools.count(1)
+        self._unacked = {}  # delivery tag -> task, in delivery order
+        self._stopped = threading.Event()
+
+    def publish_many(self, messages):
+        published_at = time.time()
+        for message in messages:
+            priority = message.get("priority") or 0
+            self.tasks.put((json.dumps(message), published_at), priority=priority)
+        PUBLISHED_MESSAGES.inc(len(messages))
+
+    def consume(self, consumer):
+        """
+        Schedule whatever is queued, up to ``consumer.batch_size`` messages
+        per pass, until ``stop`` is called.
+
+        Passes do not wait for a batch to fill: a lone message is scheduled
+        as soon as it arrives, and a backlog goes through in batches with
+        one commit each.
+        """
+        with self.session_factory() as db:
+            consumer.capacity.load(db)
+        while not self._stopped.is_set():
+            deliveries = self.get_deliveries(consumer.batch_size)
+            if len(deliveries) > 1:
+                consumer.process_batch(self, deliveries)
+            elif deliveries:
+                consumer.process_deployment(self, *deliveries[0])
+
+    def stop(self):
+        self._stopped.set()
+
+    def get_deliveries(self, limit):
+        """
+        Take up to ``limit`` messages, most urgent first, as deliveries.
+
+        Waits a moment for the first one (returning [] if none arrives), then
+        takes whatever is queued behind it without waiting further.
+        """
+        tasks = self.tasks.get_batch(limit, self._release_due())
+        QUEUE_DEPTH.set(len(self.tasks))
+        return [self._delivery(task) for task in tasks]
+
+    def recover(self):
+        """
+        Take the in-process queue's lock and re-queue the deployments still
+        PENDING in the database; return how many were queued.
+
+        Raises RuntimeError if another process holds QUEUE_INPROCESS_LOCK_FILE.
+        """
+        if not self._take_lock():
+            raise RuntimeError(
+                f"QUEUE_BACKEND={self.name} runs in a single API process, and another "
+                f"one holds {self.lock_file}; run one API process or use another backend"
+            )
+        with self.session_factory() as db:
+            rows = (
+                db.query(Deployment.id, Deployment.priority, Deployment.attempts)
+                .filter(Deployment.status == DeploymentStatus.PENDING)
+                .order_by(Deployment.priority, Deployment.created_at, Deployment.id)
+                .all()
+            )
+        self.publish_many(
+            [
+                {"deployment_id": row.id, "priority": row.priority, "attempt": row.attempts}
+                for row in rows
+            ]
+        )
+        logger.info("Re-queued pending deployments", extra={"deployments": len(rows)})
+        return len(rows)
+
+    def close(self):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def _take_lock(self):
+        if self._lock is not None:
+            return True
+        lock = open(self.lock_file, "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self._lock = lock
+        return True
+
+    # Channel interface used by the consumer
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if is_dead_letter_queue(routing_key):
+            return
+        priority = json.loads(body).get("priority") or 0
+        delay = (retry_queue_delay_ms(routing_key) or 0) / 1000
+        if not delay:
+            self.tasks.put((body, time.time()), priority=priority)
+            return
+        # The lag of a retry counts from when it falls due
+        task = (body, time.time() + delay)
+        with self._delayed_lock:
+            heapq.heappush(
+                self._delayed, (time.monotonic() + delay, next(self._sequence), priority, task)
+            )
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self._settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        tasks = self._settle(delivery_tag, multiple)
+        if requeue:
+            for body, published_at in tasks:
+                self.tasks.put((body, published_at), priority=json.loads(body).get("priority") or 0)
+
+    def _settle(self, delivery_tag, multiple):
+        if not multiple:
+            return [self._unacked.pop(delivery_tag)]
+        tags = [tag for tag in self._unacked if tag <= delivery_tag]
+        return [self._unacked.pop(tag) for tag in tags]
+
+    def _release_due(self):
+        """
+        Move the retries whose backoff has passed to the queue; return how
+        long to wait for the next message.
+        """
+        now = time.monotonic()
+        with self._delayed_lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, priority, task = heapq.heappop(self._delayed)
+                self.tasks.put(task, priority=priority)
+            if self._delayed:
+                return min(_IDLE_WAIT_SECONDS, self._delayed[0][0] - now)
+        return _IDLE_WAIT_SECONDS
+
+    def _delivery(self, task):
+        body, published_at = task
+        delivery_tag = next(self._tags)
+        self._unacked[delivery_tag] = task
+        properties = pika.BasicProperties(headers={PUBLISHED_AT_HEADER: published_at})
+        return Basic.Deliver(delivery_tag=delivery_tag), properties, body
+
+
+class TableQueueBackend(QueueBackend):
+    """
+    A queue kept in the database (QueueMessage) instead of a broker.
+
+    Workers claim the most urgent ready messages with a conditional
+    ``UPDATE ... RETURNING`` over a ``FOR UPDATE SKIP LOCKED`` sub-select,
+    which pushes their ``available_at`` out by a lease. Concurrent workers
+    never block on each other's rows (PostgreSQL) and never claim the same
+    message twice (the condition on ``available_at``; SQLite has no row
+    locks). Acks delete the rows; a worker that dies leaves its messages to
+    be delivered again when the lease runs out. Retries are rows that become
+    available after their backoff; dead-lettered messages stay in the table
+    under the consumer's dead-letter queue name.
+    """
+
+    name = "table"
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        queue_name=DEPLOYMENT_QUEUE,
+        poll_interval_ms=None,
+        lease_seconds=None,
+    ):
+        self.session_factory = session_factory
+        self.queue_name = queue_name
+        self.poll_interval = (poll_interval_ms or settings.QUEUE_TABLE_POLL_INTERVAL_MS) / 1000
+        self.lease = timedelta(seconds=lease_seconds or settings.QUEUE_TABLE_LEASE_SECONDS)
+        self._unacked = {}  # claimed message id -> None, in delivery order
+        self._stopped = threading.Event()
+        self._events_stopped = threading.Event()
+
+    def publish_many(self, messages):
+        with self.session_factory() as db:
+            self._insert(db, [(self.queue_name, message, datetime.utcnow()) for message in messages])
+            db.commit()
+        PUBLISHED_MESSAGES.inc(len(messages))
+
+    def consume(self, consumer):
+        with self.session_factory() as db:
+            consumer.capacity.load(db)
+        while not self._stopped.is_set():
+            deliveries = self.claim(max(consumer.batch_size, 1))
+            if not deliveries:
+                self._stopped.wait(self.poll_interval)
+            elif consumer.batch_size > 1:
+                consumer.process_batch(self, deliveries)
+            else:
+                consumer.process_deployment(self, *deliveries[0])
+
+    def stop(self):
+        self._stopped.set()
+
+    def claim(self, limit):
+        """
+        Lease up to ``limit`` ready messages, most urgent first, and return
+        them as deliveries.
+        """
+        now = datetime.utcnow()
+        ready = (
+            select(QueueMessage.id)
+            .where(QueueMessage.queue == self.queue_name, QueueMessage.available_at <= now)
+            .order_by(QueueMessage.priority, QueueMessage.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        with self.session_factory() as db:
+            rows = db.execute(
+                update(QueueMessage)
+                .where(QueueMessage.id.in_(ready), QueueMessage.available_at <= now)
+                .values(available_at=now + self.lease)
+                .returning(
+                    QueueMessage.id,
+                    QueueMessage.priority,
+                    QueueMessage.body,
+                    QueueMessage.enqueued_at,
+                )
+            ).all()
+            db.commit()
+        # RETURNING order is unspecified
+        rows.sort(key=lambda row: (row.priority, row.id))
+        self._unacked.update(dict.fromkeys(row.id for row in rows))
+        return [
+            (
+                Basic.Deliver(delivery_tag=row.id),
+                pika.BasicProperties(
+                    headers={
+                        PUBLISHED_AT_HEADER: row.enqueued_at.replace(tzinfo=timezone.utc).timestamp()
+                    }
+                ),
+                row.body,
+            )
+            for row in rows
+        ]
+
+    def publish_events(self, events):
+        with self.session_factory() as db:
+            db.execute(
+                insert(QueueMessage).values(
+                    queue=DEPLOYMENT_EVENTS,
+                    priority=0,
+                    body=json.dumps(events),
+                    available_at=datetime.utcnow(),
+                    enqueued_at=datetime.utcnow(),
+                )
+            )
+            db.commit()
+
+    def consume_events(self, callback):
+        """
+        Pass every status event row written after the call to ``callback``.
+
+        Rows are read by id every poll interval and kept for a while, not
+        acked, so every API process sees all of them; each listener deletes
+        the rows older than the retention period as it goes. Best effort: a
+        row committed after one with a larger id was read is missed.
+        """
+        self._events_stopped.clear()
+        with self.session_factory() as db:
+            last_id = (
+                db.query(func.max(QueueMessage.id))
+                .filter(QueueMessage.queue == DEPLOYMENT_EVENTS)
+                .scalar()
+            ) or 0
+        pruned = time.monotonic()
+        while not self._events_stopped.wait(self.poll_interval):
+            with self.session_factory() as db:
+                rows = db.execute(
+                    select(QueueMessage.id, QueueMessage.body)
+                    .where(
+                        QueueMessage.queue == DEPLOYMENT_EVENTS,
+                        QueueMessage.priority == 0,
+                        QueueMessage.id > last_id,
+                    )
+                    .order_by(QueueMessage.id)
+                ).all()
+                if time.monotonic() - pruned > _EVENT_RETENTION.total_seconds():
+                    db.execute(
+                        delete(QueueMessage).where(
+                            QueueMessage.queue == DEPLOYMENT_EVENTS,
+                            QueueMessage.enqueued_at < datetime.utcnow() - _EVENT_RETENTION,
+                        )
+                    )
+                    db.commit()
+                    pruned = time.monotonic()
+            for row in rows:
+                callback(json.loads(row.body))
+                last_id = row.id
+
+    def stop_events(self):
+        self._events_stopped.set()
+
+    # Channel interface used by the consumer
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        message = json.loads(body)
+        delay_ms = retry_queue_delay_ms(routing_key)
+        if delay_ms is None:
+            queue, available_at = routing_key, datetime.utcnow()
+        else:
+            queue, available_at = self.queue_name, datetime.utcnow() + timedelta(milliseconds=delay_ms)
+        with self.session_factory() as db:
+            self._insert(db, [(queue, message, available_at)])
+            db.commit()
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self._settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        ids = self._settle(delivery_tag, multiple, delete_rows=not requeue)
+        if requeue and ids:
+            with self.session_factory() as db:
+                db.execute(
+                    update(QueueMessage)
+                    .where(QueueMessage.id.in_(ids))
+                    .values(available_at=datetime.utcnow())
+                )
+                db.commit()
+
+    def _settle(self, delivery_tag, multiple, delete_rows=True):
+        if multiple:
+            # Everything delivered up to and including the tag
+            ids = []
+            for message_id in self._unacked:
+                ids.append(message_id)
+                if message_id == delivery_tag:
+                    break
+        else:
+            ids = [delivery_tag]
+        for message_id in ids:
+            del self._unacked[message_id]
+        if delete_rows:
+            with self.session_factory() as db:
+                db.execute(delete(QueueMessage).where(QueueMessage.id.in_(ids)))
+                db.commit()
+        return ids
+
+    @staticmethod
+    def _insert(db, rows):
+        db.execute(
+            insert(QueueMessage),
+            [
+                {
+                    "queue": queue,
+                    "priority": message.get("priority") or 0,
+                    "body": json.dumps(message),
+                    "available_at": available_at,
+                    "enqueued_at": available_at,
+                }
+                for queue, message, available_at in rows
+            ],
+        )
+
+
+BACKENDS = {backend.name: backend for backend in (RabbitMQBackend, InProcessBackend, TableQueueBackend)}
+
+
+def get_backend(name=None):
+    """
+    Return a new backend called ``name`` (QUEUE_BACKEND by default).
+    """
+    name = name or settings.QUEUE_BACKEND
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown queue backend {name!r}; choose from {sorted(BACKENDS)}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_queue_backend():
+    """
+    Return the backend of this process (QUEUE_BACKEND), created on first use.
+
+    Importing the app does not open a broker connection or touch the
+    database; the first caller, typically the lifespan or a worker, does.
+    """
+    return get_backend()
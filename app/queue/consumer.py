@@ -1,17 +1,70 @@
+import itertools
 import json
+import logging
+import time
 
 import pika
+from sqlalchemy.orm.exc import StaleDataError
 
+from app.core.config import settings
+from app.core.metrics import (
+    PUBLISHED_AT_HEADER,
+    SCHEDULED_DEPLOYMENTS,
+    SCHEDULING_CONFLICTS,
+    SCHEDULING_SECONDS,
+    observe_queue_lag,
+)
 from app.db.session import SessionLocal
-from app.models.cluster import Cluster
 from app.models.deployment import Deployment, DeploymentStatus
+from app.queue.events import stage_status_events
+from app.queue.topology import (
+    CAPACITY_FREED,
+    DEPLOYMENT_QUEUE,
+    amqp_priority,
+    dead_letter_queue_name,
+    declare_deployment_queue,
+    declare_retry_queues,
+    retry_delay_ms,
+    retry_queue_name,
+)
+from app.scheduler.capacity import CapacityIndex
+from app.scheduler.pending import PendingIndex
 from app.scheduler.scheduler import Scheduler
+from app.scheduler.usage import record_transition
+
+logger = logging.getLogger(__name__)
 
 
 class RabbitMQConsumer:
-    def __init__(self, queue_name="deployment_queue", rabbitmq_url="localhost"):
+    def __init__(
+        self,
+        queue_name=DEPLOYMENT_QUEUE,
+        rabbitmq_url=None,
+        batch_size=None,
+        batch_timeout_ms=None,
+        prefetch_count=None,
+        max_retries=None,
+        conflict_retries=None,
+    ):
         self.queue_name = queue_name
-        self.rabbitmq_url = rabbitmq_url
+        self.dead_letter_queue = dead_letter_queue_name(queue_name)
+        self.rabbitmq_url = rabbitmq_url or settings.RABBITMQ_HOST
+        self.batch_size = batch_size or settings.SCHEDULER_BATCH_SIZE
+        self.batch_timeout_ms = batch_timeout_ms or settings.SCHEDULER_BATCH_TIMEOUT_MS
+        self.prefetch_count = prefetch_count or settings.WORKER_PREFETCH_COUNT
+        self.max_retries = (
+            settings.SCHEDULER_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.conflict_retries = (
+            settings.SCHEDULER_CONFLICT_RETRIES if conflict_retries is None else conflict_retries
+        )
+        # Cluster capacity kept in memory for the lifetime of the consumer
+        self.capacity = CapacityIndex()
+        # Deployments waiting for capacity, per cluster
+        self.pending = PendingIndex()
+        self._connection = None
+        self._channel = None
+        self._stopping = False
 
     def process_deployment(self, ch, method, properties, body):
         """
@@ -19,11 +72,22 @@ class RabbitMQConsumer:
         """
         try:
             # Parse the message body
-            data = json.loads(body)
+            try:
+                data = json.loads(body)
+            except ValueError:
+                logger.warning("Invalid message: not JSON")
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
             deployment_id = data.get("deployment_id")
 
             if not deployment_id:
-                print("Invalid message: Missing deployment_id.")
+                logger.warning("Invalid message: missing deployment_id")
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+
+            if data.get("event") == CAPACITY_FREED:
+                with SessionLocal() as db:
+                    self.on_capacity_freed(db, deployment_id)
                 ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
 
@@ -33,73 +97,501 @@ class RabbitMQConsumer:
                     db.query(Deployment).filter(Deployment.id == deployment_id).first()
                 )
                 if not deployment:
-                    print(f"Deployment {deployment_id} not found.")
+                    logger.warning("Deployment not found", extra={"deployment_id": deployment_id})
                     ch.basic_ack(delivery_tag=method.delivery_tag)
                     return
-
-                cluster = (
-                    db.query(Cluster)
-                    .filter(Cluster.id == deployment.cluster_id)
-                    .first()
-                )
-                if not cluster:
-                    print(f"Cluster not found for Deployment {deployment_id}.")
-                    self.mark_deployment_status(db, deployment, DeploymentStatus.FAILED)
+                if deployment.status != DeploymentStatus.PENDING:
+                    # The outbox delivers at least once; skip redelivered tasks
+                    logger.info(
+                        "Deployment already processed",
+                        extra={"deployment_id": deployment_id, "status": deployment.status.value},
+                    )
+                    ch.basic_ack(delivery_tag=method.delivery_tag)
+                    return
+                if data.get("attempt", 0) != deployment.attempts:
+                    # Superseded by a newer retry or a re-drive of the same deployment
                     ch.basic_ack(delivery_tag=method.delivery_tag)
                     return
 
                 # Schedule the deployment
-                scheduler = Scheduler(db)
-                if scheduler.schedule_deployment(deployment, cluster):
-                    print(f"Deployment {deployment_id} is now RUNNING.")
-                    self.execute_deployment(deployment)
-                    self.mark_deployment_status(
-                        db, deployment, DeploymentStatus.COMPLETED
-                    )
-                else:
-                    print(f"Deployment {deployment_id} could not be scheduled.")
-                    self.mark_deployment_status(db, deployment, DeploymentStatus.FAILED)
+                if not self.settle_deployment(ch, db, deployment):
+                    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                    return
 
                 # Acknowledge message after processing
                 ch.basic_ack(delivery_tag=method.delivery_tag)
 
-        except Exception as e:
-            print(f"Error processing deployment: {e}")
-            ch.basic_nack(
-                delivery_tag=method.delivery_tag, requeue=False
-            )  # Reject and do not requeue on failure
+        except Exception:
+            logger.exception("Error processing deployment")
+            # The deployment queue has no dead-letter exchange: a rejected
+            # message would be lost and its deployment left PENDING for good
+            self._retry_message(ch, method, body)
+        finally:
+            observe_queue_lag(properties)
+
+    def process_batch(self, ch, messages):
+        """
+        Schedule a batch of deployment messages together.
+
+        Deployments are loaded with one query, placed in a single
+        priority-ordered bin-packing pass and committed once. Deployments
+        that do not fit fall back to per-deployment preemption, then to a
+        delayed retry. A deployment whose scheduling fails is deferred like
+        an unschedulable one, without holding up the rest of the batch.
+
+        Messages are acknowledged once their deployment is settled: placed,
+        failed, or parked for a retry. When every message is, the batch is
+        acknowledged with a single multiple-ack; messages whose deployment
+        could not even be deferred go back to the queue.
+        """
+        last_tag = messages[-1][0].delivery_tag
+        unsettled = set()  # delivery tags to hand back to the queue
+        try:
+            attempts = {}  # deployment id -> attempts named by its messages
+            tags = {}  # deployment id -> delivery tags of its messages
+            released = []  # (deployment id, delivery tag) announcing freed capacity
+            for method, properties, body in messages:
+                data = json.loads(body)
+                deployment_id = data.get("deployment_id")
+                if not deployment_id:
+                    logger.warning("Invalid message: missing deployment_id")
+                elif data.get("event") == CAPACITY_FREED:
+                    released.append((deployment_id, method.delivery_tag))
+                else:
+                    attempts.setdefault(deployment_id, set()).add(data.get("attempt", 0))
+                    tags.setdefault(deployment_id, []).append(method.delivery_tag)
+
+            with SessionLocal() as db:
+                deployments = [
+                    deployment
+                    for deployment in db.query(Deployment).filter(
+                        Deployment.id.in_(attempts),
+                        Deployment.status == DeploymentStatus.PENDING,
+                    )
+                    # Skip messages superseded by a newer retry or re-drive
+                    if deployment.attempts in attempts[deployment.id]
+                ]
+                path = "preemption"
+                try:
+                    with SCHEDULING_SECONDS.labels(path="batch").time():
+                        placed, unplaced = self.place_batch(db, deployments)
+                except Exception as error:
+                    if isinstance(error, StaleDataError):
+                        # Each deployment gets its own conflict retries, then the retry queues
+                        logger.warning("Deployment batch kept conflicting; scheduling one by one")
+                    else:
+                        logger.exception("Error scheduling deployment batch; scheduling one by one")
+                    db.rollback()
+                    placed, path = [], "single"
+                    unplaced = self._still_pending(
+                        db, {deployment.id: deployment.attempts for deployment in deployments}
+                    )
+                logger.info(
+                    "Scheduled batch",
+                    extra={"placed": len(placed), "deployments": len(deployments)},
+                )
+
+                for deployment in unplaced:
+                    deployment_id = deployment.id
+                    if not self.settle_deployment(ch, db, deployment, path=path):
+                        unsettled.update(tags[deployment_id])
+
+                for deployment_id, delivery_tag in released:
+                    try:
+                        self.on_capacity_freed(db, deployment_id)
+                    except Exception:
+                        logger.exception(
+                            "Error admitting pending deployments",
+                            extra={"deployment_id": deployment_id},
+                        )
+                        db.rollback()
+                        unsettled.add(delivery_tag)
+
+        except Exception:
+            logger.exception("Error processing deployment batch")
+            unsettled = {method.delivery_tag for method, properties, body in messages}
+        finally:
+            for method, properties, body in messages:
+                observe_queue_lag(properties)
+
+        if not unsettled:
+            ch.basic_ack(delivery_tag=last_tag, multiple=True)
+            return
+        for method, properties, body in messages:
+            if method.delivery_tag in unsettled:
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            else:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def settle_deployment(self, ch, db, deployment, path="single"):
+        """
+        Place, fail or defer one deployment; return whether it is settled.
+
+        An error while scheduling it rolls its transaction back and defers
+        it, so a deployment that keeps failing ends in the dead-letter queue
+        after ``max_retries`` attempts instead of being retried forever.
+        Returns False only if it could not even be deferred.
+        """
+        deployment_id, attempt = deployment.id, deployment.attempts
+        try:
+            # Only hit the Cluster table when the index has not seen it yet
+            if not self.capacity.ensure(db, deployment.cluster_id):
+                self.fail_unknown_cluster(db, deployment)
+            else:
+                self.place_deployment(ch, db, deployment, path=path)
+            return True
+        except Exception:
+            logger.exception("Error scheduling deployment", extra={"deployment_id": deployment_id})
+            db.rollback()
+        try:
+            # Expired by the rollback, so these read the current row
+            if deployment.status == DeploymentStatus.PENDING and deployment.attempts == attempt:
+                self.defer_deployment(ch, db, deployment)
+            return True
+        except Exception:
+            logger.exception("Error deferring deployment", extra={"deployment_id": deployment_id})
+            db.rollback()
+            return False
+
+    def place_deployment(self, ch, db, deployment, path="single"):
+        """
+        Schedule one deployment, preempting lower-priority work if needed, or
+        defer it.
+
+        The reservation and the status change are committed together, and
+        the status write compares and swaps the deployment's version. If
+        another worker or the API changed the deployment since it was read,
+        the transaction is rolled back, only its cluster is re-read into the
+        capacity index, and the deployment is tried again as long as it is
+        still PENDING at the same attempt. After ``conflict_retries`` lost
+        conflicts it is deferred like an unschedulable deployment, so it
+        goes through the retry queues and, in the end, the dead-letter
+        queue. No row stays locked while the decision is taken.
+
+        The "preemption" path goes straight to preemption, for deployments a
+        batch pass already found no room for.
+        """
+        cluster_id, attempt = deployment.cluster_id, deployment.attempts
+        for retry in itertools.count():
+            try:
+                with SCHEDULING_SECONDS.labels(path=path).time():
+                    scheduler = Scheduler(db, self.capacity)
+                    if path == "preemption":
+                        scheduled = scheduler.preempt_deployments(deployment)
+                    else:
+                        scheduled = scheduler.schedule_deployment(deployment)
+                    if scheduled:
+                        self.execute_deployment(deployment)
+                        self.mark_deployment_status(db, deployment, DeploymentStatus.COMPLETED)
+                if not scheduled:
+                    self.defer_deployment(ch, db, deployment)
+                    return
+            except StaleDataError:
+                db.rollback()
+                self.capacity.refresh(db, cluster_id)
+                SCHEDULING_CONFLICTS.labels(path=path).inc()
+                # Expired by the rollback, so these read the current row
+                if deployment.status != DeploymentStatus.PENDING or deployment.attempts != attempt:
+                    logger.info(
+                        "Deployment changed concurrently; leaving it",
+                        extra={"deployment_id": deployment.id, "status": deployment.status.value},
+                    )
+                    return
+                if retry >= self.conflict_retries:
+                    logger.warning(
+                        "Deployment kept changing concurrently; retrying later",
+                        extra={"deployment_id": deployment.id, "conflicts": retry + 1},
+                    )
+                    self.defer_deployment(ch, db, deployment)
+                    return
+                continue
+            except Exception:
+                # The index may hold a reservation that was just rolled back
+                db.rollback()
+                self.capacity.refresh(db, cluster_id)
+                raise
+            SCHEDULED_DEPLOYMENTS.labels(outcome="placed").inc()
+            logger.info("Deployment scheduled", extra={"deployment_id": deployment.id})
+            return
+
+    def place_batch(self, db, deployments):
+        """
+        Place ``deployments`` in one bin-packing pass and commit them COMPLETED.
+
+        A version conflict on any of them rolls the pass back (see
+        ``complete_placed``); it is then run again over the deployments still
+        PENDING at the attempt they were read at. Returns the placed and
+        unplaced deployments. Raises StaleDataError after
+        ``conflict_retries`` lost conflicts; the caller then places the
+        deployments one by one.
+        """
+        attempts = {deployment.id: deployment.attempts for deployment in deployments}
+        for retry in itertools.count():
+            placed, unplaced = Scheduler(db, self.capacity).schedule_batch(deployments)
+            try:
+                self.complete_placed(db, placed)
+                return placed, unplaced
+            except StaleDataError:
+                SCHEDULING_CONFLICTS.labels(path="batch").inc()
+                if retry >= self.conflict_retries:
+                    raise
+                deployments = self._still_pending(db, attempts)
 
     def mark_deployment_status(self, db, deployment, status):
         """
-        Update the status of a deployment and commit the change.
+        Update the status of a deployment and its cluster's usage counters,
+        and commit the change. Stream subscribers hear of it after the commit.
         """
+        record_transition(db, [deployment], deployment.status, status)
+        stage_status_events(db, [deployment], status)
         deployment.status = status
         db.commit()
 
+    def defer_deployment(self, ch, db, deployment):
+        """
+        Park an unschedulable deployment and retry it after a backoff.
+
+        The deployment stays PENDING and its task is published to the delay
+        queue of the next backoff step, which dead-letters it back onto the
+        deployment queue once the delay expires. ``Deployment.attempts`` is
+        bumped so that older messages for the same deployment are ignored.
+        A parked deployment is also admitted early when its cluster frees
+        capacity (see ``on_capacity_freed``).
+        After ``max_retries`` attempts the task goes to the dead-letter queue
+        and the deployment is marked FAILED.
+        """
+        attempt = deployment.attempts
+        if attempt >= self.max_retries:
+            self.mark_deployment_status(db, deployment, DeploymentStatus.FAILED)
+            self._publish(ch, self.dead_letter_queue, deployment, reason="unschedulable")
+            SCHEDULED_DEPLOYMENTS.labels(outcome="dead_lettered").inc()
+            logger.warning(
+                "Deployment could not be scheduled; giving up",
+                extra={"deployment_id": deployment.id, "attempts": attempt},
+            )
+            return
+
+        delay_ms = retry_delay_ms(attempt)
+        deployment.attempts = attempt + 1
+        db.commit()
+        # The lag of a retry counts from when it falls due, not from now
+        self._publish(
+            ch, retry_queue_name(delay_ms, self.queue_name), deployment, due_in=delay_ms / 1000
+        )
+        SCHEDULED_DEPLOYMENTS.labels(outcome="deferred").inc()
+        logger.info(
+            "Deployment could not be scheduled; retrying later",
+            extra={"deployment_id": deployment.id, "attempt": attempt + 1, "delay_ms": delay_ms},
+        )
+
+    def fail_unknown_cluster(self, db, deployment):
+        self.mark_deployment_status(db, deployment, DeploymentStatus.FAILED)
+        SCHEDULED_DEPLOYMENTS.labels(outcome="failed").inc()
+        logger.warning(
+            "Cluster not found",
+            extra={"deployment_id": deployment.id, "cluster_id": deployment.cluster_id},
+        )
+
+    def on_capacity_freed(self, db, deployment_id):
+        """
+        Admit the pending deployments that fit the room a released deployment left.
+
+        The cluster's queue is reloaded from the database, since other
+        workers park and place deployments too, and every deployment that now
+        fits is placed in one pass and committed together. After
+        ``conflict_retries`` lost conflicts the admission is dropped: the
+        parked deployments still have their retry messages, which take them
+        through the retry queues and, in the end, the dead-letter queue.
+        """
+        released = db.get(Deployment, deployment_id)
+        if released is None or not self.capacity.refresh(db, released.cluster_id):
+            return
+        cluster_id = released.cluster_id
+        with SCHEDULING_SECONDS.labels(path="admission").time():
+            for retry in itertools.count():
+                self.pending.load(db, cluster_id)
+                placed = Scheduler(db, self.capacity).admit_pending(cluster_id, self.pending)
+                try:
+                    self.complete_placed(db, placed)
+                    break
+                except StaleDataError:
+                    SCHEDULING_CONFLICTS.labels(path="admission").inc()
+                    if retry >= self.conflict_retries:
+                        logger.warning(
+                            "Pending deployments kept changing concurrently; leaving them to their retries",
+                            extra={"cluster_id": cluster_id, "conflicts": retry + 1},
+                        )
+                        return
+        logger.info(
+            "Capacity freed; admitted pending deployments",
+            extra={"cluster_id": cluster_id, "placed": len(placed)},
+        )
+
+    def complete_placed(self, db, placed):
+        """
+        Run the placed deployments and commit them as COMPLETED in one transaction.
+
+        Each status write compares and swaps the deployment's version, so the
+        commit raises StaleDataError when any of them changed concurrently.
+        On failure everything is rolled back and the clusters of the placed
+        deployments are re-read into the capacity index.
+        """
+        cluster_ids = {deployment.cluster_id for deployment in placed}
+        for deployment in placed:
+            self.execute_deployment(deployment)
+            deployment.status = DeploymentStatus.COMPLETED
+        record_transition(db, placed, DeploymentStatus.PENDING, DeploymentStatus.COMPLETED)
+        stage_status_events(db, placed, DeploymentStatus.COMPLETED)
+        try:
+            db.commit()
+        except Exception:
+            # The index already holds the reservations
+            db.rollback()
+            for cluster_id in cluster_ids:
+                self.capacity.refresh(db, cluster_id)
+            raise
+        SCHEDULED_DEPLOYMENTS.labels(outcome="placed").inc(len(placed))
+
+    @staticmethod
+    def _still_pending(db, attempts):
+        """
+        Re-read the deployments of ``attempts`` (id -> attempt) and return
+        those still PENDING at that attempt.
+        """
+        return [
+            deployment
+            for deployment in db.query(Deployment).filter(
+                Deployment.id.in_(attempts),
+                Deployment.status == DeploymentStatus.PENDING,
+            )
+            if deployment.attempts == attempts[deployment.id]
+        ]
+
+    def _publish(self, ch, routing_key, deployment, due_in=0, **extra):
+        message = {
+            "deployment_id": deployment.id,
+            "priority": deployment.priority,
+            "attempt": deployment.attempts,
+            **extra,
+        }
+        ch.basic_publish(
+            exchange="",
+            routing_key=routing_key,
+            body=json.dumps(message),
+            properties=pika.BasicProperties(
+                delivery_mode=2,  # Make the message persistent
+                priority=amqp_priority(deployment.priority),
+                headers={PUBLISHED_AT_HEADER: time.time() + due_in},
+            ),
+        )
+
+    def _retry_message(self, ch, method, body):
+        """
+        Send a message that could not be processed back through the first
+        delay queue, then ack it; requeue it if even that fails.
+        """
+        delay_ms = retry_delay_ms(0)
+        try:
+            ch.basic_publish(
+                exchange="",
+                routing_key=retry_queue_name(delay_ms, self.queue_name),
+                body=body,
+                properties=pika.BasicProperties(
+                    delivery_mode=2,
+                    priority=amqp_priority(json.loads(body).get("priority")),
+                    headers={PUBLISHED_AT_HEADER: time.time() + delay_ms / 1000},
+                ),
+            )
+        except Exception:
+            logger.exception("Error retrying deployment message")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
     def execute_deployment(self, deployment):
         """
         Simulate deployment execution.
         Replace this method with actual deployment execution logic.
         """
-        print(f"Executing deployment {deployment.id}...")
+        logger.debug("Executing deployment", extra={"deployment_id": deployment.id})
 
     def start_consuming(self):
         """
         Start consuming messages from RabbitMQ queue.
+
+        Returns once ``stop`` was called and the message (or batch) in
+        progress has been acknowledged. Messages the broker had prefetched to
+        this consumer go back to the queue when the connection closes.
         """
         connection = pika.BlockingConnection(
             pika.ConnectionParameters(self.rabbitmq_url)
         )
         channel = connection.channel()
+        self._connection, self._channel = connection, channel
+
+        try:
+            # Warm the capacity index before the first message arrives
+            with SessionLocal() as db:
+                self.capacity.load(db)
 
-        # Declare the queue
-        channel.queue_declare(queue=self.queue_name, durable=True)
+            # Declare the queue (priority-aware, see app.queue.topology)
+            declare_deployment_queue(channel, self.queue_name)
+            declare_retry_queues(channel, self.queue_name, self.max_retries)
 
-        # Set up the consumer
-        channel.basic_qos(prefetch_count=1)  # Process one task at a time
-        channel.basic_consume(
-            queue=self.queue_name, on_message_callback=self.process_deployment
-        )
+            logger.info("Waiting for messages", extra={"queue": self.queue_name})
+            if self.batch_size > 1:
+                # Let the broker push at least a full batch ahead of the acks
+                channel.basic_qos(prefetch_count=max(self.prefetch_count, self.batch_size))
+                self.consume_batches(channel)
+                return
+
+            # Set up the consumer
+            channel.basic_qos(prefetch_count=self.prefetch_count)
+            channel.basic_consume(
+                queue=self.queue_name, on_message_callback=self.process_deployment
+            )
+            if not self._stopping:
+                channel.start_consuming()
+        finally:
+            self._connection = self._channel = None
+            if connection.is_open:
+                connection.close()
+
+    def stop(self):
+        """
+        Stop taking new messages; the message or batch in progress finishes first.
+
+        Safe to call from a signal handler or another thread.
+        """
+        self._stopping = True
+        connection, channel = self._connection, self._channel
+        if connection is not None and self.batch_size <= 1:
+            # Batch mode polls the flag between messages instead
+            connection.add_callback_threadsafe(channel.stop_consuming)
 
-        print(f" [*] Waiting for messages in queue: {self.queue_name}...")
-        channel.start_consuming()
+    def consume_batches(self, channel):
+        """
+        Drain up to ``batch_size`` messages, or whatever arrived within
+        ``batch_timeout_ms`` of the first one, and schedule them as a batch.
+        """
+        timeout = self.batch_timeout_ms / 1000
+        batch, deadline = [], None
+        for method, properties, body in channel.consume(
+            self.queue_name, inactivity_timeout=timeout
+        ):
+            if method is not None:
+                batch.append((method, properties, body))
+                if deadline is None:
+                    deadline = time.monotonic() + timeout
+            if batch and (
+                method is None
+                or len(batch) >= self.batch_size
+                or time.monotonic() >= deadline
+                or self._stopping
+            ):
+                self.process_batch(channel, batch)
+                batch, deadline = [], None
+            if self._stopping:
+                # Hand the prefetched messages back to the queue
+                channel.cancel()
+                return
@@ -0,0 +1,163 @@
+"""
+Deployment status changes, carried from whichever process commits them to
+the stream subscribers of every API process (``GET /deployments/events``).
+
+Code that changes deployment statuses stages the change on its session with
+``stage_status_events``. The change is published when that session commits
+and dropped when it rolls back, so subscribers never see a status the
+database does not hold. With the in-process queue backend the scheduler runs
+inside the API process and changes go straight to the listeners. Otherwise
+they travel through the queue backend (a RabbitMQ fanout exchange, or rows
+of the queue table) to every API process, which receives them with
+``StatusEvents.listen``.
+"""
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.queue.backends import get_queue_backend
+
+logger = logging.getLogger(__name__)
+
+# Session.info key of the changes waiting for the commit
+_STAGED = "staged_status_events"
+
+
+def status_event(deployment, status):
+    """
+    Return the event of ``deployment`` (a row or any object with ``id`` and
+    ``cluster_id``) moving to ``status``.
+    """
+    return {
+        "deployment_id": deployment.id,
+        "cluster_id": deployment.cluster_id,
+        "status": status.value,
+    }
+
+
+def stage_status_events(db, deployments, status):
+    """
+    Announce that ``deployments`` move to ``status`` once ``db`` commits.
+
+    Works on sync and async sessions alike.
+    """
+    session = getattr(db, "sync_session", db)
+    session.info.setdefault(_STAGED, []).extend(
+        status_event(deployment, status) for deployment in deployments
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_staged(session):
+    events = session.info.pop(_STAGED, None)
+    if events:
+        status_events.publish(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_staged(session):
+    session.info.pop(_STAGED, None)
+
+
+class StatusEvents:
+    """
+    Per-process hub of committed deployment status changes.
+
+    ``publish`` never waits on the queue backend: changes are handed to a
+    background thread, which sends whatever has accumulated in one message.
+    Delivery is best effort. A client that reconnects lists the deployments
+    once to catch up.
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._listeners = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sender = None
+        self._listener = None
+
+    @property
+    def backend(self):
+        # Resolved on first use, so the module-level hub does not create the backend
+        return self._backend or get_queue_backend()
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    def add_listener(self, listener):
+        """
+        Call ``listener(events)`` with every batch of changes this process receives.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def publish(self, events):
+        if self.backend.in_process:
+            self.deliver(events)
+            return
+        with self._lock:
+            self._pending.extend(events)
+            if self._sender is None:
+                self._sender = threading.Thread(
+                    target=self._run_sender, name="status-events", daemon=True
+                )
+                self._sender.start()
+        self._wakeup.set()
+
+    def deliver(self, events):
+        for listener in list(self._listeners):
+            try:
+                listener(events)
+            except Exception:
+                logger.exception("Status event listener failed")
+
+    def listen(self):
+        """
+        Receive the changes published by every process from a background thread.
+
+        For API processes; a no-op with an in-process backend, which runs in
+        a single API process, so every change is made where it is streamed.
+        """
+        if self.backend.in_process or self._listener is not None:
+            return self
+        self._listener = threading.Thread(
+            target=self.backend.consume_events,
+            args=(self.deliver,),
+            name="status-events-listener",
+            daemon=True,
+        )
+        self._listener.start()
+        return self
+
+    def stop(self, timeout=5):
+        if self._listener is not None:
+            self.backend.stop_events()
+            self._listener.join(timeout)
+            self._listener = None
+
+    def _run_sender(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                events, self._pending = self._pending, []
+            if not events:
+                continue
+            try:
+                self.backend.publish_events(events)
+            except Exception:
+                logger.warning(
+                    "Failed to publish deployment status events",
+                    exc_info=True,
+                    extra={"events": len(events)},
+                )
+
+
+status_events = StatusEvents()
@@ -0,0 +1,59 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class PriorityTaskQueue:
+    """
+    In-process priority queue for deployment messages.
+
+    A stand-in for the RabbitMQ priority queue in local runs and tests: the
+    lowest deployment priority number is served first and messages of equal
+    priority keep their FIFO order. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._not_empty = threading.Condition()
+
+    def __len__(self):
+        with self._not_empty:
+            return len(self._heap)
+
+    def put(self, message, priority=0):
+        with self._not_empty:
+            heapq.heappush(self._heap, (priority, next(self._sequence), message))
+            self._not_empty.notify()
+
+    def get(self, timeout=None):
+        """
+        Pop the most urgent message, waiting up to ``timeout`` seconds.
+
+        Returns None when the queue stays empty for the whole timeout.
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._heap, timeout):
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def get_batch(self, size, timeout=None):
+        """
+        Pop up to ``size`` messages in priority order.
+
+        Waits up to ``timeout`` seconds for the first message and then takes
+        whatever is already queued behind it, without waiting further.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        batch = []
+        with self._not_empty:
+            while len(batch) < size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not self._heap:
+                    if batch or (remaining is not None and remaining <= 0):
+                        break
+                    if not self._not_empty.wait_for(lambda: self._heap, remaining):
+                        break
+                batch.append(heapq.heappop(self._heap)[2])
+        return batch
@@ -0,0 +1,145 @@
+import logging
+import threading
+
+from pika.exceptions import AMQPError
+from sqlalchemy import delete, insert
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.outbox import OutboxMessage
+from app.queue.backends import get_queue_backend
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    """
+    Publish pending outbox rows to the queue backend in bulk.
+
+    Each pass claims up to ``batch_size`` rows (``FOR UPDATE SKIP LOCKED``
+    where the database supports it, so several relays can share the table),
+    publishes them in one committed batch and deletes them with a single
+    DELETE in the same transaction, so the table never grows beyond the
+    messages still to send. A crash between publishing and deleting means
+    the batch is published again, so delivery is at-least-once and consumers ignore
+    deployments that are no longer pending.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        publisher=None,
+        batch_size=None,
+        poll_interval_ms=None,
+    ):
+        self.session_factory = session_factory
+        self._publisher = publisher
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.poll_interval = (poll_interval_ms or settings.OUTBOX_POLL_INTERVAL_MS) / 1000
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def publisher(self):
+        # Resolved on first use, so the module-level relay does not create the backend
+        return self._publisher or get_queue_backend()
+
+    @publisher.setter
+    def publisher(self, publisher):
+        self._publisher = publisher
+
+    def relay_once(self):
+        """
+        Publish one batch of unsent messages and return how many were sent.
+        """
+        with self.session_factory() as db:
+            rows = (
+                db.query(
+                    OutboxMessage.id,
+                    OutboxMessage.deployment_id,
+                    OutboxMessage.priority,
+                    OutboxMessage.event,
+                )
+                .order_by(OutboxMessage.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not rows:
+                db.rollback()
+                return 0
+
+            self.publisher.publish_many([self.message(row) for row in rows])
+            db.execute(delete(OutboxMessage).where(OutboxMessage.id.in_([row.id for row in rows])))
+            db.commit()
+            return len(rows)
+
+    @staticmethod
+    def message(row):
+        message = {"deployment_id": row.deployment_id, "priority": row.priority}
+        if row.event is not None:
+            message["event"] = row.event
+        return message
+
+    def wake(self):
+        """
+        Ask the relay to run now instead of at its next poll.
+        """
+        self._wakeup.set()
+
+    def run(self):
+        """
+        Relay until ``stop()`` is called, draining full batches back to back.
+        """
+        while not self._stopped.is_set():
+            try:
+                sent = self.relay_once()
+                # The broker drops a publishing connection that stays silent
+                self.publisher.heartbeat()
+            except AMQPError as e:
+                logger.warning("Outbox relay could not reach the broker", extra={"error": str(e)})
+                sent = 0
+            except Exception:
+                logger.exception("Error relaying outbox messages")
+                sent = 0
+            if sent < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name="outbox-relay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+relay = OutboxRelay()
+
+
+async def stage_messages(db, messages):
+    """
+    Queue task messages in the caller's (async) transaction.
+
+    They are written to the outbox for the relay, unless the scheduler runs
+    in this process: then ``dispatch_messages`` hands them over directly.
+    """
+    if not get_queue_backend().in_process:
+        await db.execute(insert(OutboxMessage), messages)
+
+
+def dispatch_messages(messages):
+    """
+    Deliver messages staged by ``stage_messages`` once their transaction committed.
+    """
+    backend = get_queue_backend()
+    if backend.in_process:
+        backend.publish_many(messages)
+    else:
+        relay.wake()
@@ -1,28 +1,131 @@
+import atexit
 import json
+import threading
+import time
 
 import pika
+from pika.exceptions import AMQPError
 
+from app.core.config import settings
+from app.core.metrics import PUBLISHED_AT_HEADER, PUBLISHED_MESSAGES
+from app.queue.topology import (
+    DEPLOYMENT_EVENTS,
+    DEPLOYMENT_QUEUE,
+    amqp_priority,
+    declare_deployment_queue,
+    declare_events_exchange,
+)
 
-def publish_deployment_task(deployment_id: int, priority: int):
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters("localhost")
-    )  # Adjust RabbitMQ server URL
-    channel = connection.channel()
-
-    # Declare the queue (make sure it exists)
-    channel.queue_declare(queue="deployment_queue", durable=True)
-
-    # Message format
-    message = {"deployment_id": deployment_id, "priority": priority}
-
-    # Publish the message
-    channel.basic_publish(
-        exchange="",
-        routing_key="deployment_queue",
-        body=json.dumps(message),
-        properties=pika.BasicProperties(
-            delivery_mode=2,  # Make the message persistent
-        ),
-    )
-    print(f" [x] Sent deployment task for deployment_id: {deployment_id}")
-    connection.close()
+
+class DeploymentPublisher:
+    """
+    Long-lived, per-process publisher for deployment tasks.
+
+    One broker connection and transactional channel are opened lazily and
+    reused for every publish instead of a TCP + AMQP handshake per request.
+    A batch of messages is published and then committed at once, so the
+    broker acknowledges the batch in a single round trip rather than one
+    message at a time (pika's blocking channel waits for every publisher
+    confirm separately).
+    pika connections are not thread-safe, so all broker calls go through one
+    lock. A dropped connection is reopened and the publish retried once.
+
+    A blocking connection only answers broker heartbeats while it is used, so
+    an owner that can sit idle (the outbox relay) calls ``heartbeat`` between
+    publishes; otherwise the broker drops the connection.
+    """
+
+    def __init__(self, host=None):
+        self.host = host or settings.RABBITMQ_HOST
+        self._lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+
+    def publish_many(self, messages):
+        """
+        Publish ``messages`` on the shared channel, reconnecting once on failure.
+
+        The broker has taken all of them when this returns; none if it raises.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    channel = self._ensure_channel()
+                    # Consumers measure the queue lag from this timestamp
+                    headers = {PUBLISHED_AT_HEADER: time.time()}
+                    for message in messages:
+                        channel.basic_publish(
+                            exchange="",
+                            routing_key=DEPLOYMENT_QUEUE,
+                            body=json.dumps(message),
+                            properties=pika.BasicProperties(
+                                delivery_mode=2,  # Make the message persistent
+                                priority=amqp_priority(message.get("priority")),
+                                headers=headers,
+                            ),
+                        )
+                    # One round trip settles the whole batch
+                    channel.tx_commit()
+                    PUBLISHED_MESSAGES.inc(len(messages))
+                    return
+                except AMQPError:
+                    self._reset()
+                    if attempt:
+                        raise
+
+    def publish_events(self, events):
+        """
+        Publish deployment status ``events`` to the DEPLOYMENT_EVENTS fanout
+        exchange as one transient message, reconnecting once on failure.
+        """
+        body = json.dumps(events)
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    channel = self._ensure_channel()
+                    channel.basic_publish(exchange=DEPLOYMENT_EVENTS, routing_key="", body=body)
+                    channel.tx_commit()
+                    return
+                except AMQPError:
+                    self._reset()
+                    if attempt:
+                        raise
+
+    def heartbeat(self):
+        """
+        Answer the broker's heartbeats on an idle connection, if one is open.
+        """
+        with self._lock:
+            if self._connection is not None and self._connection.is_open:
+                try:
+                    self._connection.process_data_events(time_limit=0)
+                except AMQPError:
+                    self._reset()
+
+    def close(self):
+        with self._lock:
+            self._reset()
+
+    def _ensure_channel(self):
+        if self._channel is None or self._channel.is_closed or self._connection.is_closed:
+            self._reset()
+            self._connection = pika.BlockingConnection(pika.ConnectionParameters(self.host))
+            channel = self._connection.channel()
+            channel.tx_select()
+            # Declare the queue and the events exchange once per connection
+            declare_deployment_queue(channel)
+            declare_events_exchange(channel)
+            self._channel = channel
+        return self._channel
+
+    def _reset(self):
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except AMQPError:
+                pass
+
+
+publisher = DeploymentPublisher()
+atexit.register(publisher.close)
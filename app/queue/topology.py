@@ -0,0 +1,119 @@
+"""
+Queue names and declarations shared by the producer and the consumers.
+"""
+import re
+
+from app.core.config import settings
+
+DEPLOYMENT_QUEUE = "deployment_queue"
+
+# Event messages share the deployment queue with scheduling tasks. A deployment
+# released its resources: admit the pending work of its cluster that now fits.
+CAPACITY_FREED = "capacity_freed"
+
+# Fanout exchange (and, for the table backend, queue name) carrying committed
+# deployment status changes to every API process; see app.queue.events
+DEPLOYMENT_EVENTS = "deployment_events"
+
+# Number of AMQP priority levels on the deployment queue. RabbitMQ keeps one
+# sub-queue per level, so this stays small; deployment priorities beyond it
+# share the lowest level.
+MAX_PRIORITY = 10
+
+
+def amqp_priority(priority):
+    """
+    Map a deployment priority (0 is the most urgent) to an AMQP message
+    priority (higher is delivered first).
+    """
+    return MAX_PRIORITY - min(max(priority or 0, 0), MAX_PRIORITY)
+
+
+def declare_deployment_queue(channel, queue_name=DEPLOYMENT_QUEUE):
+    """
+    Declare the durable, priority-aware deployment queue.
+
+    The broker delivers higher ``amqp_priority`` messages first, so an urgent
+    deployment no longer waits behind a backlog of low-priority ones.
+    """
+    channel.queue_declare(
+        queue=queue_name,
+        durable=True,
+        arguments={"x-max-priority": MAX_PRIORITY},
+    )
+
+
+def declare_events_exchange(channel):
+    channel.exchange_declare(exchange=DEPLOYMENT_EVENTS, exchange_type="fanout", durable=True)
+
+
+def retry_delay_ms(attempt):
+    """
+    Backoff before retry number ``attempt`` (0-based): doubles each time, capped.
+    """
+    return min(
+        settings.SCHEDULER_RETRY_BASE_DELAY_MS * 2**attempt,
+        settings.SCHEDULER_RETRY_MAX_DELAY_MS,
+    )
+
+
+def retry_queue_name(delay_ms, queue_name=DEPLOYMENT_QUEUE):
+    return f"{queue_name}.retry.{delay_ms}ms"
+
+
+def dead_letter_queue_name(queue_name=DEPLOYMENT_QUEUE):
+    """
+    Queue of the deployments from ``queue_name`` that stayed unschedulable
+    after every retry.
+    """
+    return f"{queue_name}.dead"
+
+
+def is_dead_letter_queue(queue_name):
+    return queue_name.endswith(".dead")
+
+
+DEAD_LETTER_QUEUE = dead_letter_queue_name()
+
+
+_RETRY_QUEUE = re.compile(r"\.retry\.(\d+)ms$")
+
+
+def retry_queue_delay_ms(queue_name):
+    """
+    Delay of the retry queue called ``queue_name``, or None for any other queue.
+
+    Lets the backends without TTL queues (app.queue.backends) honour the
+    delay the consumer chose by routing key.
+    """
+    match = _RETRY_QUEUE.search(queue_name)
+    return int(match.group(1)) if match else None
+
+
+def declare_retry_queues(channel, queue_name=DEPLOYMENT_QUEUE, max_retries=None):
+    """
+    Declare one delay queue per backoff step of a consumer of ``queue_name``
+    that retries ``max_retries`` times (SCHEDULER_MAX_RETRIES by default),
+    plus that queue's dead-letter queue.
+
+    A delay queue has no consumers: its messages expire after the queue's
+    fixed TTL and are dead-lettered back onto ``queue_name``. Using one queue
+    per delay (rather than per-message TTLs) keeps every queue FIFO by expiry,
+    so a long delay never holds up a short one. Queues are named after their
+    delay, so changing the backoff settings declares new queues instead of
+    clashing with the arguments of existing ones.
+    """
+    if max_retries is None:
+        max_retries = settings.SCHEDULER_MAX_RETRIES
+    # Capped steps share a delay, and so a queue
+    for delay_ms in sorted({retry_delay_ms(attempt) for attempt in range(max_retries)}):
+        channel.queue_declare(
+            queue=retry_queue_name(delay_ms, queue_name),
+            durable=True,
+            arguments={
+                "x-message-ttl": delay_ms,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue_name,
+            },
+        )
+    channel.queue_declare(queue=dead_letter_queue_name(queue_name), durable=True)
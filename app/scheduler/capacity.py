@@ -0,0 +1,149 @@
+import numpy as np
+
+from app.models.cluster import Cluster
+
+# Column order of every resource vector handled by the index.
+RESOURCES = ("cpu", "ram", "gpu")
+
+# Cluster columns read into the index: id, then availability
+_COLUMNS = (
+    Cluster.id,
+    Cluster.cpu_available,
+    Cluster.ram_available,
+    Cluster.gpu_available,
+)
+
+
+def demand_of(deployment):
+    """
+    Return the (cpu, ram, gpu) a deployment needs as a numpy vector.
+
+    The requirements are per replica; all replicas are reserved together.
+    """
+    replicas = getattr(deployment, "replicas", None) or 1
+    return replicas * np.array(
+        (deployment.cpu_required, deployment.ram_required, deployment.gpu_required),
+        dtype=np.float64,
+    )
+
+
+class CapacityIndex:
+    """
+    In-memory index of the free CPU/RAM/GPU of every cluster.
+
+    Availability is stored as one row per cluster in a contiguous
+    ``(n, 3)`` float array, so fit checks are array comparisons instead of
+    database reads. The index mirrors
+    ``Cluster.*_available``: the scheduler writes each winning allocation back
+    to the table and stores the availability the database reports afterwards.
+    With several workers the index can go stale; it is only used to skip
+    hopeless reservations, and the database has the final word.
+    """
+
+    def __init__(self, initial_size=64):
+        self._slots = {}  # cluster id -> row in self._free
+        self._ids = np.zeros(initial_size, dtype=np.int64)
+        self._free = np.zeros((initial_size, len(RESOURCES)), dtype=np.float64)
+        self._size = 0
+
+    def __contains__(self, cluster_id):
+        return cluster_id in self._slots
+
+    def __len__(self):
+        return self._size
+
+    def load(self, db):
+        """
+        Rebuild the index from the ``Cluster`` table in a single query.
+        """
+        rows = db.query(*_COLUMNS).all()
+        self._slots.clear()
+        self._size = 0
+        for row in rows:
+            self.set(row[0], row[1:])
+        return self
+
+    def ensure(self, db, cluster_id):
+        """
+        Make sure ``cluster_id`` is indexed, loading its row on a miss.
+
+        Returns False when the cluster does not exist.
+        """
+        if cluster_id in self._slots:
+            return True
+        row = db.query(*_COLUMNS).filter(Cluster.id == cluster_id).first()
+        if row is None:
+            return False
+        self.set(row[0], row[1:])
+        return True
+
+    def refresh(self, db, cluster_id):
+        """
+        Re-read one cluster's availability, e.g. after losing a reservation race.
+        """
+        self.discard(cluster_id)
+        return self.ensure(db, cluster_id)
+
+    def ensure_many(self, db, cluster_ids):
+        """
+        Load every missing cluster of ``cluster_ids`` in a single query.
+
+        Returns the set of ids that are indexed afterwards.
+        """
+        missing = {cluster_id for cluster_id in cluster_ids if cluster_id not in self._slots}
+        if missing:
+            for row in db.query(*_COLUMNS).filter(Cluster.id.in_(missing)):
+                self.set(row[0], row[1:])
+        return {cluster_id for cluster_id in cluster_ids if cluster_id in self._slots}
+
+    def sync(self, cluster):
+        """
+        Copy the availability of an already loaded ``Cluster`` row into the index.
+        """
+        self.set(cluster.id, (cluster.cpu_available, cluster.ram_available, cluster.gpu_available))
+
+    def set(self, cluster_id, available):
+        """
+        Store a cluster's availability.
+        """
+        slot = self._slots.get(cluster_id)
+        if slot is None:
+            slot = self._grow()
+            self._slots[cluster_id] = slot
+            self._ids[slot] = cluster_id
+        self._free[slot] = available
+
+    def discard(self, cluster_id):
+        """
+        Drop a cluster from the index, keeping the rows contiguous.
+        """
+        slot = self._slots.pop(cluster_id, None)
+        if slot is None:
+            return
+        last = self._size - 1
+        if slot != last:
+            moved = int(self._ids[last])
+            self._ids[slot] = moved
+            self._free[slot] = self._free[last]
+            self._slots[moved] = slot
+        self._size = last
+
+    def available(self, cluster_id):
+        """
+        Return a copy of the free (cpu, ram, gpu) vector of a cluster.
+        """
+        return self._free[self._slots[cluster_id]].copy()
+
+    def fits(self, cluster_id, demand):
+        return bool((self._free[self._slots[cluster_id]] >= demand).all())
+
+    def _grow(self):
+        if self._size == len(self._ids):
+            capacity = max(1, 2 * len(self._ids))
+            self._ids = np.resize(self._ids, capacity)
+            free = np.zeros((capacity, len(RESOURCES)), dtype=np.float64)
+            free[: self._size] = self._free[: self._size]
+            self._free = free
+        slot = self._size
+        self._size += 1
+        return slot
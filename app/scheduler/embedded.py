@@ -0,0 +1,49 @@
+import threading
+
+from app.core.config import settings
+from app.queue.backends import get_queue_backend
+from app.queue.consumer import RabbitMQConsumer
+
+
+class EmbeddedScheduler:
+    """
+    Scheduler loop running inside the API process (QUEUE_BACKEND=inprocess).
+
+    Endpoints hand their tasks to the in-process queue right after the
+    commit, and a single thread schedules them with a capacity index that
+    stays loaded for the life of the process. The backend admits a single
+    API process (see InProcessBackend), so that thread is the only writer
+    of scheduling decisions and reservations never contend with other
+    consumers for the cluster rows. Starting fails if another API process
+    already runs the in-process queue. Each pass takes everything queued,
+    up to ``max_batch``: at low load a deployment is placed on its own
+    within milliseconds of the request; under load the backlog is placed in
+    batches with one commit each.
+    """
+
+    def __init__(self, backend=None, max_batch=None):
+        self.backend = backend or get_queue_backend()
+        self.consumer = RabbitMQConsumer(
+            batch_size=max_batch or settings.SCHEDULER_EMBEDDED_MAX_BATCH
+        )
+        self._thread = None
+
+    def start(self):
+        # Deployments accepted before a restart were only queued in memory
+        self.backend.recover()
+        self._thread = threading.Thread(
+            target=self.backend.consume,
+            args=(self.consumer,),
+            name="embedded-scheduler",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """
+        Stop after the pass in progress.
+        """
+        self.backend.stop()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,69 @@
+from app.models.deployment import Deployment, DeploymentStatus
+from app.scheduler.capacity import demand_of
+
+# Most pending deployments of one cluster considered per admission pass
+ADMISSION_SCAN_LIMIT = 1000
+
+
+class PendingIndex:
+    """
+    Per-cluster queue of deployments waiting for capacity.
+
+    Entries are ordered by priority (lowest number first), then submit time.
+    When a cluster frees capacity the consumer reloads that cluster's queue
+    from the partial ``ix_deployment_pending`` index, which returns the rows
+    already in that order, and asks for the deployments that fit, so the
+    whole admission is one ordered pass instead of one scheduling round trip
+    per waiting deployment. Entries may be stale (another worker placed
+    them); the scheduler only places rows that are still PENDING.
+    """
+
+    def __init__(self):
+        self._queues = {}  # cluster id -> [(id, demand)] in queue order
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def load(self, db, cluster_id, limit=ADMISSION_SCAN_LIMIT):
+        """
+        Replace the cluster's queue with its most urgent PENDING deployments.
+        """
+        rows = (
+            db.query(
+                Deployment.id,
+                Deployment.cpu_required,
+                Deployment.ram_required,
+                Deployment.gpu_required,
+                Deployment.replicas,
+            )
+            .filter(
+                Deployment.cluster_id == cluster_id,
+                Deployment.status == DeploymentStatus.PENDING,
+            )
+            .order_by(Deployment.priority, Deployment.created_at, Deployment.id)
+            .limit(limit)
+            .all()
+        )
+        self._queues[cluster_id] = [(row.id, demand_of(row)) for row in rows]
+
+    def discard(self, cluster_id, deployment_ids):
+        queue = self._queues.get(cluster_id)
+        if not queue:
+            return
+        deployment_ids = set(deployment_ids)
+        queue[:] = [entry for entry in queue if entry[0] not in deployment_ids]
+
+    def admissible(self, cluster_id, available):
+        """
+        Return the ids of the queued deployments that fit in ``available``.
+
+        Deployments are taken in queue order; one that does not fit is skipped
+        so smaller, less urgent ones behind it can still use the room.
+        """
+        free = available.copy()
+        admitted = []
+        for deployment_id, demand in self._queues.get(cluster_id, ()):
+            if (free >= demand).all():
+                free -= demand
+                admitted.append(deployment_id)
+        return admitted
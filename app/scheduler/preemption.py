@@ -0,0 +1,76 @@
+from itertools import combinations
+
+import numpy as np
+
+from app.scheduler.capacity import demand_of
+
+# Above this many candidates the exhaustive search gives way to greedy + pruning
+EXACT_SEARCH_LIMIT = 12
+
+
+def select_victims(candidates, deficit, exact_limit=EXACT_SEARCH_LIMIT):
+    """
+    Pick the deployments to preempt so that ``deficit`` (cpu, ram, gpu) is freed.
+
+    This is a small multi-dimensional covering knapsack: the chosen set must
+    free at least the deficit on all three resources, using as few victims as
+    possible and, among sets of the same size, the lowest-priority ones
+    (highest ``priority`` number). Small candidate lists are searched exactly;
+    larger ones are packed greedily from the lowest priority up and then pruned
+    of victims that turned out not to be needed.
+
+    Returns the list of victims, or None when even preempting every candidate
+    would not free enough.
+    """
+    deficit = np.maximum(np.asarray(deficit, dtype=np.float64), 0)
+    if not deficit.any():
+        return []
+    if not candidates:
+        return None
+
+    demands = np.array([demand_of(candidate) for candidate in candidates])
+    if not (demands.sum(axis=0) >= deficit).all():
+        return None
+
+    if len(candidates) <= exact_limit:
+        chosen = _exact(candidates, demands, deficit)
+    else:
+        chosen = _greedy(candidates, demands, deficit)
+    return [candidates[i] for i in chosen]
+
+
+def _exact(candidates, demands, deficit):
+    for size in range(1, len(candidates) + 1):
+        best, best_cost = None, None
+        for subset in combinations(range(len(candidates)), size):
+            if not (demands[list(subset)].sum(axis=0) >= deficit).all():
+                continue
+            cost = sum(candidates[i].priority for i in subset)
+            if best_cost is None or cost > best_cost:
+                best, best_cost = subset, cost
+        if best is not None:
+            return list(best)
+    return list(range(len(candidates)))
+
+
+def _greedy(candidates, demands, deficit):
+    # Lowest priority first, larger footprints first within a priority
+    scale = np.where(deficit > 0, deficit, 1)
+    weight = (demands / scale).sum(axis=1)
+    order = sorted(
+        range(len(candidates)), key=lambda i: (-candidates[i].priority, -weight[i])
+    )
+
+    chosen, freed = [], np.zeros_like(deficit)
+    for i in order:
+        if (freed >= deficit).all():
+            break
+        chosen.append(i)
+        freed += demands[i]
+
+    # Give back the highest-priority victims that the others already cover
+    for i in sorted(chosen, key=lambda i: candidates[i].priority):
+        if (freed - demands[i] >= deficit).all():
+            chosen.remove(i)
+            freed -= demands[i]
+    return chosen
@@ -0,0 +1,50 @@
+from sqlalchemy import update
+
+from app.models.cluster import Cluster
+from app.models.deployment import Deployment, DeploymentStatus
+
+# Statuses in which a deployment holds its cluster's resources
+HOLDING_STATUSES = (DeploymentStatus.COMPLETED,)
+
+
+def end_deployment(deployment_id, from_status, to_status):
+    """
+    UPDATE moving a deployment from ``from_status`` to ``to_status``.
+
+    Returns the deployment's (cluster_id, cpu, ram, gpu, replicas) when
+    executed, or no row when its status already changed, so two concurrent terminations can
+    never release the same resources twice. Bumps the row version like an ORM
+    write, so a concurrent ORM status change fails instead of overwriting it.
+    """
+    return (
+        update(Deployment)
+        .where(Deployment.id == deployment_id, Deployment.status == from_status)
+        .values(status=to_status, version=Deployment.version + 1)
+        .returning(
+            Deployment.cluster_id,
+            Deployment.cpu_required,
+            Deployment.ram_required,
+            Deployment.gpu_required,
+            Deployment.replicas,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release_capacity(cluster_id, freed):
+    """
+    UPDATE returning ``freed`` (cpu, ram, gpu) to the cluster's availability.
+    """
+    cpu, ram, gpu = (float(value) for value in freed)
+    return (
+        update(Cluster)
+        .where(Cluster.id == cluster_id)
+        .values(
+            cpu_available=Cluster.cpu_available + cpu,
+            ram_available=Cluster.ram_available + ram,
+            gpu_available=Cluster.gpu_available + gpu,
+            version=Cluster.version + 1,
+        )
+        .returning(Cluster.cpu_available, Cluster.ram_available, Cluster.gpu_available)
+        .execution_options(synchronize_session=False)
+    )
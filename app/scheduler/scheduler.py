@@ -1,79 +1,263 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import update
+
+from app.core.metrics import PREEMPTION_ATTEMPTS, PREEMPTIONS
+from app.models.cluster import Cluster
 from app.models.deployment import Deployment, DeploymentStatus
+from app.queue.events import stage_status_events
+from app.scheduler.capacity import CapacityIndex, demand_of
+from app.scheduler.preemption import select_victims
+from app.scheduler.usage import record_transition
+
+logger = logging.getLogger(__name__)
 
 
 class Scheduler:
-    def __init__(self, db):
+    def __init__(self, db, capacity_index=None):
         self.db = db
+        # Share one index across schedulers (e.g. per consumer) to keep it hot
+        self.capacity = capacity_index if capacity_index is not None else CapacityIndex()
 
-    def schedule_deployment(self, deployment, cluster):
+    def schedule_deployment(self, deployment, cluster=None):
         """
         Schedule a deployment by validating and allocating resources.
+
+        The fit check runs against the in-memory capacity index; only the
+        winning allocation is written back to the ``Cluster`` row. All
+        replicas are reserved by that one conditional UPDATE, so a
+        multi-replica deployment is placed whole or not at all.
+
+        Nothing is committed: the caller commits the reservation together
+        with the deployment's status change, so a status write that loses a
+        version conflict takes the reservation down with it. When that
+        commit fails the caller refreshes the cluster in the capacity index.
+        """
+        cluster_id = deployment.cluster_id
+        if cluster is not None and cluster_id not in self.capacity:
+            self.capacity.sync(cluster)
+        elif not self.capacity.ensure(self.db, cluster_id):
+            return False
+
+        demand = demand_of(deployment)
+        for attempt in range(2):
+            # Check if resources are available
+            if self.capacity.fits(cluster_id, demand):
+                available = self._write_back(cluster_id, -demand)
+                if available is not None:
+                    self.capacity.set(cluster_id, available)
+                    return True
+            if attempt == 0:
+                # The index may be stale when other workers share the cluster
+                self.capacity.refresh(self.db, cluster_id)
+
+        # Attempt to preempt lower-priority deployments
+        return self.preempt_deployments(deployment, cluster)
+
+    def schedule_batch(self, deployments):
         """
-        # Check if resources are available
-        if (
-            deployment.cpu_required <= cluster.cpu_available
-            and deployment.ram_required <= cluster.ram_available
-            and deployment.gpu_required <= cluster.gpu_available
-        ):
-            # Deduct resources
-            cluster.cpu_available -= deployment.cpu_required
-            cluster.ram_available -= deployment.ram_required
-            cluster.gpu_available -= deployment.gpu_required
-            self.db.commit()
-            return True
-        else:
-            # Attempt to preempt lower-priority deployments
-            return self.preempt_deployments(deployment, cluster)
-
-    def preempt_deployments(self, deployment, cluster):
+        Place a batch of deployments in one priority-ordered bin-packing pass.
+
+        Deployments are visited highest priority first (lowest number, then
+        oldest submission) and packed into their cluster while it still fits. The
+        accumulated allocation is written back with one UPDATE per touched
+        cluster but not committed: the caller commits it together with the
+        status changes and must reload the capacity index if that fails.
+
+        Returns the lists of placed and unplaced deployments.
         """
-        Preempt lower-priority deployments to free resources.
+        placed, unplaced = [], []
+        by_cluster = {}
+        for deployment in sorted(deployments, key=_queue_order):
+            by_cluster.setdefault(deployment.cluster_id, []).append(deployment)
+        known = self.capacity.ensure_many(self.db, by_cluster)
+
+        for cluster_id, queued in by_cluster.items():
+            if cluster_id not in known:
+                unplaced.extend(queued)
+                continue
+            for attempt in range(2):
+                fitted, rest = self._pack(cluster_id, queued)
+                if not fitted:
+                    break
+                available = self._write_back(cluster_id, -self._total(fitted))
+                if available is not None:
+                    self.capacity.set(cluster_id, available)
+                    break
+                # Another worker took capacity since the index was refreshed
+                self.capacity.refresh(self.db, cluster_id)
+                fitted, rest = [], queued
+            placed.extend(fitted)
+            unplaced.extend(rest)
+        return placed, unplaced
+
+    def admit_pending(self, cluster_id, pending):
+        """
+        Place the pending deployments of a cluster that fit its free capacity.
+
+        ``pending`` is a PendingIndex holding the cluster's queue. The fitting
+        deployments are placed like a batch (see ``schedule_batch``) and are
+        not committed. Returns the placed deployments.
         """
-        # Query the lower-priority deployments that are still pending
-        print("PREEMPTING")
-        lower_priority_deployments = (
+        admitted = pending.admissible(cluster_id, self.capacity.available(cluster_id))
+        if not admitted:
+            return []
+        deployments = (
             self.db.query(Deployment)
             .filter(
-                Deployment.cluster_id == cluster.id,
+                Deployment.id.in_(admitted),
+                Deployment.status == DeploymentStatus.PENDING,
+            )
+            .all()
+        )
+        placed, unplaced = self.schedule_batch(deployments)
+        # Placed and stale entries leave the queue; the rest wait for more room
+        waiting = {deployment.id for deployment in unplaced}
+        pending.discard(cluster_id, [id for id in admitted if id not in waiting])
+        return placed
+
+    def _pack(self, cluster_id, deployments):
+        """
+        Greedily fit ``deployments`` (in order) into the indexed free capacity.
+        """
+        free = self.capacity.available(cluster_id)
+        fitted, rest = [], []
+        for deployment in deployments:
+            demand = demand_of(deployment)
+            if (free >= demand).all():
+                free -= demand
+                fitted.append(deployment)
+            else:
+                rest.append(deployment)
+        return fitted, rest
+
+    @staticmethod
+    def _total(deployments):
+        return sum((demand_of(d) for d in deployments), np.zeros(3))
+
+    def preempt_deployments(self, deployment, cluster=None):
+        """
+        Preempt lower-priority deployments to free resources.
+
+        The victim set is chosen in memory first; the victims' status change,
+        the freed capacity and the new allocation are then applied in a single
+        transaction, so nothing is preempted unless the deployment can run.
+        Like ``schedule_deployment`` it leaves that transaction for the caller
+        to commit with the deployment's status change.
+        """
+        cluster_id = deployment.cluster_id
+        demand = demand_of(deployment)
+        # Query the lower-priority deployments currently holding resources
+        candidates = (
+            self.db.query(
+                Deployment.id,
+                Deployment.cluster_id,
+                Deployment.priority,
+                Deployment.cpu_required,
+                Deployment.ram_required,
+                Deployment.gpu_required,
+                Deployment.replicas,
+            )
+            .filter(
+                Deployment.cluster_id == cluster_id,
                 Deployment.status == DeploymentStatus.COMPLETED,
                 Deployment.priority
                 > deployment.priority,  # Only preempt lower-priority deployments
             )
-            .order_by(Deployment.priority)  # Ascending order of priority
             .all()
         )
 
-        for lower_deployment in lower_priority_deployments:
-            print(
-                f"PREEMPTING Deployment {lower_deployment.id}: "
-                f"CPU={lower_deployment.cpu_required}, RAM={lower_deployment.ram_required}, GPU={lower_deployment.gpu_required}"
+        victims = select_victims(candidates, demand - self.capacity.available(cluster_id))
+        if victims is None:
+            PREEMPTION_ATTEMPTS.labels(result="insufficient").inc()
+            logger.info(
+                "Could not free enough resources for the deployment",
+                extra={"deployment_id": deployment.id, "cluster_id": cluster_id},
+            )
+            return False
+
+        freed = self._total(victims)
+        victim_ids = [victim.id for victim in victims]
+
+        # Mark every victim FAILED in one bulk UPDATE, unless another worker got there first
+        preempted = (
+            self.db.query(Deployment)
+            .filter(
+                Deployment.id.in_(victim_ids),
+                Deployment.status == DeploymentStatus.COMPLETED,
             )
+            .update(
+                {
+                    Deployment.status: DeploymentStatus.FAILED,
+                    Deployment.version: Deployment.version + 1,
+                },
+                synchronize_session="fetch",
+            )
+        )
+        # Return the victims' resources and take the new allocation in one go
+        available = self._write_back(cluster_id, freed - demand)
+        if preempted != len(victim_ids) or available is None:
+            self.db.rollback()
+            self.capacity.refresh(self.db, cluster_id)
+            PREEMPTION_ATTEMPTS.labels(result="raced").inc()
+            logger.info(
+                "Preemption raced with another worker; giving up on this attempt",
+                extra={"deployment_id": deployment.id, "cluster_id": cluster_id},
+            )
+            return False
+        record_transition(self.db, victims, DeploymentStatus.COMPLETED, DeploymentStatus.FAILED)
+        stage_status_events(self.db, victims, DeploymentStatus.FAILED)
+        self.capacity.set(cluster_id, available)
+        PREEMPTION_ATTEMPTS.labels(result="preempted").inc()
+        PREEMPTIONS.inc(len(victims))
+        logger.info(
+            "Preempted deployments",
+            extra={
+                "deployment_id": deployment.id,
+                "cluster_id": cluster_id,
+                "victims": victim_ids,
+                "freed": {"cpu": float(freed[0]), "ram": float(freed[1]), "gpu": float(freed[2])},
+            },
+        )
+        return True
+
+    def _write_back(self, cluster_id, delta):
+        """
+        Atomically apply a (cpu, ram, gpu) delta to ``Cluster.*_available``.
+
+        Negative deltas allocate resources, positive deltas free them. This is
+        a single conditional ``UPDATE ... WHERE *_available + delta >= 0``, so
+        concurrent consumers can never drive a cluster below zero: the row lock
+        (PostgreSQL) or the database write lock (SQLite) makes the check and
+        the write one step. Returns the new (cpu, ram, gpu) availability, or
+        None if the cluster no longer has room. The caller commits and then
+        stores the returned values in the capacity index.
+        """
+        cpu, ram, gpu = (float(value) for value in delta)
+        row = self.db.execute(
+            update(Cluster)
+            .where(
+                Cluster.id == cluster_id,
+                Cluster.cpu_available + cpu >= 0,
+                Cluster.ram_available + ram >= 0,
+                Cluster.gpu_available + gpu >= 0,
+            )
+            .values(
+                cpu_available=Cluster.cpu_available + cpu,
+                ram_available=Cluster.ram_available + ram,
+                gpu_available=Cluster.gpu_available + gpu,
+                version=Cluster.version + 1,
+            )
+            .returning(Cluster.cpu_available, Cluster.ram_available, Cluster.gpu_available)
+            .execution_options(synchronize_session=False)
+        ).first()
+        return None if row is None else tuple(row)
+
 
-            # Free resources allocated to the lower-priority deployment
-            cluster.cpu_available += lower_deployment.cpu_required
-            cluster.ram_available += lower_deployment.ram_required
-            cluster.gpu_available += lower_deployment.gpu_required
-
-            # Mark the lower-priority deployment as FAILED
-            lower_deployment.status = DeploymentStatus.FAILED
-            print(f"Deployment {lower_deployment.id} status updated to FAILED.")
-
-            # Persist changes to the database
-            self.db.commit()
-
-            # Re-check if enough resources are now available for the new deployment
-            if (
-                deployment.cpu_required <= cluster.cpu_available
-                and deployment.ram_required <= cluster.ram_available
-                and deployment.gpu_required <= cluster.gpu_available
-            ):
-                print("Enough resources freed. Scheduling the deployment...")
-                cluster.cpu_available -= deployment.cpu_required
-                cluster.ram_available -= deployment.ram_required
-                cluster.gpu_available -= deployment.gpu_required
-                self.db.commit()
-                return True
-
-        # If we exit the loop and still don’t have enough resources, return False
-        print("Could not free enough resources for the deployment.")
-        return False
+def _queue_order(deployment):
+    """
+    Sort key of the scheduling order: priority, then submit time.
+    """
+    return deployment.priority, deployment.created_at or datetime.min, deployment.id
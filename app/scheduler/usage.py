@@ -0,0 +1,117 @@
+import numpy as np
+from sqlalchemy import func, insert, select, update
+
+from app.models.cluster import Cluster
+from app.models.cluster_usage import ClusterUsage
+from app.models.deployment import Deployment, DeploymentStatus
+from app.scheduler.capacity import demand_of
+
+
+def usage_rows(cluster_id):
+    """
+    Return the zeroed counter rows of a new cluster, one per status.
+    """
+    return [
+        {"cluster_id": cluster_id, "status": status, "deployments": 0, "cpu": 0.0, "ram": 0.0, "gpu": 0.0}
+        for status in DeploymentStatus
+    ]
+
+
+def usage_transition(deployments, old_status, new_status):
+    """
+    Return the UPDATE statements moving ``deployments`` between status counters.
+
+    ``old_status`` is None for newly created deployments. Deployments are
+    summed per cluster, so a batch costs two statements per touched cluster.
+    The statements are plain Core UPDATEs: sync callers ``db.execute`` them,
+    async callers ``await db.execute`` them, in the transaction that changes
+    the deployments' status.
+    """
+    if old_status == new_status:
+        return []
+    totals = {}
+    for deployment in deployments:
+        count, total = totals.get(deployment.cluster_id, (0, np.zeros(3)))
+        totals[deployment.cluster_id] = (count + 1, total + demand_of(deployment))
+
+    statements = []
+    for cluster_id, (count, total) in totals.items():
+        if old_status is not None:
+            statements.append(_delta(cluster_id, old_status, -count, -total))
+        if new_status is not None:
+            statements.append(_delta(cluster_id, new_status, count, total))
+    return statements
+
+
+def record_transition(db, deployments, old_status, new_status):
+    """
+    Apply ``usage_transition`` on a sync session without committing.
+    """
+    for statement in usage_transition(deployments, old_status, new_status):
+        db.execute(statement)
+
+
+def backfill_cluster_usage(db):
+    """
+    Create missing counter rows from the deployments table.
+
+    Covers clusters that predate the counters and statuses added since. Only
+    clusters with fewer rows than there are statuses are aggregated, so this
+    is a cheap no-op once every cluster has all of its rows. Commits.
+    """
+    incomplete = (
+        select(Cluster.id)
+        .outerjoin(ClusterUsage, ClusterUsage.cluster_id == Cluster.id)
+        .group_by(Cluster.id)
+        .having(func.count(ClusterUsage.status) < len(DeploymentStatus))
+    )
+    cluster_ids = db.scalars(incomplete).all()
+    if not cluster_ids:
+        return 0
+
+    existing = set(
+        db.execute(
+            select(ClusterUsage.cluster_id, ClusterUsage.status).where(
+                ClusterUsage.cluster_id.in_(cluster_ids)
+            )
+        ).all()
+    )
+    rows = {}
+    for cluster_id in cluster_ids:
+        for row in usage_rows(cluster_id):
+            if (cluster_id, row["status"]) not in existing:
+                rows[cluster_id, row["status"]] = row
+    totals = db.execute(
+        select(
+            Deployment.cluster_id,
+            Deployment.status,
+            func.count(),
+            func.coalesce(func.sum(Deployment.cpu_required * Deployment.replicas), 0),
+            func.coalesce(func.sum(Deployment.ram_required * Deployment.replicas), 0),
+            func.coalesce(func.sum(Deployment.gpu_required * Deployment.replicas), 0),
+        )
+        .where(Deployment.cluster_id.in_(cluster_ids), Deployment.status.is_not(None))
+        .group_by(Deployment.cluster_id, Deployment.status)
+    )
+    for cluster_id, status, count, cpu, ram, gpu in totals:
+        if (cluster_id, status) in rows:
+            rows[cluster_id, status].update(deployments=count, cpu=cpu, ram=ram, gpu=gpu)
+
+    db.execute(insert(ClusterUsage), list(rows.values()))
+    db.commit()
+    return len(cluster_ids)
+
+
+def _delta(cluster_id, status, count, total):
+    cpu, ram, gpu = (float(value) for value in total)
+    return (
+        update(ClusterUsage)
+        .where(ClusterUsage.cluster_id == cluster_id, ClusterUsage.status == status)
+        .values(
+            deployments=ClusterUsage.deployments + count,
+            cpu=ClusterUsage.cpu + cpu,
+            ram=ClusterUsage.ram + ram,
+            gpu=ClusterUsage.gpu + gpu,
+        )
+        .execution_options(synchronize_session=False)
+    )
@@ -1,7 +1,9 @@
-from typing import Optional
+from typing import Dict, Optional
 
 from pydantic import BaseModel
 
+from app.models.deployment import DeploymentStatus
+
 
 class ClusterBase(BaseModel):
     name: str
@@ -27,3 +29,24 @@ class Cluster(ClusterBase):
 
     class Config:
         from_attributes = True
+
+
+class StatusUsage(BaseModel):
+    deployments: int = 0
+    cpu: float = 0
+    ram: float = 0
+    gpu: float = 0
+
+    class Config:
+        from_attributes = True
+
+
+class ClusterUtilization(BaseModel):
+    cluster_id: int
+    cpu_limit: float
+    ram_limit: float
+    gpu_limit: float
+    cpu_available: float
+    ram_available: float
+    gpu_available: float
+    by_status: Dict[DeploymentStatus, StatusUsage]
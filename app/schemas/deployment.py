@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from app.models.deployment import DeploymentStatus
 
@@ -12,6 +12,7 @@ class DeploymentBase(BaseModel):
     ram_required: float
     gpu_required: float
     priority: int = 0
+    replicas: int = Field(1, ge=1)
 
 
 class DeploymentCreate(DeploymentBase):
@@ -26,6 +27,26 @@ class Deployment(DeploymentBase):
     id: int
     cluster_id: int
     status: DeploymentStatus
+    attempts: int = 0
 
     class Config:
         from_attributes = True
+
+
+class DeploymentBulkItem(BaseModel):
+    # Position of the deployment in the submitted list
+    index: int
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class DeploymentBulkResult(BaseModel):
+    created: int
+    results: List[DeploymentBulkItem]
+
+
+class DeploymentStatusEvent(BaseModel):
+    # A deployment moved to ``status``; sent on GET /deployments/events
+    deployment_id: int
+    cluster_id: int
+    status: DeploymentStatus
@@ -1,7 +1,11 @@
+import random
+import string
+
 from fastapi import APIRouter, Depends, HTTPException
 from app.models.organization import Organization as OrganizationModel
 router = APIRouter()
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 def generate_invite_code(length=8):
     """
@@ -15,7 +19,7 @@ def generate_invite_code(length=8):
     return invite_code
 
 
-def generate_unique_invite_code(db: Session, length=8):
+async def generate_unique_invite_code(db: AsyncSession, length=8):
     """
     Generates a unique invite code that doesn't already exist in the database.
     :param db: The database session
@@ -26,10 +30,10 @@ def generate_unique_invite_code(db: Session, length=8):
 
     # Check if the invite code already exists in the database
     while (
-        db.query(OrganizationModel)
-        .filter(OrganizationModel.invite_code == invite_code)
-        .first()
-    ):
+        await db.execute(
+            select(OrganizationModel.id).where(OrganizationModel.invite_code == invite_code)
+        )
+    ).first():
         # If it exists, generate a new one
         invite_code = generate_invite_code(length)
 
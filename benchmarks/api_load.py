@@ -0,0 +1,204 @@
+"""
+Load benchmark: async API stack vs. the previous sync stack.
+
+Seeds a SQLite database, then drives ``GET /api/v1/deployments/`` (with JWT
+auth) and ``GET /health`` from many concurrent in-process clients through
+httpx's ASGI transport. The same load runs twice: once against the real
+application (async engine, ``async def`` endpoints) and once against a
+reference app built from the previous sync handlers (sync ``Session``,
+threadpool endpoints). Reports requests per second and latency percentiles.
+
+Usage:
+    python -m benchmarks.api_load --concurrency 64 --requests 4000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def configure_environment():
+    if "DATABASE_URL" not in os.environ:
+        path = os.path.join(tempfile.mkdtemp(), "api_load.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("SESSION_COOKIE_NAME", "session")
+    os.environ.setdefault("SESSION_MAX_AGE", "1800")
+    os.environ.setdefault("OUTBOX_RELAY_IN_API", "false")
+
+
+def seed(deployments):
+    from app.core.security import get_password_hash
+    from app.db.base import Base
+    from app.db.session import SessionLocal, engine
+    from app.models.cluster import Cluster
+    from app.models.deployment import Deployment, DeploymentStatus
+    from app.models.organization import Organization
+    from app.models.user import User
+    from app.utils.jwt_utils import create_access_token
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        organization = Organization(name="bench", invite_code="BENCH001")
+        db.add(organization)
+        db.flush()
+        db.add(
+            User(
+                username="bench",
+                email="bench@example.com",
+                hashed_password=get_password_hash("bench"),
+                organization_id=organization.id,
+            )
+        )
+        cluster = Cluster(
+            name="bench",
+            organization_id=organization.id,
+            cpu_limit=64,
+            ram_limit=256,
+            gpu_limit=8,
+            cpu_available=64,
+            ram_available=256,
+            gpu_available=8,
+        )
+        db.add(cluster)
+        db.flush()
+        db.add_all(
+            Deployment(
+                name=f"bench-{i}",
+                docker_image="bench:latest",
+                cluster_id=cluster.id,
+                status=DeploymentStatus.PENDING,
+                priority=i % 10,
+                cpu_required=1,
+                ram_required=1,
+                gpu_required=0,
+            )
+            for i in range(deployments)
+        )
+        db.commit()
+    return create_access_token({"sub": "bench"})
+
+
+def build_sync_app():
+    """
+    Reference app with the pre-async handlers: sync Session and ``def``
+    endpoints run by Starlette's threadpool.
+    """
+    from typing import List
+
+    import jwt
+    from fastapi import Depends, FastAPI, HTTPException, Request
+
+    from app.core.config import ALGORITHM, SECRET_KEY
+    from app.db.session import SessionLocal
+    from app.models.cluster import Cluster
+    from app.models.deployment import Deployment as DBDeployment
+    from app.models.user import User
+    from app.schemas.deployment import Deployment
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get_current_user(request: Request, db=Depends(get_db)):
+        token = request.headers["Authorization"].split(" ")[1]
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"]
+        user = db.query(User).filter(User.username == username).first()
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        return user
+
+    sync_app = FastAPI()
+
+    @sync_app.get("/api/v1/deployments/", response_model=List[Deployment])
+    def list_deployments(db=Depends(get_db), current_user=Depends(get_current_user)):
+        clusters = (
+            db.query(Cluster).filter(Cluster.organization_id == current_user.organization_id).all()
+        )
+        return (
+            db.query(DBDeployment)
+            .filter(DBDeployment.cluster_id.in_([cluster.id for cluster in clusters]))
+            .all()
+        )
+
+    @sync_app.get("/health")
+    async def health_check():
+        return {"status": "healthy"}
+
+    return sync_app
+
+
+async def drive(app, token, concurrency, requests, health_ratio):
+    import httpx
+
+    latencies = {"deployments": [], "health": []}
+    counter = iter(range(requests))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def client_loop(client):
+        for i in counter:
+            kind = "health" if health_ratio and i % health_ratio == 0 else "deployments"
+            url = "/health" if kind == "health" else "/api/v1/deployments/"
+            started = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            latencies[kind].append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies
+
+
+def summarize(elapsed, latencies):
+    def percentiles(values):
+        ordered = sorted(values)
+        pick = lambda q: round(1000 * ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+        return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "requests_per_second": round(total / elapsed, 1),
+        **{kind: percentiles(values) for kind, values in latencies.items() if values},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--deployments", type=int, default=200, help="rows returned per list call")
+    parser.add_argument("--health-every", type=int, default=10, help="every Nth request is /health")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    configure_environment()
+    token = seed(args.deployments)
+
+    from app.main import app
+
+    results = {}
+    for name, target in (("sync", build_sync_app()), ("async", app)):
+        elapsed, latencies = asyncio.run(
+            drive(target, token, args.concurrency, args.requests, args.health_every)
+        )
+        results[name] = summarize(elapsed, latencies)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,536 @@
+"""
+End-to-end load benchmark: API, outbox relay and scheduler together.
+
+Seeds a SQLite database with a fleet of clusters, then submits a seeded
+synthetic workload through the real FastAPI app (httpx's ASGI transport,
+``POST /api/v1/deployments/`` or ``/bulk``). The outbox relay publishes the
+tasks to an in-memory stand-in for RabbitMQ, and a ``RabbitMQConsumer`` on a
+background thread consumes them through its own loop (per message, or
+``consume_batches`` with ``--batch-size``) and schedules them with the
+``Scheduler``. The stand-in keeps the broker behaviour the consumer relies
+on: priority delivery, TTL retry queues routed back to the deployment queue,
+the dead-letter queue, and (multiple) acks and nacks.
+
+With ``--backend inprocess`` the broker, relay and consumer thread are
+replaced by the embedded scheduler (app.scheduler.embedded), fed straight
+from the endpoints through the in-process queue backend.
+
+Reports submissions per second with the API latency percentiles, and
+scheduling decisions per second with the time to decision (submission to
+the last ack of a deployment's task) percentiles. With ``--output`` the
+results, the workload parameters and the current git commit are saved as
+JSON so runs can be compared across commits.
+
+Usage:
+    python -m benchmarks.e2e --deployments 5000 --concurrency 32
+    python -m benchmarks.e2e --batch-size 64 --bulk 100 --output e2e.json
+    python -m benchmarks.e2e --backend inprocess
+
+Retry backoffs are shortened (SCHEDULER_RETRY_BASE_DELAY_MS=10) unless set
+in the environment, so unschedulable work reaches the dead-letter queue
+within the run.
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def configure_environment(backend):
+    if backend == "inprocess":
+        os.environ["QUEUE_BACKEND"] = "inprocess"
+    if "DATABASE_URL" not in os.environ:
+        path = os.path.join(tempfile.mkdtemp(), "e2e.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("SESSION_COOKIE_NAME", "session")
+    os.environ.setdefault("SESSION_MAX_AGE", "1800")
+    os.environ.setdefault("OUTBOX_RELAY_IN_API", "false")
+    os.environ.setdefault("OUTBOX_POLL_INTERVAL_MS", "20")
+    os.environ.setdefault("SCHEDULER_RETRY_BASE_DELAY_MS", "10")
+    os.environ.setdefault("SCHEDULER_RETRY_MAX_DELAY_MS", "200")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+
+class InMemoryBroker:
+    """
+    Thread-safe stand-in for the RabbitMQ broker and channel.
+
+    It serves as the publisher of the outbox relay (``publish_many``), as the
+    backend of the status events (``publish_events``, which drops them) and
+    as the consumer's channel. Deliveries come highest AMQP priority first, then
+    in publish order. Messages sent to a ``<queue>.retry.<delay>ms`` queue
+    return to the deployment queue once the delay has passed, like the TTL
+    queues of ``declare_retry_queues``.
+    """
+
+    _RETRY_QUEUE = re.compile(r"\.retry\.(\d+)ms$")
+    in_process = False
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._ready = []  # heap of (-priority, seq, properties, body)
+        self._delayed = []  # heap of (due, seq, properties, body)
+        self._unacked = {}  # delivery tag -> (body, delivered at)
+        self._seq = itertools.count()
+        self._tags = itertools.count(1)
+        self._consuming = False
+        self._callback = None
+        self.dead = []
+        self.acks = []  # (body, delivered at, acked at)
+
+    # Publisher side (DeploymentPublisher interface)
+
+    def publish_many(self, messages):
+        import pika
+        from app.core.metrics import PUBLISHED_AT_HEADER
+        from app.queue.topology import amqp_priority
+
+        properties = [
+            pika.BasicProperties(
+                delivery_mode=2,
+                priority=amqp_priority(message.get("priority")),
+                headers={PUBLISHED_AT_HEADER: time.time()},
+            )
+            for message in messages
+        ]
+        with self._condition:
+            for message, props in zip(messages, properties):
+                self._push(props, json.dumps(message))
+            self._condition.notify_all()
+
+    def publish_events(self, events):
+        pass
+
+    def heartbeat(self):
+        pass
+
+    # Channel side (the subset of pika's BlockingChannel the consumer uses)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        from app.queue.topology import DEAD_LETTER_QUEUE
+
+        with self._condition:
+            retry = self._RETRY_QUEUE.search(routing_key)
+            if routing_key == DEAD_LETTER_QUEUE:
+                self.dead.append(body)
+            elif retry:
+                due = time.monotonic() + int(retry.group(1)) / 1000
+                heapq.heappush(self._delayed, (due, next(self._seq), properties, body))
+            else:
+                self._push(properties, body)
+            self._condition.notify_all()
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self._settle(delivery_tag, multiple, acked=True)
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self._settle(delivery_tag, multiple, acked=False)
+
+    def basic_qos(self, prefetch_count=0):
+        pass
+
+    def basic_consume(self, queue, on_message_callback):
+        self._callback = on_message_callback
+
+    def start_consuming(self):
+        self._consuming = True
+        while self._consuming:
+            delivery = self._get(timeout=0.05)
+            if delivery is not None:
+                self._callback(self, *delivery)
+
+    def stop_consuming(self):
+        self._consuming = False
+
+    def consume(self, queue, inactivity_timeout=None):
+        self._consuming = True
+        while self._consuming:
+            yield self._get(inactivity_timeout) or (None, None, None)
+
+    def cancel(self):
+        self._consuming = False
+
+    # Bookkeeping
+
+    def idle(self):
+        with self._condition:
+            return not (self._ready or self._delayed or self._unacked)
+
+    def _push(self, properties, body):
+        heapq.heappush(self._ready, (-(properties.priority or 0), next(self._seq), properties, body))
+
+    def _get(self, timeout):
+        from pika.spec import Basic
+
+        deadline = time.monotonic() + (timeout or 0)
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, properties, body = heapq.heappop(self._delayed)
+                    self._push(properties, body)
+                if self._ready:
+                    _, _, properties, body = heapq.heappop(self._ready)
+                    tag = next(self._tags)
+                    self._unacked[tag] = (body, now)
+                    return Basic.Deliver(delivery_tag=tag), properties, body
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self._delayed:
+                    wait = min(wait, self._delayed[0][0] - now)
+                self._condition.wait(wait)
+
+    def _settle(self, delivery_tag, multiple, acked):
+        now = time.monotonic()
+        with self._condition:
+            tags = [tag for tag in self._unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+            for tag in tags:
+                body, delivered = self._unacked.pop(tag)
+                if acked:
+                    self.acks.append((body, delivered, now))
+            self._condition.notify_all()
+
+
+def recording_inprocess_backend():
+    """
+    An InProcessBackend that logs deliveries, acks and dead letters like
+    InMemoryBroker, for the same report.
+    """
+    from app.queue.backends import InProcessBackend
+    from app.queue.topology import DEAD_LETTER_QUEUE
+
+    class RecordingInProcessBackend(InProcessBackend):
+        def __init__(self):
+            super().__init__()
+            self._unacked = {}  # delivery tag -> (body, delivered at)
+            self.dead = []
+            self.acks = []  # (body, delivered at, acked at)
+
+        def idle(self):
+            with self._delayed_lock:
+                return not (len(self.tasks) or self._delayed or self._unacked)
+
+        def basic_publish(self, exchange, routing_key, body, properties=None):
+            if routing_key == DEAD_LETTER_QUEUE:
+                self.dead.append(body)
+            super().basic_publish(exchange, routing_key, body, properties)
+
+        def basic_ack(self, delivery_tag, multiple=False):
+            self._settle(delivery_tag, multiple, acked=True)
+
+        def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+            self._settle(delivery_tag, multiple, acked=False)
+
+        def _delivery(self, task):
+            method, properties, body = super()._delivery(task)
+            with self._delayed_lock:
+                self._unacked[method.delivery_tag] = (body, time.monotonic())
+            return method, properties, body
+
+        def _settle(self, delivery_tag, multiple, acked):
+            now = time.monotonic()
+            with self._delayed_lock:
+                tags = [tag for tag in self._unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+                for tag in tags:
+                    body, delivered = self._unacked.pop(tag)
+                    if acked:
+                        self.acks.append((body, delivered, now))
+
+    return RecordingInProcessBackend()
+
+
+def seed(clusters):
+    from sqlalchemy import insert, text
+
+    from app.core.security import get_password_hash
+    from app.db.base import Base
+    from app.db.session import SessionLocal, engine
+    from app.models.cluster import Cluster
+    from app.models.cluster_usage import ClusterUsage
+    from app.models.organization import Organization
+    from app.models.user import User
+    from app.scheduler.usage import usage_rows
+    from app.utils.jwt_utils import create_access_token
+    from benchmarks.simulator import CLUSTER_SHAPES
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if engine.dialect.name == "sqlite":
+            # Let the API, the relay and the consumer read while one of them writes
+            db.execute(text("PRAGMA journal_mode=WAL"))
+        organization = Organization(name="bench", invite_code="BENCH001")
+        db.add(organization)
+        db.flush()
+        db.add(
+            User(
+                username="bench",
+                email="bench@example.com",
+                hashed_password=get_password_hash("bench"),
+                organization_id=organization.id,
+            )
+        )
+        fleet = []
+        for i in range(clusters):
+            cpu, ram, gpu = CLUSTER_SHAPES[i % len(CLUSTER_SHAPES)]
+            cluster = Cluster(
+                name=f"bench-{i}",
+                organization_id=organization.id,
+                cpu_limit=cpu,
+                ram_limit=ram,
+                gpu_limit=gpu,
+                cpu_available=cpu,
+                ram_available=ram,
+                gpu_available=gpu,
+            )
+            db.add(cluster)
+            db.flush()
+            db.execute(insert(ClusterUsage), usage_rows(cluster.id))
+            fleet.append((cluster.id, (cpu, ram, gpu)))
+        db.commit()
+    return fleet, create_access_token({"sub": "bench"})
+
+
+def fleet_size(deployments, load):
+    """
+    Number of clusters whose CPU the workload requests ``load`` of on average.
+    """
+    from benchmarks.simulator import CLUSTER_SHAPES, DEPLOYMENT_SHAPES
+
+    shapes, weights = zip(*DEPLOYMENT_SHAPES)
+    mean_cpu = sum(shape[0] * weight for shape, weight in DEPLOYMENT_SHAPES) / sum(weights)
+    mean_cluster_cpu = sum(shape[0] for shape in CLUSTER_SHAPES) / len(CLUSTER_SHAPES)
+    return max(1, round(deployments * mean_cpu / (load * mean_cluster_cpu)))
+
+
+def synthetic_workload(fleet, deployments, seed_value):
+    """
+    Deployment payloads on random clusters. Shapes that exceed a cluster's
+    limits are shrunk to fit them, so every submission is accepted.
+    """
+    from benchmarks.simulator import DEPLOYMENT_SHAPES
+
+    rng = random.Random(seed_value)
+    shapes, weights = zip(*DEPLOYMENT_SHAPES)
+    for i in range(deployments):
+        cluster_id, limits = rng.choice(fleet)
+        cpu, ram, gpu = (min(need, limit) for need, limit in zip(rng.choices(shapes, weights=weights)[0], limits))
+        yield {
+            "name": f"e2e-{i}",
+            "docker_image": "bench:latest",
+            "cluster_id": cluster_id,
+            "cpu_required": cpu,
+            "ram_required": ram,
+            "gpu_required": gpu,
+            "priority": rng.choices((0, 2, 5, 9), weights=(5, 15, 30, 50))[0],
+        }
+
+
+async def submit(app, token, workload, concurrency, bulk):
+    """
+    Submit ``workload`` from ``concurrency`` clients; return the elapsed time,
+    the request latencies and the submission time of every deployment id.
+    """
+    import httpx
+
+    headers = {"Authorization": f"Bearer {token}"}
+    size = max(bulk, 1)
+    requests = iter([workload[i : i + size] for i in range(0, len(workload), size)])
+    latencies, submitted = [], {}
+
+    async def client_loop(client):
+        for items in requests:
+            started = time.perf_counter()
+            if bulk:
+                response = await client.post("/api/v1/deployments/bulk", json=items, headers=headers)
+            else:
+                response = await client.post("/api/v1/deployments/", json=items[0], headers=headers)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+            now = time.monotonic()
+            body = response.json()
+            ids = [item["id"] for item in body["results"] if item["id"]] if bulk else [body["id"]]
+            submitted.update((deployment_id, now) for deployment_id in ids)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies, submitted
+
+
+def run_consumer(consumer, broker):
+    if consumer.batch_size > 1:
+        consumer.consume_batches(broker)
+    else:
+        broker.basic_consume(queue=consumer.queue_name, on_message_callback=consumer.process_deployment)
+        broker.start_consuming()
+
+
+def wait_until_drained(broker, relay, timeout):
+    """
+    Wait until every outbox row is published (unless there is no ``relay``),
+    every task is acked and no retry is pending. Returns False on timeout.
+    """
+    from app.db.session import SessionLocal
+    from app.models.outbox import OutboxMessage
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        if not broker.idle():
+            continue
+        if relay is None:
+            return True
+        relay.wake()
+        with SessionLocal() as db:
+            unsent = db.query(OutboxMessage.id).first()
+        if unsent is None and broker.idle():
+            return True
+    return False
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    pick = lambda q: round(1000 * ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": pick(1.0)}
+
+
+def summarize(submit_elapsed, request_latencies, submitted, broker, drained):
+    from sqlalchemy import func
+
+    from app.db.session import SessionLocal
+    from app.models.deployment import Deployment
+
+    decided = {}  # deployment id -> time of its last ack
+    decisions, first_delivery, last_ack = 0, None, None
+    for body, delivered, acked in broker.acks:
+        data = json.loads(body)
+        if data.get("event"):
+            continue
+        decisions += 1
+        decided[data["deployment_id"]] = acked
+        first_delivery = delivered if first_delivery is None else min(first_delivery, delivered)
+        last_ack = acked if last_ack is None else max(last_ack, acked)
+    with SessionLocal() as db:
+        statuses = dict(db.query(Deployment.status, func.count()).group_by(Deployment.status).all())
+
+    scheduling_elapsed = (last_ack - first_delivery) if decisions else 0
+    return {
+        "submissions": {
+            "deployments": len(submitted),
+            "per_second": round(len(submitted) / submit_elapsed, 1),
+            "request_latency": percentiles(request_latencies),
+        },
+        "scheduling": {
+            "decisions": decisions,
+            "per_second": round(decisions / scheduling_elapsed, 1) if scheduling_elapsed else None,
+            "time_to_decision": percentiles(
+                [decided[i] - submitted[i] for i in submitted if i in decided]
+            ),
+            "dead_lettered": len(broker.dead),
+            "drained": drained,
+        },
+        "statuses": {status.value: count for status, count in sorted(statuses.items(), key=lambda item: item[0].value)},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--deployments", type=int, default=2000)
+    parser.add_argument("--load", type=float, default=0.8, help="requested CPU / fleet CPU")
+    parser.add_argument("--clusters", type=int, help="fleet size (default: derived from --load)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bulk", type=int, default=0, help="submit this many per /bulk request (0: one per request)")
+    parser.add_argument("--backend", choices=("broker", "inprocess"), default="broker")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="consumer batch size (default: 1, or SCHEDULER_EMBEDDED_MAX_BATCH in process)",
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for the scheduler to drain")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    configure_environment(args.backend)
+    fleet, token = seed(args.clusters or fleet_size(args.deployments, args.load))
+    workload = list(synthetic_workload(fleet, args.deployments, args.seed))
+
+    from app.main import app
+    from app.queue import outbox
+    from app.queue.consumer import RabbitMQConsumer
+    from app.queue.events import status_events
+    from app.scheduler.embedded import EmbeddedScheduler
+
+    if args.backend == "inprocess":
+        # The endpoints dispatch to the process's backend; swap in the recording one
+        broker = recording_inprocess_backend()
+        outbox.get_queue_backend = lambda: broker
+        relay = None
+        scheduler = EmbeddedScheduler(broker, max_batch=args.batch_size).start()
+        status_events.backend = broker
+    else:
+        broker = InMemoryBroker()
+        # The API wakes the module-level relay after each commit; publish through the stand-in
+        relay = outbox.relay
+        relay.publisher = broker
+        relay.start()
+        status_events.backend = broker
+        consumer = RabbitMQConsumer(batch_size=args.batch_size or 1)
+        thread = threading.Thread(
+            target=run_consumer, args=(consumer, broker), name="consumer", daemon=True
+        )
+        thread.start()
+
+    try:
+        submit_elapsed, request_latencies, submitted = asyncio.run(
+            submit(app, token, workload, args.concurrency, args.bulk)
+        )
+        drained = wait_until_drained(broker, relay, args.timeout)
+    finally:
+        if relay is None:
+            scheduler.stop()
+        else:
+            consumer.stop()
+            broker.stop_consuming()
+            thread.join()
+            relay.stop()
+
+    results = {
+        "commit": git_commit(),
+        "parameters": vars(args),
+        **summarize(submit_elapsed, request_latencies, submitted, broker, drained),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if drained else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Health-check latency during a login storm.
+
+Fires a burst of concurrent ``POST /api/v1/auth/login`` requests while a probe
+keeps calling ``GET /health``, and reports the probe's latency. It runs twice:
+with bcrypt verified inline on the event loop (the previous behaviour) and
+through the bounded process pool. With the pool, health latency should stay
+close to the idle baseline.
+
+Usage:
+    python -m benchmarks.login_storm --logins 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.api_load import configure_environment, seed
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    pick = lambda q: round(1000 * ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p99_ms": pick(0.99), "max_ms": pick(1.0)}
+
+
+async def storm(app, logins, concurrency, probe_interval):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        health, login_statuses = [], {}
+        remaining = iter(range(logins))
+        done = asyncio.Event()
+
+        async def probe():
+            # Latency is measured from when the probe was due, so time spent
+            # waiting for a blocked event loop counts against it
+            due = time.perf_counter()
+            while not done.is_set():
+                await client.get("/health")
+                health.append(time.perf_counter() - due)
+                due = time.perf_counter() + probe_interval
+                await asyncio.sleep(probe_interval)
+
+        async def login_loop():
+            for _ in remaining:
+                response = await client.post(
+                    "/api/v1/auth/login", params={"username": "bench", "password": "bench"}
+                )
+                login_statuses[response.status_code] = login_statuses.get(response.status_code, 0) + 1
+
+        # Idle baseline first
+        probe_task = asyncio.create_task(probe())
+        await asyncio.sleep(0.5)
+        baseline, health[:] = list(health), []
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    return {
+        "logins_per_second": round(logins / elapsed, 1),
+        "login_statuses": login_statuses,
+        "health_idle": percentiles(baseline),
+        "health_during_storm": percentiles(health),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--probe-ms", type=float, default=5.0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    configure_environment()
+    seed(deployments=0)
+
+    from app.core import security
+    from app.main import app
+
+    pooled = security.verify_password_async
+
+    async def inline(username, plain_password, hashed_password):
+        return security.verify_password(plain_password, hashed_password)
+
+    async def run_all():
+        # One event loop for both runs: the async engine's pool is bound to it
+        results = {}
+        for name, verifier in (("inline", inline), ("pool", pooled)):
+            security.verify_password_async = verifier
+            results[name] = await storm(app, args.logins, args.concurrency, args.probe_ms / 1000)
+        security.verify_password_async = pooled
+        return results
+
+    results = asyncio.run(run_all())
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
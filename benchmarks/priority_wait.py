@@ -0,0 +1,119 @@
+"""
+Head-of-line wait per priority band: FIFO queue vs. priority queue.
+
+Replays a seeded burst of deployment messages through a single consumer in
+simulated time, once with the old FIFO discipline and once through
+``PriorityTaskQueue``, and reports how long messages of each priority band
+waited before the consumer picked them up.
+
+Usage:
+    python -m benchmarks.priority_wait --messages 20000 --load 1.2
+"""
+import argparse
+import collections
+import json
+import random
+import sys
+
+from app.queue.local import PriorityTaskQueue
+
+# Deployment priority bands (0 is the most urgent)
+BANDS = ((0, 0), (1, 3), (4, 6), (7, None))
+
+
+def band_of(priority):
+    for low, high in BANDS:
+        if priority >= low and (high is None or priority <= high):
+            return f"{low}+" if high is None else (f"{low}" if low == high else f"{low}-{high}")
+
+
+def workload(messages, load, service_time, seed):
+    """
+    Yield (arrival_time, priority) with Poisson arrivals at ``load`` times
+    the consumer's service rate. Most submissions are low priority.
+    """
+    rng = random.Random(seed)
+    rate = load / service_time
+    now = 0.0
+    for _ in range(messages):
+        now += rng.expovariate(rate)
+        priority = rng.choices((0, 2, 5, 9), weights=(5, 15, 30, 50))[0]
+        yield now, priority
+
+
+def simulate(arrivals, service_time, queue_kind):
+    """
+    Serve ``arrivals`` one at a time and return the waits grouped by band.
+    """
+    fifo = collections.deque()
+    heap = PriorityTaskQueue()
+    waits = collections.defaultdict(list)
+    clock, i = 0.0, 0
+
+    def push(arrival, priority):
+        if queue_kind == "fifo":
+            fifo.append((arrival, priority))
+        else:
+            heap.put((arrival, priority), priority)
+
+    def pop():
+        return fifo.popleft() if queue_kind == "fifo" else heap.get(timeout=0)
+
+    while i < len(arrivals) or fifo or len(heap):
+        # Admit everything that arrived while the consumer was busy
+        while i < len(arrivals) and arrivals[i][0] <= clock:
+            push(*arrivals[i])
+            i += 1
+        if not fifo and not len(heap):
+            clock = arrivals[i][0]
+            continue
+        arrival, priority = pop()
+        waits[band_of(priority)].append(clock - arrival)
+        clock += service_time
+    return waits
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--load", type=float, default=1.2, help="offered load / capacity")
+    parser.add_argument("--service-ms", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    service_time = args.service_ms / 1000
+    arrivals = list(workload(args.messages, args.load, service_time, args.seed))
+    results = {}
+    for kind in ("fifo", "priority"):
+        waits = simulate(arrivals, service_time, kind)
+        results[kind] = {
+            band: {
+                "count": len(values),
+                "p50_ms": round(1000 * percentile(values, 0.50), 2),
+                "p99_ms": round(1000 * percentile(values, 0.99), 2),
+                "max_ms": round(1000 * max(values), 2),
+            }
+            for band, values in sorted(waits.items())
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print(f"{'queue':<10}{'band':<7}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+    for kind, bands in results.items():
+        for band, row in bands.items():
+            print(
+                f"{kind:<10}{band:<7}{row['count']:>8}"
+                f"{row['p50_ms']:>12}{row['p99_ms']:>12}{row['max_ms']:>12}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Multi-process stress check for concurrent resource reservation.
+
+Several worker processes, each with its own session and its own (quickly
+stale) capacity index, race to schedule deployments on the same small set of
+clusters. Afterwards the script verifies that no cluster was over-committed:
+``*_available`` never drops below zero and always equals the limit minus the
+resources of the deployments that were actually scheduled.
+
+With ``--overlap`` every deployment is handed to two workers, as when a task
+is delivered twice. Only one of them may change its status: the other's
+commit loses the version compare-and-swap, and its reservation is rolled
+back with it.
+
+Usage:
+    python -m benchmarks.reservation_stress --workers 8 --deployments 400
+    python -m benchmarks.reservation_stress --workers 8 --deployments 400 --overlap
+
+DATABASE_URL defaults to a throwaway SQLite file; point it at PostgreSQL to
+exercise row locking there. Exits with status 1 if an over-commit is found.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def run_worker(deployment_ids, seed):
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm.exc import StaleDataError
+
+    from app.db.session import SessionLocal
+    from app.models.deployment import Deployment, DeploymentStatus
+    from app.scheduler.capacity import CapacityIndex
+    from app.scheduler.scheduler import Scheduler
+
+    random.seed(seed)
+    scheduled = conflicts = 0
+    with SessionLocal() as db:
+        capacity = CapacityIndex().load(db)
+        for deployment_id in deployment_ids:
+            while True:
+                try:
+                    deployment = db.get(Deployment, deployment_id)
+                    if deployment.status != DeploymentStatus.PENDING:
+                        break
+                    placed = Scheduler(db, capacity).schedule_deployment(deployment)
+                    deployment.status = (
+                        DeploymentStatus.COMPLETED if placed else DeploymentStatus.FAILED
+                    )
+                    db.commit()
+                    scheduled += placed
+                    break
+                except StaleDataError:
+                    # Another worker changed it first; re-read only its cluster
+                    db.rollback()
+                    capacity.refresh(db, deployment.cluster_id)
+                    conflicts += 1
+                except OperationalError:
+                    # SQLite reports lock contention instead of waiting forever
+                    db.rollback()
+                    capacity.load(db)
+                    time.sleep(random.random() / 100)
+    return scheduled, conflicts
+
+
+def seed(clusters, deployments, seed_value):
+    from app.db.base import Base
+    from app.db.session import SessionLocal, engine
+    from app.models.cluster import Cluster
+    from app.models.deployment import Deployment, DeploymentStatus
+
+    random.seed(seed_value)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        cluster_rows = [
+            Cluster(
+                name=f"stress-{i}",
+                cpu_limit=32,
+                ram_limit=64,
+                gpu_limit=4,
+                cpu_available=32,
+                ram_available=64,
+                gpu_available=4,
+            )
+            for i in range(clusters)
+        ]
+        db.add_all(cluster_rows)
+        db.flush()
+        rows = [
+            Deployment(
+                name=f"stress-{i}",
+                docker_image="stress:latest",
+                cluster_id=random.choice(cluster_rows).id,
+                status=DeploymentStatus.PENDING,
+                # No victims are ever eligible, so only reservations are exercised
+                priority=0,
+                cpu_required=random.randint(1, 4),
+                ram_required=random.randint(1, 8),
+                gpu_required=random.choice((0, 0, 0, 1)),
+                # Some gangs, which must be reserved all or nothing
+                replicas=random.choice((1, 1, 1, 2, 4)),
+            )
+            for i in range(deployments)
+        ]
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+
+
+def verify():
+    from sqlalchemy import func
+
+    from app.db.session import SessionLocal
+    from app.models.cluster import Cluster
+    from app.models.deployment import Deployment, DeploymentStatus
+
+    problems = []
+    with SessionLocal() as db:
+        for cluster in db.query(Cluster).all():
+            used = (
+                db.query(
+                    func.coalesce(func.sum(Deployment.cpu_required * Deployment.replicas), 0),
+                    func.coalesce(func.sum(Deployment.ram_required * Deployment.replicas), 0),
+                    func.coalesce(func.sum(Deployment.gpu_required * Deployment.replicas), 0),
+                )
+                .filter(
+                    Deployment.cluster_id == cluster.id,
+                    Deployment.status == DeploymentStatus.COMPLETED,
+                )
+                .one()
+            )
+            limits = (cluster.cpu_limit, cluster.ram_limit, cluster.gpu_limit)
+            available = (cluster.cpu_available, cluster.ram_available, cluster.gpu_available)
+            for name, limit, free, taken in zip(("cpu", "ram", "gpu"), limits, available, used):
+                if free < 0 or taken > limit or abs(limit - taken - free) > 1e-9:
+                    problems.append(
+                        f"cluster {cluster.id} {name}: limit={limit} used={taken} available={free}"
+                    )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--clusters", type=int, default=2)
+    parser.add_argument("--deployments", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--overlap", action="store_true", help="hand every deployment to two workers"
+    )
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        path = os.path.join(tempfile.mkdtemp(), "reservation_stress.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+
+    deployment_ids = seed(args.clusters, args.deployments, args.seed)
+    random.shuffle(deployment_ids)
+    chunks = [deployment_ids[i :: args.workers] for i in range(args.workers)]
+    if args.overlap and args.workers > 1:
+        # Each worker also gets its neighbour's share, in its own order
+        shares = [random.sample(chunk, len(chunk)) for chunk in chunks]
+        chunks = [chunk + shares[(i + 1) % args.workers] for i, chunk in enumerate(chunks)]
+
+    started = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(args.workers) as pool:
+        results = pool.starmap(run_worker, [(chunk, i) for i, chunk in enumerate(chunks)])
+    elapsed = time.perf_counter() - started
+    scheduled, conflicts = (sum(column) for column in zip(*results))
+
+    problems = verify()
+    print(
+        f"{args.workers} workers scheduled {scheduled}/{len(deployment_ids)} "
+        f"deployments in {elapsed:.2f}s ({conflicts} version conflicts)"
+    )
+    if scheduled > len(deployment_ids):
+        problems.append(f"{scheduled} deployments scheduled, {len(deployment_ids)} submitted")
+    for problem in problems:
+        print(f"OVER-COMMIT: {problem}")
+    print("no over-commit detected" if not problems else f"{len(problems)} problem(s)")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
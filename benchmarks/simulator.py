@@ -0,0 +1,308 @@
+"""
+Offline scheduling simulator for comparing placement strategies.
+
+Replays a trace of deployment submissions against a synthetic cluster fleet
+in simulated time, once per placement strategy, using the scheduler's own
+building blocks: ``CapacityIndex`` (extended by ``FleetIndex``) for fit
+checks, the strategies of
+``benchmarks.strategies`` to pick a cluster, and ``select_victims`` to
+preempt lower-priority work. A deployment that fits nowhere and cannot
+preempt waits until a deployment finishes and frees capacity, then is
+admitted most urgent first. Reports per strategy: time-weighted fleet
+utilization, preemptions, queue wait and scheduling decisions per second.
+
+The trace is JSON lines, one submission per line (``replicas`` is optional
+and the resources are per replica):
+    {"t": 12.5, "cpu": 2, "ram": 8, "gpu": 0, "priority": 3, "duration": 90, "replicas": 1}
+Without ``--trace`` a seeded synthetic trace is generated (and can be saved
+with ``--write-trace``).
+
+Usage:
+    python -m benchmarks.simulator --clusters 50 --deployments 20000 --load 0.9
+    python -m benchmarks.simulator --trace trace.jsonl --strategies best-fit drf
+"""
+import argparse
+import heapq
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from app.scheduler.capacity import CapacityIndex, demand_of
+from app.scheduler.pending import ADMISSION_SCAN_LIMIT
+from app.scheduler.preemption import select_victims
+from benchmarks.strategies import STRATEGIES, get_strategy
+
+# Cluster shapes of the synthetic fleet: (cpu, ram, gpu)
+CLUSTER_SHAPES = ((64, 256, 0), (32, 128, 4), (16, 64, 8))
+# Deployment shapes of the synthetic trace with their weights: (cpu, ram, gpu)
+DEPLOYMENT_SHAPES = (
+    ((1, 2, 0), 30),
+    ((2, 8, 0), 25),
+    ((8, 16, 0), 15),
+    ((4, 32, 0), 15),
+    ((4, 16, 1), 10),
+    ((8, 32, 4), 5),
+)
+
+
+class FleetIndex(CapacityIndex):
+    """
+    A CapacityIndex of the simulated fleet that also picks clusters and
+    holds the reservations.
+
+    The scheduler never picks a cluster and reserves through the database,
+    so only the simulator needs the cluster limits the strategies compare,
+    ``choose``, and in-memory ``reserve`` / ``release``. Clusters are
+    numbered by their position in ``fleet`` and are never discarded.
+    """
+
+    def __init__(self, fleet):
+        super().__init__(initial_size=len(fleet))
+        self._limits = np.array(fleet, dtype=np.float64).reshape(-1, 3)
+        for cluster_id, limits in enumerate(self._limits):
+            self.set(cluster_id, limits)
+
+    def choose(self, demand, strategy):
+        """
+        Return the cluster ``strategy`` picks among those that can host
+        ``demand``, or None if none can.
+        """
+        slots = np.flatnonzero((self._free[: self._size] >= demand).all(axis=1))
+        if not len(slots):
+            return None
+        ids = self._ids[slots]
+        chosen = strategy.choose(demand, self._free[slots], self._limits[ids])
+        return int(ids[chosen])
+
+    def reserve(self, cluster_id, demand):
+        self._free[self._slots[cluster_id]] -= demand
+
+    def release(self, cluster_id, demand):
+        self._free[self._slots[cluster_id]] += demand
+
+
+class Job:
+    """
+    One submission of the trace, shaped like a deployment for ``demand_of``.
+    """
+
+    def __init__(self, id, submitted, cpu, ram, gpu, priority, duration, replicas=1):
+        self.id = id
+        self.submitted = submitted
+        self.cpu_required = cpu
+        self.ram_required = ram
+        self.gpu_required = gpu
+        self.priority = priority
+        self.duration = duration
+        self.replicas = replicas
+        self.demand = demand_of(self)
+        self.cluster_id = None
+        self.started = None
+        self.preempted = False
+
+
+def synthetic_fleet(clusters):
+    return [CLUSTER_SHAPES[i % len(CLUSTER_SHAPES)] for i in range(clusters)]
+
+
+def synthetic_trace(fleet, deployments, load, mean_duration, seed):
+    """
+    Poisson submissions sized so that, on average, ``load`` of the fleet's
+    CPU is requested. Most submissions are low priority.
+    """
+    rng = random.Random(seed)
+    shapes, weights = zip(*DEPLOYMENT_SHAPES)
+    mean_cpu = sum(shape[0] * weight for shape, weight in DEPLOYMENT_SHAPES) / sum(weights)
+    fleet_cpu = sum(cluster[0] for cluster in fleet)
+    rate = load * fleet_cpu / (mean_cpu * mean_duration)
+    now = 0.0
+    for _ in range(deployments):
+        now += rng.expovariate(rate)
+        cpu, ram, gpu = rng.choices(shapes, weights=weights)[0]
+        yield {
+            "t": round(now, 3),
+            "cpu": cpu,
+            "ram": ram,
+            "gpu": gpu,
+            "priority": rng.choices((0, 2, 5, 9), weights=(5, 15, 30, 50))[0],
+            "duration": round(rng.expovariate(1 / mean_duration), 3),
+        }
+
+
+def read_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Simulation:
+    def __init__(self, fleet, trace, strategy, preemption=True):
+        self.strategy = strategy
+        self.preemption = preemption
+        self.capacity = FleetIndex(fleet)
+        self.limits = np.array(fleet, dtype=np.float64)
+        self.fleet_total = self.limits.sum(axis=0)
+        self.jobs = [
+            Job(
+                i,
+                item["t"],
+                item["cpu"],
+                item["ram"],
+                item["gpu"],
+                item["priority"],
+                item["duration"],
+                item.get("replicas", 1),
+            )
+            for i, item in enumerate(sorted(trace, key=lambda item: item["t"]))
+        ]
+        self.running = {cluster_id: {} for cluster_id in range(len(fleet))}
+        self.pending = []  # heap of (priority, submitted, id)
+        self.events = []  # heap of (time, seq, kind, job)
+        self.seq = 0
+        self.used = np.zeros(3)
+        self.used_area = np.zeros(3)
+        self.clock = 0.0
+        self.decisions = 0
+        self.decision_time = 0.0
+        self.preemptions = 0
+
+    def run(self):
+        for job in self.jobs:
+            self._push(job.submitted, "submit", job)
+        while self.events:
+            at, _, kind, job = heapq.heappop(self.events)
+            self.used_area += self.used * (at - self.clock)
+            self.clock = at
+            started = time.perf_counter()
+            if kind == "submit":
+                if not self._place(job):
+                    heapq.heappush(self.pending, (job.priority, job.submitted, job.id))
+            elif job.cluster_id is not None and not job.preempted:
+                self._stop(job)
+                self._admit()
+            self.decision_time += time.perf_counter() - started
+        return self.report()
+
+    def _push(self, at, kind, job):
+        heapq.heappush(self.events, (at, self.seq, kind, job))
+        self.seq += 1
+
+    def _place(self, job):
+        self.decisions += 1
+        cluster_id = self.capacity.choose(job.demand, self.strategy)
+        if cluster_id is None and self.preemption:
+            cluster_id = self._preempt_for(job)
+        if cluster_id is None:
+            return False
+        self._start(job, cluster_id)
+        return True
+
+    def _preempt_for(self, job):
+        """
+        Preempt the fewest lower-priority jobs on any one cluster to fit ``job``.
+        """
+        best, best_victims = None, None
+        for cluster_id, running in self.running.items():
+            if not (self.limits[cluster_id] >= job.demand).all():
+                continue
+            candidates = [other for other in running.values() if other.priority > job.priority]
+            victims = select_victims(candidates, job.demand - self.capacity.available(cluster_id))
+            if victims is not None and (best_victims is None or len(victims) < len(best_victims)):
+                best, best_victims = cluster_id, victims
+        for victim in best_victims or ():
+            victim.preempted = True
+            self._stop(victim)
+            self.preemptions += 1
+        return best
+
+    def _start(self, job, cluster_id):
+        job.cluster_id = cluster_id
+        job.started = self.clock
+        self.capacity.reserve(cluster_id, job.demand)
+        self.running[cluster_id][job.id] = job
+        self.used += job.demand
+        self._push(self.clock + job.duration, "finish", job)
+
+    def _stop(self, job):
+        self.capacity.release(job.cluster_id, job.demand)
+        del self.running[job.cluster_id][job.id]
+        self.used -= job.demand
+
+    def _admit(self):
+        """
+        Capacity was freed: place the most urgent waiting jobs that now fit.
+        """
+        waiting = heapq.nsmallest(ADMISSION_SCAN_LIMIT, self.pending)
+        placed = set()
+        for priority, submitted, job_id in waiting:
+            job = self.jobs[job_id]
+            self.decisions += 1
+            cluster_id = self.capacity.choose(job.demand, self.strategy)
+            if cluster_id is not None:
+                self._start(job, cluster_id)
+                placed.add(job_id)
+        if placed:
+            self.pending = [entry for entry in self.pending if entry[2] not in placed]
+            heapq.heapify(self.pending)
+
+    def report(self):
+        waits = sorted(job.started - job.submitted for job in self.jobs if job.started is not None)
+        pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))], 3) if waits else None
+        utilization = np.divide(
+            self.used_area,
+            self.fleet_total * self.clock,
+            out=np.zeros(3),
+            where=self.fleet_total * self.clock > 0,
+        )
+        return {
+            "utilization": {
+                name: round(float(share), 4) for name, share in zip(("cpu", "ram", "gpu"), utilization)
+            },
+            "placed": len(waits),
+            "never_placed": len(self.pending),
+            "preemptions": self.preemptions,
+            "queue_wait_s": {"p50": pick(0.50), "p99": pick(0.99), "max": pick(1.0)},
+            "decisions": self.decisions,
+            "decisions_per_second": round(self.decisions / self.decision_time) if self.decision_time else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--deployments", type=int, default=20000)
+    parser.add_argument("--load", type=float, default=0.9, help="requested CPU / fleet CPU")
+    parser.add_argument("--mean-duration", type=float, default=600.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--trace", help="replay this JSONL trace instead of a synthetic one")
+    parser.add_argument("--write-trace", help="save the synthetic trace to this file")
+    parser.add_argument("--strategies", nargs="+", default=sorted(STRATEGIES), choices=sorted(STRATEGIES))
+    parser.add_argument("--no-preemption", action="store_true")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    fleet = synthetic_fleet(args.clusters)
+    if args.trace:
+        trace = read_trace(args.trace)
+    else:
+        trace = list(synthetic_trace(fleet, args.deployments, args.load, args.mean_duration, args.seed))
+        if args.write_trace:
+            with open(args.write_trace, "w") as f:
+                f.writelines(json.dumps(item) + "\n" for item in trace)
+
+    results = {}
+    for name in args.strategies:
+        simulation = Simulation(fleet, trace, get_strategy(name), preemption=not args.no_preemption)
+        results[name] = simulation.run()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Placement strategies compared by the scheduling simulator.
+
+Deployments are submitted to a given cluster, so the scheduler itself never
+picks one; these strategies only drive the simulator's placement.
+"""
+import numpy as np
+
+
+def _shares(amounts, limits):
+    """
+    Divide (k, 3) ``amounts`` by ``limits``; resources a cluster lacks count as 0.
+    """
+    return np.divide(amounts, limits, out=np.zeros_like(amounts), where=limits > 0)
+
+
+class PlacementStrategy:
+    """
+    Picks which cluster hosts a deployment.
+
+    ``choose`` receives the demand and the (k, 3) free and limit arrays of
+    the k candidate clusters that can host it, in candidate order, and
+    returns the row of the chosen one. Strategies are stateless and compare
+    clusters with array operations only.
+    """
+
+    name = None
+
+    def choose(self, demand, free, limits):
+        raise NotImplementedError
+
+
+class FirstFit(PlacementStrategy):
+    """
+    The first candidate that fits.
+    """
+
+    name = "first-fit"
+
+    def choose(self, demand, free, limits):
+        return 0
+
+
+class BestFit(PlacementStrategy):
+    """
+    The candidate left with the least free capacity, as a share of its limits.
+
+    Packs clusters tightly and keeps whole clusters free for large deployments.
+    """
+
+    name = "best-fit"
+
+    def choose(self, demand, free, limits):
+        return int(np.argmin(_shares(free - demand, limits).sum(axis=1)))
+
+
+class WorstFit(PlacementStrategy):
+    """
+    The candidate left with the most free capacity, as a share of its limits.
+
+    Spreads load, leaving headroom on every cluster.
+    """
+
+    name = "worst-fit"
+
+    def choose(self, demand, free, limits):
+        return int(np.argmax(_shares(free - demand, limits).sum(axis=1)))
+
+
+class DominantResourceFit(PlacementStrategy):
+    """
+    Dominant resource fairness across CPU, RAM and GPU.
+
+    A cluster's dominant share is its highest used fraction over the three
+    resources. The candidate whose dominant share stays lowest after placing
+    the deployment wins, so no single resource of a cluster is exhausted
+    while the others sit idle (e.g. CPU-heavy work is kept off GPU clusters).
+    """
+
+    name = "drf"
+
+    def choose(self, demand, free, limits):
+        used = limits - free + demand
+        return int(np.argmin(_shares(used, limits).max(axis=1)))
+
+
+STRATEGIES = {
+    strategy.name: strategy for strategy in (FirstFit, BestFit, WorstFit, DominantResourceFit)
+}
+
+
+def get_strategy(name):
+    """
+    Return an instance of the strategy called ``name``.
+    """
+    try:
+        return STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown placement strategy {name!r}; choose from {sorted(STRATEGIES)}")
@@ -1,8 +1,19 @@
+import os
 from typing import Generator
 
+# The app reads these at import time
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("SESSION_COOKIE_NAME", "test-session")
+os.environ.setdefault("SESSION_MAX_AGE", "1800")
+os.environ.setdefault("OUTBOX_RELAY_IN_API", "false")
+# No broker in tests: queue and status events stay in the process
+os.environ.setdefault("QUEUE_BACKEND", "inprocess")
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.core.deps import get_db
@@ -15,6 +26,11 @@ engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The API runs on the async engine
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+TestingAsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
 
 
 @pytest.fixture(scope="session")
@@ -26,12 +42,9 @@ def db() -> Generator:
 
 @pytest.fixture(scope="module")
 def client() -> Generator:
-    def override_get_db():
-        try:
-            db = TestingSessionLocal()
+    async def override_get_db():
+        async with TestingAsyncSessionLocal() as db:
             yield db
-        finally:
-            db.close()
 
     app.dependency_overrides[get_db] = override_get_db
     with TestClient(app) as c:
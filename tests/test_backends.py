@@ -0,0 +1,108 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base
+from app.models.cluster import Cluster
+from app.models.deployment import Deployment, DeploymentStatus
+from app.models.queue_message import QueueMessage
+from app.queue import backends
+from app.queue.backends import InProcessBackend, TableQueueBackend, get_queue_backend
+from app.queue.events import StatusEvents
+from app.queue.outbox import OutboxRelay
+from app.queue.topology import DEAD_LETTER_QUEUE
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'queue.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_backend_is_created_on_first_use(monkeypatch):
+    created = []
+
+    def get_backend():
+        created.append(object())
+        return created[-1]
+
+    monkeypatch.setattr(backends, "get_backend", get_backend)
+    get_queue_backend.cache_clear()
+    try:
+        relay, events = OutboxRelay(), StatusEvents()
+        assert created == []
+
+        assert relay.publisher is events.backend is get_queue_backend()
+        assert len(created) == 1
+    finally:
+        get_queue_backend.cache_clear()
+
+
+@pytest.mark.parametrize("backend_class", [InProcessBackend, TableQueueBackend])
+def test_backends_deliver_the_most_urgent_first(backend_class, session_factory):
+    backend = backend_class(session_factory=session_factory)
+    priorities = [5, 0, 9, 0, 2, None]
+    backend.publish_many(
+        [{"deployment_id": i, "priority": priority} for i, priority in enumerate(priorities)]
+    )
+    take = backend.get_deliveries if backend_class is InProcessBackend else backend.claim
+
+    delivered = [json.loads(body)["deployment_id"] for _, _, body in take(len(priorities))]
+
+    # Lowest priority number first, FIFO among equals
+    assert delivered == [1, 3, 5, 4, 0, 2]
+
+
+def test_inprocess_backend_drops_dead_letters(session_factory):
+    backend = InProcessBackend(session_factory=session_factory)
+
+    for queue in (DEAD_LETTER_QUEUE, "urgent.dead"):
+        backend.basic_publish("", queue, json.dumps({"deployment_id": 1, "priority": 0}))
+
+    assert len(backend.tasks) == 0
+
+
+def test_table_backend_settles_by_tag(session_factory):
+    backend = TableQueueBackend(session_factory=session_factory)
+    backend.publish_many([{"deployment_id": i, "priority": 0} for i in range(5)])
+    tags = [method.delivery_tag for method, _, _ in backend.claim(5)]
+
+    backend.basic_ack(tags[1])
+    backend.basic_ack(tags[2], multiple=True)
+    backend.basic_nack(tags[4], requeue=True)
+
+    assert list(backend._unacked) == [tags[3]]
+    with session_factory() as db:
+        remaining = [row.id for row in db.query(QueueMessage.id).order_by(QueueMessage.id)]
+    assert remaining == [tags[3], tags[4]]
+    # The requeued message can be claimed again, the leased one cannot
+    assert [method.delivery_tag for method, _, _ in backend.claim(5)] == [tags[4]]
+
+
+def test_only_one_process_runs_the_inprocess_queue(session_factory, tmp_path):
+    with session_factory() as db:
+        cluster = Cluster(name="recovery", cpu_limit=4, ram_limit=8, gpu_limit=0)
+        db.add(cluster)
+        db.flush()
+        db.add_all(
+            Deployment(name=f"pending-{i}", cluster_id=cluster.id, status=DeploymentStatus.PENDING)
+            for i in range(3)
+        )
+        db.commit()
+    lock_file = str(tmp_path / "inprocess.lock")
+    first, second = (
+        InProcessBackend(session_factory=session_factory, lock_file=lock_file) for _ in range(2)
+    )
+
+    assert first.recover() == 3
+    with pytest.raises(RuntimeError):
+        second.recover()
+    assert len(second.tasks) == 0
+
+    # The lock goes with the process that held it
+    first.close()
+    assert second.recover() == 3
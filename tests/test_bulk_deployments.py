@@ -0,0 +1,156 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core import deps
+from app.core.cluster_limits import cluster_limits_cache
+from app.core.config import settings
+from app.db.base import Base
+from app.main import app
+from app.models.cluster import Cluster
+from app.models.cluster_usage import ClusterUsage
+from app.models.deployment import Deployment, DeploymentStatus
+from app.models.organization import Organization
+from app.models.outbox import OutboxMessage
+from app.models.user import User
+from app.queue import outbox
+from app.scheduler.usage import usage_rows
+from app.utils.jwt_utils import create_access_token
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    A client for a user of the ``own`` cluster's organization, whose API
+    sessions use a database of their own, and queue tasks go to the outbox.
+    """
+    path = tmp_path / "bulk.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    sessions = sessionmaker(bind=engine)
+    clusters = {}
+    with sessions() as db:
+        for name in ("own", "foreign"):
+            organization = Organization(name=name, invite_code=name)
+            db.add(organization)
+            db.flush()
+            clusters[name] = Cluster(
+                name=name,
+                organization_id=organization.id,
+                cpu_limit=4,
+                ram_limit=8,
+                gpu_limit=0,
+                cpu_available=4,
+                ram_available=8,
+                gpu_available=0,
+            )
+            db.add(clusters[name])
+            db.flush()
+            db.execute(insert(ClusterUsage), usage_rows(clusters[name].id))
+        db.add(User(username="bulk", email="bulk@example.com", organization_id=clusters["own"].organization_id))
+        db.commit()
+        clusters = {name: cluster.id for name, cluster in clusters.items()}
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(
+        deps, "AsyncSessionLocal", async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    )
+    monkeypatch.setattr(outbox, "get_queue_backend", lambda: SimpleNamespace(in_process=False))
+    cluster_limits_cache.clear()
+    headers = {"Authorization": f"Bearer {create_access_token(data={'sub': 'bulk'})}"}
+    client = TestClient(app, headers=headers)
+    yield SimpleNamespace(client=client, sessions=sessions, clusters=clusters)
+    cluster_limits_cache.clear()
+    engine.dispose()
+
+
+def deployment(name, cluster_id, cpu=1):
+    return {
+        "name": name,
+        "docker_image": "nginx",
+        "cpu_required": cpu,
+        "ram_required": 1,
+        "gpu_required": 0,
+        "priority": 2,
+        "cluster_id": cluster_id,
+    }
+
+
+def test_bulk_reports_each_item(api):
+    own, foreign = api.clusters["own"], api.clusters["foreign"]
+    response = api.client.post(
+        "/api/v1/deployments/bulk",
+        json=[
+            deployment("first", own),
+            deployment("too-big", own, cpu=5),
+            deployment("nowhere", 999),
+            deployment("trespassing", foreign),
+            deployment("second", own),
+        ],
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 2
+    results = body["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3, 4]
+    assert [result["error"] for result in results] == [
+        None,
+        "Insufficient CPU resources in the cluster",
+        "Cluster not found",
+        "User does not have permission to create a deployment in this cluster",
+        None,
+    ]
+    assert [result["id"] is not None for result in results] == [True, False, False, False, True]
+
+    with api.sessions() as db:
+        created = {
+            row.id: (row.name, row.status, row.cluster_id)
+            for row in db.query(Deployment).order_by(Deployment.id)
+        }
+        tasks = [
+            (row.deployment_id, row.priority)
+            for row in db.query(OutboxMessage).order_by(OutboxMessage.id)
+        ]
+        pending = db.get(ClusterUsage, (own, DeploymentStatus.PENDING))
+    assert created == {
+        results[0]["id"]: ("first", DeploymentStatus.PENDING, own),
+        results[4]["id"]: ("second", DeploymentStatus.PENDING, own),
+    }
+    # One queued task per created deployment, in the same transaction
+    assert tasks == [(results[0]["id"], 2), (results[4]["id"], 2)]
+    assert (pending.deployments, pending.cpu) == (2, 2)
+
+
+def test_bulk_with_nothing_valid_creates_nothing(api):
+    response = api.client.post(
+        "/api/v1/deployments/bulk", json=[deployment("trespassing", api.clusters["foreign"])]
+    )
+
+    assert response.status_code == 200
+    assert response.json()["created"] == 0
+    with api.sessions() as db:
+        assert db.query(Deployment).count() == 0
+        assert db.query(OutboxMessage).count() == 0
+
+
+def test_bulk_rejects_too_many_items(api, monkeypatch):
+    monkeypatch.setattr(settings, "BULK_DEPLOYMENTS_MAX_ITEMS", 2)
+    own = api.clusters["own"]
+
+    response = api.client.post(
+        "/api/v1/deployments/bulk", json=[deployment(f"d{i}", own) for i in range(3)]
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "At most 2 deployments per request"
+    with api.sessions() as db:
+        assert db.query(Deployment).count() == 0
+
+    response = api.client.post(
+        "/api/v1/deployments/bulk", json=[deployment(f"d{i}", own) for i in range(2)]
+    )
+    assert response.json()["created"] == 2
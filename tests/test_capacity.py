@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.cluster import Cluster
+from app.scheduler.capacity import CapacityIndex, demand_of
+from benchmarks.simulator import FleetIndex
+from benchmarks.strategies import get_strategy
+
+
+def make_deployment(cpu, ram, gpu, replicas=1):
+    return SimpleNamespace(
+        cpu_required=cpu, ram_required=ram, gpu_required=gpu, replicas=replicas
+    )
+
+
+@pytest.fixture
+def index():
+    index = CapacityIndex(initial_size=1)
+    index.set(1, (4, 8, 1))
+    index.set(2, (16, 32, 0))
+    return index
+
+
+def test_demand_of_scales_with_replicas():
+    assert demand_of(make_deployment(1, 2, 0.5)).tolist() == [1, 2, 0.5]
+    assert demand_of(make_deployment(1, 2, 0.5, replicas=3)).tolist() == [3, 6, 1.5]
+    # Rows written before replicas existed count as one replica
+    assert demand_of(make_deployment(1, 2, 0, replicas=None)).tolist() == [1, 2, 0]
+
+
+def test_fits(index):
+    assert index.fits(1, demand_of(make_deployment(4, 8, 1)))
+    assert not index.fits(1, demand_of(make_deployment(4, 8, 2)))
+    assert not index.fits(2, demand_of(make_deployment(1, 1, 1)))
+    # Replicas are reserved together
+    assert not index.fits(1, demand_of(make_deployment(2, 4, 1, replicas=2)))
+
+
+def test_discard_keeps_rows_contiguous(index):
+    index.set(3, (1, 1, 1))
+    index.discard(1)
+    assert len(index) == 2
+    assert 1 not in index
+    assert index.available(3).tolist() == [1, 1, 1]
+    assert index.available(2).tolist() == [16, 32, 0]
+    index.set(4, (2, 2, 2))
+    assert len(index) == 3
+    assert index.available(4).tolist() == [2, 2, 2]
+
+
+def test_load_and_refresh(db):
+    cluster = Cluster(
+        name="capacity",
+        cpu_limit=8,
+        ram_limit=16,
+        gpu_limit=2,
+        cpu_available=8,
+        ram_available=16,
+        gpu_available=2,
+    )
+    db.add(cluster)
+    db.commit()
+
+    index = CapacityIndex().load(db)
+    assert index.available(cluster.id).tolist() == [8, 16, 2]
+    index.set(cluster.id, (6, 12, 1))
+
+    # Another worker reserves capacity: the index is stale until refreshed
+    cluster.cpu_available = 5
+    cluster.ram_available = 10
+    cluster.gpu_available = 2
+    db.commit()
+    assert index.available(cluster.id).tolist() == [6, 12, 1]
+    assert index.refresh(db, cluster.id)
+    assert index.available(cluster.id).tolist() == [5, 10, 2]
+
+    assert not index.ensure(db, cluster.id + 1000)
+    assert index.ensure_many(db, {cluster.id, cluster.id + 1000}) == {cluster.id}
+
+
+def test_fleet_index_chooses_and_reserves():
+    index = FleetIndex([(4, 8, 1), (16, 32, 0), (8, 16, 0)])
+    demand = demand_of(make_deployment(1, 2, 0, replicas=2))
+
+    assert index.choose(demand, get_strategy("first-fit")) == 0
+    assert index.choose(demand_of(make_deployment(1, 1, 1)), get_strategy("first-fit")) == 0
+    assert index.choose(demand_of(make_deployment(32, 1, 0)), get_strategy("first-fit")) is None
+    # Reservations change what fits, not the limits strategies compare
+    index.reserve(0, demand)
+    assert index.available(0).tolist() == [2, 4, 1]
+    assert index.choose(demand_of(make_deployment(3, 1, 0)), get_strategy("first-fit")) == 1
+    index.release(0, demand)
+    assert index.available(0).tolist() == [4, 8, 1]
+    assert index._limits[0].tolist() == [4, 8, 1]
@@ -0,0 +1,384 @@
+import json
+import logging
+from datetime import datetime
+
+import pika
+import pytest
+from pika.spec import Basic
+from sqlalchemy import update
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.core.config import settings
+from app.models.cluster import Cluster
+from app.models.deployment import Deployment, DeploymentStatus
+from app.queue import consumer as consumer_module
+from app.queue.consumer import RabbitMQConsumer
+from app.queue.topology import (
+    DEAD_LETTER_QUEUE,
+    declare_retry_queues,
+    retry_delay_ms,
+    retry_queue_name,
+)
+from app.scheduler.scheduler import Scheduler
+from tests.conftest import TestingSessionLocal
+
+
+class Channel:
+    """
+    Records what the consumer does with its messages.
+    """
+
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.nacked.append((delivery_tag, multiple, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((routing_key, json.loads(body)))
+
+
+def message(delivery_tag, deployment, attempt=0):
+    body = json.dumps(
+        {"deployment_id": deployment.id, "priority": deployment.priority, "attempt": attempt}
+    )
+    return Basic.Deliver(delivery_tag=delivery_tag), pika.BasicProperties(headers={}), body
+
+
+@pytest.fixture
+def cluster(db):
+    cluster = Cluster(
+        name="consumer",
+        cpu_limit=8,
+        ram_limit=16,
+        gpu_limit=0,
+        cpu_available=8,
+        ram_available=16,
+        gpu_available=0,
+    )
+    db.add(cluster)
+    db.commit()
+    return cluster
+
+
+def add_deployments(db, cluster, count):
+    deployments = [
+        Deployment(
+            name=f"deployment-{i}",
+            cluster_id=cluster.id,
+            docker_image="image",
+            status=DeploymentStatus.PENDING,
+            priority=1,
+            cpu_required=1,
+            ram_required=1,
+            gpu_required=0,
+        )
+        for i in range(count)
+    ]
+    db.add_all(deployments)
+    db.commit()
+    return deployments
+
+
+class FailingConsumer(RabbitMQConsumer):
+    """
+    A consumer whose deployment runs fail for the ids in ``failing``.
+    """
+
+    def __init__(self, failing, **kwargs):
+        super().__init__(batch_size=10, **kwargs)
+        self.failing = failing
+
+    def execute_deployment(self, deployment):
+        if deployment.id in self.failing:
+            raise RuntimeError("deployment failed to start")
+
+
+def test_batch_defers_the_failing_deployment(db, cluster):
+    deployments = add_deployments(db, cluster, 3)
+    failing = deployments[1]
+    consumer = FailingConsumer({failing.id})
+    channel = Channel()
+
+    consumer.process_batch(channel, [message(i + 1, d) for i, d in enumerate(deployments)])
+
+    # Every message is settled, so the batch is acked at once
+    assert channel.acked == [(3, True)]
+    assert channel.nacked == []
+    db.expire_all()
+    assert [db.get(Deployment, d.id).status for d in deployments] == [
+        DeploymentStatus.COMPLETED,
+        DeploymentStatus.PENDING,
+        DeploymentStatus.COMPLETED,
+    ]
+    # The failing deployment is retried after a backoff
+    assert db.get(Deployment, failing.id).attempts == 1
+    assert channel.published == [
+        (
+            retry_queue_name(retry_delay_ms(0)),
+            {"deployment_id": failing.id, "priority": 1, "attempt": 1},
+        )
+    ]
+    # Only the placed deployments hold capacity
+    assert db.get(Cluster, cluster.id).cpu_available == 6
+
+
+def test_batch_requeues_only_unsettled_messages(db, cluster):
+    deployments = add_deployments(db, cluster, 3)
+    failing = deployments[0]
+
+    class UndeferrableConsumer(FailingConsumer):
+        def defer_deployment(self, ch, db, deployment):
+            raise RuntimeError("database unavailable")
+
+    consumer = UndeferrableConsumer({failing.id})
+    channel = Channel()
+
+    consumer.process_batch(channel, [message(i + 1, d) for i, d in enumerate(deployments)])
+
+    assert channel.nacked == [(1, False, True)]
+    assert channel.acked == [(2, False), (3, False)]
+    db.expire_all()
+    assert db.get(Deployment, failing.id).status == DeploymentStatus.PENDING
+    assert db.get(Deployment, failing.id).attempts == 0
+    assert db.get(Cluster, cluster.id).cpu_available == 6
+
+
+def test_retry_backoff_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_RETRY_BASE_DELAY_MS", 100)
+    monkeypatch.setattr(settings, "SCHEDULER_RETRY_MAX_DELAY_MS", 500)
+    assert [retry_delay_ms(attempt) for attempt in range(5)] == [100, 200, 400, 500, 500]
+
+
+def test_unschedulable_deployment_is_retried_then_dead_lettered(db, cluster):
+    (deployment,) = add_deployments(db, cluster, 1)
+    # Needs more than the whole cluster
+    deployment.cpu_required = 100
+    db.commit()
+    consumer = RabbitMQConsumer(max_retries=2)
+    channel = Channel()
+
+    for attempt in range(3):
+        consumer.process_deployment(
+            channel, *message(attempt + 1, deployment, attempt=attempt)
+        )
+        db.expire_all()
+
+    assert channel.acked == [(1, False), (2, False), (3, False)]
+    assert [routing_key for routing_key, body in channel.published] == [
+        retry_queue_name(retry_delay_ms(0)),
+        retry_queue_name(retry_delay_ms(1)),
+        DEAD_LETTER_QUEUE,
+    ]
+    assert [body["attempt"] for routing_key, body in channel.published] == [1, 2, 2]
+    assert channel.published[-1][1]["reason"] == "unschedulable"
+    deployment = db.get(Deployment, deployment.id)
+    assert deployment.status == DeploymentStatus.FAILED
+    assert deployment.attempts == 2
+    assert db.get(Cluster, cluster.id).cpu_available == 8
+
+
+def test_retry_queues_follow_the_consumer(db, cluster, monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_RETRY_BASE_DELAY_MS", 100)
+    monkeypatch.setattr(settings, "SCHEDULER_RETRY_MAX_DELAY_MS", 300)
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_RETRIES", 1)
+    (deployment,) = add_deployments(db, cluster, 1)
+    deployment.cpu_required = 100
+    db.commit()
+    consumer = RabbitMQConsumer(queue_name="urgent", max_retries=4)
+    channel = Channel()
+    declared = {}
+    channel.queue_declare = lambda queue, durable, arguments=None: declared.update(
+        {queue: arguments}
+    )
+
+    declare_retry_queues(channel, consumer.queue_name, consumer.max_retries)
+    for attempt in range(5):
+        consumer.process_deployment(channel, *message(attempt + 1, deployment, attempt=attempt))
+        db.expire_all()
+
+    # One delay queue per step of this consumer's ladder, back onto its queue
+    assert declared == {
+        **{
+            f"urgent.retry.{delay}ms": {
+                "x-message-ttl": delay,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": "urgent",
+            }
+            for delay in (100, 200, 300)
+        },
+        "urgent.dead": None,
+    }
+    assert [routing_key for routing_key, body in channel.published] == [
+        "urgent.retry.100ms",
+        "urgent.retry.200ms",
+        "urgent.retry.300ms",
+        "urgent.retry.300ms",
+        "urgent.dead",
+    ]
+    assert {routing_key for routing_key, body in channel.published} <= set(declared)
+
+
+def test_superseded_retry_is_ignored(db, cluster):
+    (deployment,) = add_deployments(db, cluster, 1)
+    deployment.cpu_required = 100
+    deployment.attempts = 1
+    db.commit()
+    channel = Channel()
+
+    RabbitMQConsumer().process_deployment(channel, *message(1, deployment, attempt=0))
+
+    assert channel.acked == [(1, False)]
+    assert channel.published == []
+    db.expire_all()
+    assert db.get(Deployment, deployment.id).attempts == 1
+
+
+def test_admission_follows_submit_time(db, cluster):
+    released, later, earlier = add_deployments(db, cluster, 3)
+    released.status = DeploymentStatus.TERMINATED
+    # Ids and submit times disagree: the older submission must go first
+    later.created_at = datetime(2030, 1, 2)
+    earlier.created_at = datetime(2030, 1, 1)
+    cluster.cpu_available = 1
+    db.commit()
+
+    RabbitMQConsumer().on_capacity_freed(db, released.id)
+
+    db.expire_all()
+    assert db.get(Deployment, earlier.id).status == DeploymentStatus.COMPLETED
+    assert db.get(Deployment, later.id).status == DeploymentStatus.PENDING
+    assert db.get(Cluster, cluster.id).cpu_available == 0
+
+
+def test_batch_follows_submit_time(db, cluster):
+    later, earlier = add_deployments(db, cluster, 2)
+    later.created_at = datetime(2030, 1, 2)
+    earlier.created_at = datetime(2030, 1, 1)
+    cluster.cpu_available = 1
+    db.commit()
+    channel = Channel()
+
+    RabbitMQConsumer(batch_size=10).process_batch(
+        channel, [message(1, later), message(2, earlier)]
+    )
+
+    db.expire_all()
+    assert db.get(Deployment, earlier.id).status == DeploymentStatus.COMPLETED
+    assert db.get(Deployment, later.id).status == DeploymentStatus.PENDING
+
+
+def test_stale_cluster_write_is_rejected(db, cluster):
+    first, second = TestingSessionLocal(), TestingSessionLocal()
+    try:
+        mine, theirs = first.get(Cluster, cluster.id), second.get(Cluster, cluster.id)
+        mine.cpu_available -= 1
+        first.commit()
+
+        # Read before the first commit: the version no longer matches
+        theirs.cpu_available -= 2
+        with pytest.raises(StaleDataError):
+            second.commit()
+    finally:
+        first.close()
+        second.close()
+    db.expire_all()
+    assert db.get(Cluster, cluster.id).cpu_available == 7
+
+
+class ContendedScheduler(Scheduler):
+    """
+    A scheduler racing another worker: every deployment it is given is
+    written by another session before the placement commits.
+    """
+
+    def schedule_deployment(self, deployment, cluster=None):
+        self._touch([deployment])
+        return super().schedule_deployment(deployment, cluster)
+
+    def schedule_batch(self, deployments):
+        self._touch(deployments)
+        return super().schedule_batch(deployments)
+
+    @staticmethod
+    def _touch(deployments):
+        with TestingSessionLocal() as other:
+            other.execute(
+                update(Deployment)
+                .where(Deployment.id.in_([deployment.id for deployment in deployments]))
+                .values(version=Deployment.version + 1)
+            )
+            other.commit()
+
+
+@pytest.fixture
+def contended(monkeypatch):
+    monkeypatch.setattr(consumer_module, "Scheduler", ContendedScheduler)
+
+
+def test_deployments_that_keep_conflicting_are_retried_later(db, cluster, contended, caplog):
+    deployments = add_deployments(db, cluster, 2)
+    channel = Channel()
+
+    with caplog.at_level(logging.INFO, logger="app.queue.consumer"):
+        RabbitMQConsumer(batch_size=10, conflict_retries=2).process_batch(
+            channel, [message(i + 1, d) for i, d in enumerate(deployments)]
+        )
+
+    # Deferred like unschedulable deployments, not handled as errors
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+    assert channel.acked == [(2, True)]
+    assert channel.published == [
+        (
+            retry_queue_name(retry_delay_ms(0)),
+            {"deployment_id": d.id, "priority": 1, "attempt": 1},
+        )
+        for d in deployments
+    ]
+    db.expire_all()
+    for d in deployments:
+        assert db.get(Deployment, d.id).status == DeploymentStatus.PENDING
+        assert db.get(Deployment, d.id).attempts == 1
+    # Every reservation was rolled back with its conflicting commit
+    assert db.get(Cluster, cluster.id).cpu_available == 8
+
+
+def test_contended_admission_leaves_deployments_to_their_retries(db, cluster, contended):
+    released, waiting = add_deployments(db, cluster, 2)
+    released.status = DeploymentStatus.TERMINATED
+    db.commit()
+
+    RabbitMQConsumer(conflict_retries=2).on_capacity_freed(db, released.id)
+
+    db.expire_all()
+    assert db.get(Deployment, waiting.id).status == DeploymentStatus.PENDING
+    assert db.get(Cluster, cluster.id).cpu_available == 8
+
+
+def test_unexpected_error_retries_the_message_later(db, cluster):
+    (deployment,) = add_deployments(db, cluster, 1)
+
+    class BrokenConsumer(RabbitMQConsumer):
+        def settle_deployment(self, ch, db, deployment, path="single"):
+            raise RuntimeError("database unavailable")
+
+    channel = Channel()
+
+    BrokenConsumer().process_deployment(channel, *message(1, deployment))
+
+    # Not rejected: the deployment queue has no dead-letter exchange
+    assert channel.nacked == []
+    assert channel.acked == [(1, False)]
+    assert channel.published == [
+        (
+            retry_queue_name(retry_delay_ms(0)),
+            {"deployment_id": deployment.id, "priority": 1, "attempt": 0},
+        )
+    ]
+    db.expire_all()
+    assert db.get(Deployment, deployment.id).status == DeploymentStatus.PENDING
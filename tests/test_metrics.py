@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+def test_requests_are_labelled_with_their_route_template():
+    client = TestClient(app)
+    client.post("/api/v1/deployments/12345/terminate")
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert (
+        'http_request_duration_seconds_count{method="POST",'
+        'route="/api/v1/deployments/{deployment_id}/terminate",status="401"}'
+    ) in body
+    assert 'route="unmatched",status="404"' in body
+    assert "12345" not in body
+    assert "scheduler_decision_seconds" in body
@@ -0,0 +1,57 @@
+import pytest
+
+from app.models.outbox import OutboxMessage
+from app.queue.outbox import OutboxRelay
+from tests.conftest import TestingSessionLocal
+
+
+class Publisher:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.published = []
+
+    def publish_many(self, messages):
+        if self.fail:
+            raise ConnectionError("broker unavailable")
+        self.published.extend(messages)
+
+
+@pytest.fixture
+def outbox(db):
+    db.query(OutboxMessage).delete()
+    db.add_all(
+        [
+            OutboxMessage(deployment_id=1, priority=2),
+            OutboxMessage(deployment_id=2, priority=0, event="capacity_freed"),
+            OutboxMessage(deployment_id=3, priority=1),
+        ]
+    )
+    db.commit()
+    yield db
+    db.query(OutboxMessage).delete()
+    db.commit()
+
+
+def test_relay_deletes_what_it_sent(outbox):
+    publisher = Publisher()
+    relay = OutboxRelay(session_factory=TestingSessionLocal, publisher=publisher, batch_size=2)
+
+    assert relay.relay_once() == 2
+    assert outbox.query(OutboxMessage.deployment_id).all() == [(3,)]
+    assert relay.relay_once() == 1
+    assert relay.relay_once() == 0
+
+    assert outbox.query(OutboxMessage).count() == 0
+    assert publisher.published == [
+        {"deployment_id": 1, "priority": 2},
+        {"deployment_id": 2, "priority": 0, "event": "capacity_freed"},
+        {"deployment_id": 3, "priority": 1},
+    ]
+
+
+def test_relay_keeps_rows_it_failed_to_send(outbox):
+    relay = OutboxRelay(session_factory=TestingSessionLocal, publisher=Publisher(fail=True))
+
+    with pytest.raises(ConnectionError):
+        relay.relay_once()
+    assert outbox.query(OutboxMessage).count() == 3
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core import deps
+from app.db.base import Base
+from app.main import app
+from app.models.cluster import Cluster
+from app.models.organization import Organization
+from app.models.user import User
+from app.utils.jwt_utils import create_access_token
+
+
+@pytest.fixture
+def other_db(tmp_path, monkeypatch):
+    """
+    Serve the API's sessions from a database of its own and return its engine.
+    """
+    path = tmp_path / "pagination.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        organization = Organization(name="streaming", invite_code="STREAM")
+        db.add(organization)
+        db.flush()
+        db.add(User(username="streamer", email="streamer@example.com", organization_id=organization.id))
+        db.add_all(
+            Cluster(
+                name=f"cluster-{i}",
+                organization_id=organization.id,
+                cpu_limit=4,
+                ram_limit=8,
+                gpu_limit=0,
+                cpu_available=4,
+                ram_available=8,
+                gpu_available=0,
+            )
+            for i in range(5)
+        )
+        db.commit()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(
+        deps, "AsyncSessionLocal", async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    )
+    yield async_engine
+    engine.dispose()
+
+
+def test_ndjson_stream_returns_its_connection(other_db):
+    headers = {"Authorization": f"Bearer {create_access_token(data={'sub': 'streamer'})}"}
+    response = TestClient(app).get(
+        "/api/v1/clusters/", params={"format": "ndjson", "after_id": 1}, headers=headers
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    clusters = [json.loads(line) for line in response.text.splitlines()]
+    assert [cluster["name"] for cluster in clusters] == [f"cluster-{i}" for i in range(1, 5)]
+    # The stream's session is closed with the response
+    assert other_db.pool.checkedout() == 0
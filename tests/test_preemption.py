@@ -0,0 +1,122 @@
+from itertools import combinations
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.scheduler.preemption import EXACT_SEARCH_LIMIT, select_victims
+
+
+def victim(priority, cpu, ram=0, gpu=0, replicas=1):
+    return SimpleNamespace(
+        priority=priority,
+        cpu_required=cpu,
+        ram_required=ram,
+        gpu_required=gpu,
+        replicas=replicas,
+    )
+
+
+def frees(victims, deficit):
+    freed = np.zeros(3)
+    for v in victims:
+        freed += v.replicas * np.array((v.cpu_required, v.ram_required, v.gpu_required))
+    return (freed >= deficit).all()
+
+
+def smallest_cover(candidates, deficit):
+    for size in range(1, len(candidates) + 1):
+        if any(frees(subset, deficit) for subset in combinations(candidates, size)):
+            return size
+
+
+def test_nothing_to_free():
+    assert select_victims([victim(5, 1)], (0, 0, 0)) == []
+    assert select_victims([victim(5, 1)], (-1, 0, 0)) == []
+
+
+def test_not_enough_to_free():
+    assert select_victims([], (1, 0, 0)) is None
+    assert select_victims([victim(5, 1), victim(6, 1)], (3, 0, 0)) is None
+
+
+def test_exact_prefers_fewest_victims():
+    small = [victim(9, 1) for _ in range(3)]
+    large = victim(2, 3)
+    assert select_victims(small + [large], (3, 0, 0)) == [large]
+
+
+def test_exact_prefers_lowest_priority_among_equal_sizes():
+    candidates = [victim(3, 2), victim(8, 2), victim(5, 2)]
+    assert select_victims(candidates, (2, 0, 0)) == [candidates[1]]
+
+
+def test_exact_covers_every_resource():
+    cpu_only = victim(9, 4)
+    gpu_only = victim(9, 0, gpu=1)
+    both = victim(1, 2, gpu=1)
+    assert select_victims([cpu_only, gpu_only, both], (2, 0, 1)) == [both]
+    chosen = select_victims([cpu_only, gpu_only], (2, 0, 1))
+    assert sorted(chosen, key=id) == sorted([cpu_only, gpu_only], key=id)
+
+
+def test_exact_counts_replicas():
+    replicated = victim(1, 1, replicas=4)
+    assert select_victims([victim(9, 2), victim(9, 2), replicated], (4, 0, 0)) == [replicated]
+
+
+def test_exact_is_minimal():
+    rng = np.random.default_rng(7)
+    for _ in range(50):
+        candidates = [
+            victim(int(rng.integers(1, 10)), *rng.integers(0, 5, size=3).tolist())
+            for _ in range(int(rng.integers(1, EXACT_SEARCH_LIMIT + 1)))
+        ]
+        deficit = rng.integers(0, 8, size=3)
+        chosen = select_victims(candidates, deficit)
+        if chosen is None:
+            assert not frees(candidates, deficit)
+            continue
+        assert frees(chosen, deficit)
+        assert len(chosen) == (smallest_cover(candidates, deficit) if deficit.any() else 0)
+
+
+def test_greedy_takes_lowest_priority_first():
+    candidates = [victim(priority, 1) for priority in range(EXACT_SEARCH_LIMIT + 8)]
+    chosen = select_victims(candidates, (3, 0, 0))
+    assert sorted(v.priority for v in chosen) == [17, 18, 19]
+
+
+def test_greedy_prunes_unneeded_victims():
+    # Greedy packs the low-priority small ones before reaching the large one,
+    # which then covers the deficit on its own
+    candidates = [victim(1, 1) for _ in range(EXACT_SEARCH_LIMIT)]
+    small = [victim(9, 1), victim(8, 1)]
+    large = victim(7, 4)
+    chosen = select_victims(candidates + small + [large], (4, 0, 0))
+    assert chosen == [large]
+
+
+def test_greedy_result_is_minimal():
+    rng = np.random.default_rng(11)
+    for _ in range(20):
+        candidates = [
+            victim(int(rng.integers(1, 10)), *rng.integers(0, 5, size=3).tolist())
+            for _ in range(EXACT_SEARCH_LIMIT + 6)
+        ]
+        deficit = rng.integers(1, 10, size=3)
+        chosen = select_victims(candidates, deficit)
+        if chosen is None:
+            assert not frees(candidates, deficit)
+            continue
+        assert frees(chosen, deficit)
+        # No victim can be given back
+        for i in range(len(chosen)):
+            assert not frees(chosen[:i] + chosen[i + 1:], deficit)
+
+
+def test_exact_limit_switches_to_greedy():
+    candidates = [victim(9, 1), victim(9, 1), victim(1, 2)]
+    assert select_victims(candidates, (2, 0, 0)) == [candidates[2]]
+    # Greedy starts from the lowest priority and prunes nothing here
+    chosen = select_victims(candidates, (2, 0, 0), exact_limit=0)
+    assert sorted(v.priority for v in chosen) == [9, 9]
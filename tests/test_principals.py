@@ -0,0 +1,71 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core import deps
+from app.core.principals import principal_cache
+from app.db.base import Base
+from app.main import app
+from app.models.cluster import Cluster
+from app.models.organization import Organization
+from app.models.user import User
+from app.utils.jwt_utils import create_access_token
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    A client whose API sessions use a database of their own, holding a user
+    outside any organization and an organization with one cluster.
+    """
+    path = tmp_path / "principals.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        organization = Organization(name="joined", invite_code="JOINME")
+        db.add(organization)
+        db.flush()
+        db.add(User(username="joiner", email="joiner@example.com"))
+        db.add(
+            Cluster(
+                name="shared",
+                organization_id=organization.id,
+                cpu_limit=4,
+                ram_limit=8,
+                gpu_limit=0,
+                cpu_available=4,
+                ram_available=8,
+                gpu_available=0,
+            )
+        )
+        db.commit()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(
+        deps, "AsyncSessionLocal", async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    )
+    principal_cache.clear()
+    yield TestClient(app)
+    principal_cache.clear()
+    engine.dispose()
+
+
+def test_joining_an_organization_refreshes_the_cached_principal(api):
+    token = create_access_token(data={"sub": "joiner"})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = api.get("/api/v1/clusters/", headers=headers)
+    assert response.status_code == 404
+    assert principal_cache.get(token).organization_id is None
+
+    response = api.post("/api/v1/organizations/JOINME/join", headers=headers)
+    assert response.status_code == 200
+
+    # Same token, next request: the principal is resolved again
+    response = api.get("/api/v1/clusters/", headers=headers)
+    assert response.status_code == 200
+    assert [cluster["name"] for cluster in response.json()] == ["shared"]
+    response = api.post("/api/v1/organizations/JOINME/join", headers=headers)
+    assert response.status_code == 400
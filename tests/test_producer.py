@@ -0,0 +1,123 @@
+import json
+
+from pika.exceptions import AMQPConnectionError
+
+from app.queue import producer
+from app.queue.producer import DeploymentPublisher
+from app.queue.topology import MAX_PRIORITY
+
+
+class Channel:
+    is_closed = False
+
+    def __init__(self, log):
+        self.log = log
+
+    def tx_select(self):
+        self.log.append("tx_select")
+
+    def tx_commit(self):
+        self.log.append("tx_commit")
+
+    def queue_declare(self, **kwargs):
+        pass
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.log.append(("publish", json.loads(body)["deployment_id"]))
+
+
+class Connection:
+    is_closed = False
+    is_open = True
+
+    def __init__(self, log, failures):
+        self.log = log
+        self.failures = failures
+
+    def channel(self):
+        if self.failures:
+            self.failures.pop()
+            raise AMQPConnectionError("connection lost")
+        return Channel(self.log)
+
+    def process_data_events(self, time_limit=None):
+        self.log.append("heartbeat")
+
+    def close(self):
+        self.is_open = False
+
+
+def broker(monkeypatch, failures=0):
+    log, pending_failures = [], [None] * failures
+    monkeypatch.setattr(
+        producer.pika,
+        "BlockingConnection",
+        lambda parameters: Connection(log, pending_failures),
+    )
+    return log
+
+
+def test_batch_is_committed_once(monkeypatch):
+    log = broker(monkeypatch)
+    publisher = DeploymentPublisher()
+
+    publisher.publish_many([{"deployment_id": i, "priority": 0} for i in (1, 2, 3)])
+    publisher.publish_many([{"deployment_id": 4, "priority": 0}])
+
+    assert log == [
+        "tx_select",
+        ("publish", 1),
+        ("publish", 2),
+        ("publish", 3),
+        "tx_commit",
+        ("publish", 4),
+        "tx_commit",
+    ]
+
+
+def test_urgent_deployments_get_the_higher_amqp_priority(monkeypatch):
+    log = broker(monkeypatch)
+    published = []
+    monkeypatch.setattr(
+        Channel,
+        "basic_publish",
+        lambda self, exchange, routing_key, body, properties=None: published.append(
+            (properties.priority, json.loads(body)["deployment_id"])
+        ),
+    )
+    priorities = [5, 0, 9, 0, 2, None, 50]
+
+    DeploymentPublisher().publish_many(
+        [{"deployment_id": i, "priority": priority} for i, priority in enumerate(priorities)]
+    )
+
+    assert all(0 <= priority <= MAX_PRIORITY for priority, _ in published)
+    # The order a priority queue delivers them in: highest AMQP priority
+    # first, FIFO among equals (sorted() is stable)
+    delivered = [i for _, i in sorted(published, key=lambda item: -item[0])]
+    assert delivered == [1, 3, 5, 4, 0, 2, 6]
+    assert log == ["tx_select", "tx_commit"]
+
+
+def test_reconnects_once(monkeypatch):
+    log = broker(monkeypatch, failures=1)
+    publisher = DeploymentPublisher()
+
+    publisher.publish_many([{"deployment_id": 1, "priority": 0}])
+
+    assert log == ["tx_select", ("publish", 1), "tx_commit"]
+
+
+def test_heartbeat_services_the_open_connection(monkeypatch):
+    log = broker(monkeypatch)
+    publisher = DeploymentPublisher()
+
+    # Nothing to keep alive before the first publish
+    publisher.heartbeat()
+    publisher.publish_many([{"deployment_id": 1, "priority": 0}])
+    publisher.heartbeat()
+
+    assert log == ["tx_select", ("publish", 1), "tx_commit", "heartbeat"]
@@ -0,0 +1,231 @@
+"""
+Query-plan regression tests for the hot queries.
+
+A large SQLite dataset is seeded and analyzed once, then SQLite's plan
+(EXPLAIN QUERY PLAN) of every hot query of the API, the scheduler and the
+outbox relay must read its table through the index meant for it, and read
+no other table with a full scan.
+"""
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert, select, text
+
+from app.db.base import Base
+from app.models.cluster import Cluster
+from app.models.cluster_usage import ClusterUsage
+from app.models.deployment import Deployment, DeploymentStatus
+from app.models.organization import Organization
+from app.models.outbox import OutboxMessage
+from app.models.queue_message import QueueMessage
+from app.models.user import User
+from app.scheduler.usage import usage_rows
+
+CLUSTERS = 200
+DEPLOYMENTS = 20000
+
+_org_clusters = select(Cluster.id).where(Cluster.organization_id == 3)
+
+# (code issuing the query, statement, plan step(s) expected for its main table)
+HOT_QUERIES = [
+    (
+        "deps.get_current_user",
+        select(User).where(User.username == "user-7"),
+        "SEARCH user USING INDEX ix_user_username",
+    ),
+    (
+        "Scheduler.preempt_deployments candidates",
+        select(
+            Deployment.id,
+            Deployment.priority,
+            Deployment.cpu_required,
+            Deployment.ram_required,
+            Deployment.gpu_required,
+            Deployment.replicas,
+        ).where(
+            Deployment.cluster_id == 7,
+            Deployment.status == DeploymentStatus.COMPLETED,
+            Deployment.priority > 4,
+        ),
+        "SEARCH deployment USING INDEX ix_deployment_cluster_status_priority",
+    ),
+    (
+        "CapacityIndex.ensure_many",
+        select(
+            Cluster.id,
+            Cluster.cpu_available,
+            Cluster.ram_available,
+            Cluster.gpu_available,
+            Cluster.cpu_limit,
+            Cluster.ram_limit,
+            Cluster.gpu_limit,
+        ).where(Cluster.id.in_([1, 2, 3])),
+        "SEARCH cluster USING INTEGER PRIMARY KEY",
+    ),
+    (
+        "list_clusters page",
+        select(Cluster)
+        .where(Cluster.organization_id == 3, Cluster.id > 0)
+        .order_by(Cluster.id)
+        .limit(100),
+        "SEARCH cluster USING INDEX ix_cluster_organization_id",
+    ),
+    (
+        "list_deployments page",
+        select(Deployment)
+        .where(Deployment.cluster_id.in_(_org_clusters), Deployment.id > 1000)
+        .order_by(Deployment.id)
+        .limit(100),
+        "SEARCH deployment USING INTEGER PRIMARY KEY",
+    ),
+    (
+        "list_deployments filtered page",
+        select(Deployment)
+        .where(
+            Deployment.cluster_id.in_(_org_clusters),
+            Deployment.status == DeploymentStatus.RUNNING,
+            Deployment.cluster_id == 8,
+        )
+        .order_by(Deployment.id)
+        .limit(100),
+        # Either index narrows the page to one cluster
+        (
+            "SEARCH deployment USING INDEX ix_deployment_cluster_id_id",
+            "SEARCH deployment USING INDEX ix_deployment_cluster_status_priority",
+        ),
+    ),
+    (
+        "PendingIndex.load",
+        select(Deployment.id)
+        .where(Deployment.cluster_id == 7, Deployment.status == DeploymentStatus.PENDING)
+        .order_by(Deployment.priority, Deployment.created_at, Deployment.id)
+        .limit(1000),
+        "SEARCH deployment USING INDEX ix_deployment_pending",
+    ),
+    (
+        "get_cluster_utilization",
+        select(ClusterUsage).where(ClusterUsage.cluster_id == 7),
+        "SEARCH clusterusage USING INDEX sqlite_autoindex_clusterusage_1",
+    ),
+    (
+        # The relay deletes what it sent, so the table only holds unsent rows
+        # and walking it in primary key order is the plan
+        "OutboxRelay.relay_once",
+        select(OutboxMessage.id, OutboxMessage.deployment_id, OutboxMessage.priority)
+        .order_by(OutboxMessage.id)
+        .limit(500),
+        "SCAN outboxmessage",
+    ),
+    (
+        "TableQueueBackend.claim",
+        select(QueueMessage.id)
+        .where(
+            QueueMessage.queue == "deployment_queue",
+            QueueMessage.available_at <= datetime(2030, 1, 1),
+        )
+        .order_by(QueueMessage.priority, QueueMessage.id)
+        .limit(64),
+        "SEARCH queuemessage USING INDEX ix_queuemessage_ready",
+    ),
+    (
+        "TableQueueBackend.consume_events",
+        select(QueueMessage.id, QueueMessage.body)
+        .where(
+            QueueMessage.queue == "deployment_events",
+            QueueMessage.priority == 0,
+            QueueMessage.id > 1000,
+        )
+        .order_by(QueueMessage.id),
+        "SEARCH queuemessage USING INDEX ix_queuemessage_ready",
+    ),
+]
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'query_plans.db'}")
+    rng = random.Random(3)
+    organizations = CLUSTERS // 5
+    statuses = list(DeploymentStatus)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(Organization),
+            [{"id": i + 1, "name": f"org-{i}", "invite_code": f"INV{i:05d}"} for i in range(organizations)],
+        )
+        connection.execute(
+            insert(User),
+            [
+                {
+                    "username": f"user-{i}",
+                    "email": f"user-{i}@example.com",
+                    "hashed_password": "x",
+                    "organization_id": i % organizations + 1,
+                }
+                for i in range(organizations * 10)
+            ],
+        )
+        connection.execute(
+            insert(Cluster),
+            [
+                {
+                    "id": i + 1,
+                    "name": f"cluster-{i}",
+                    "organization_id": i % organizations + 1,
+                    "cpu_limit": 64,
+                    "ram_limit": 256,
+                    "gpu_limit": 8,
+                    "cpu_available": 64,
+                    "ram_available": 256,
+                    "gpu_available": 8,
+                }
+                for i in range(CLUSTERS)
+            ],
+        )
+        connection.execute(
+            insert(ClusterUsage),
+            [row for i in range(CLUSTERS) for row in usage_rows(i + 1)],
+        )
+        connection.execute(
+            insert(Deployment),
+            [
+                {
+                    "name": f"deployment-{i}",
+                    "docker_image": "image:latest",
+                    "cluster_id": rng.randint(1, CLUSTERS),
+                    "status": rng.choice(statuses),
+                    "priority": rng.randint(0, 10),
+                    "cpu_required": 1,
+                    "ram_required": 1,
+                    "gpu_required": 0,
+                }
+                for i in range(DEPLOYMENTS)
+            ],
+        )
+        # The relay deletes what it sent: only the newest rows are left
+        connection.execute(
+            insert(OutboxMessage),
+            [{"deployment_id": DEPLOYMENTS - i, "priority": 0} for i in range(100)],
+        )
+        connection.execute(text("ANALYZE"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize(
+    "statement, expected",
+    [pytest.param(statement, expected, id=name) for name, statement, expected in HOT_QUERIES],
+)
+def test_hot_query_uses_its_index(engine, statement, expected):
+    sql = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        plan = [row[3] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+    assert any(step.startswith(expected) for step in plan), plan
+    full_scans = [
+        step
+        for step in plan
+        if step.startswith("SCAN ") and not step.startswith((expected, "SCAN CONSTANT"))
+    ]
+    assert not full_scans, plan
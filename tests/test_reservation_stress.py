@@ -0,0 +1,125 @@
+"""
+Concurrent consumers in separate processes must never over-commit a cluster.
+"""
+import multiprocessing
+import random
+
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base
+from app.models.cluster import Cluster
+from app.models.deployment import Deployment, DeploymentStatus
+
+WORKERS = 4
+CLUSTERS = 2
+DEPLOYMENTS = 200
+
+
+class Channel:
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        pass
+
+
+def consume(deployment_ids):
+    """
+    Schedule ``deployment_ids`` with a consumer of this process's own.
+
+    Runs in a spawned process, which reads DATABASE_URL afresh.
+    """
+    from app.db.session import SessionLocal
+    from app.queue.consumer import RabbitMQConsumer
+
+    consumer = RabbitMQConsumer(max_retries=0)
+    channel = Channel()
+    with SessionLocal() as db:
+        consumer.capacity.load(db)
+        for deployment_id in deployment_ids:
+            deployment = db.get(Deployment, deployment_id)
+            if deployment.status == DeploymentStatus.PENDING:
+                consumer.settle_deployment(channel, db, deployment)
+            db.expire_all()
+
+
+@pytest.fixture
+def stress_db(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'reservation_stress.db'}"
+    monkeypatch.setenv("DATABASE_URL", url)
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def seed(session_factory):
+    rng = random.Random(1)
+    with session_factory() as db:
+        clusters = [
+            Cluster(
+                name=f"stress-{i}",
+                cpu_limit=32,
+                ram_limit=64,
+                gpu_limit=4,
+                cpu_available=32,
+                ram_available=64,
+                gpu_available=4,
+            )
+            for i in range(CLUSTERS)
+        ]
+        db.add_all(clusters)
+        db.flush()
+        deployments = [
+            Deployment(
+                name=f"stress-{i}",
+                docker_image="stress:latest",
+                cluster_id=rng.choice(clusters).id,
+                status=DeploymentStatus.PENDING,
+                # No victims are ever eligible, so only reservations are exercised
+                priority=0,
+                cpu_required=rng.randint(1, 4),
+                ram_required=rng.randint(1, 8),
+                gpu_required=rng.choice((0, 0, 0, 1)),
+                replicas=rng.choice((1, 1, 1, 2, 4)),
+            )
+            for i in range(DEPLOYMENTS)
+        ]
+        db.add_all(deployments)
+        db.commit()
+        ids = [deployment.id for deployment in deployments]
+    rng.shuffle(ids)
+    return ids
+
+
+def test_concurrent_consumers_never_over_commit(stress_db):
+    ids = seed(stress_db)
+    # Every deployment goes to two workers, as when a task is delivered twice
+    shares = [ids[i::WORKERS] for i in range(WORKERS)]
+    chunks = [share + shares[(i + 1) % WORKERS][::-1] for i, share in enumerate(shares)]
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(WORKERS) as pool:
+        pool.map(consume, chunks)
+
+    with stress_db() as db:
+        assert db.query(Deployment).filter(
+            Deployment.status == DeploymentStatus.COMPLETED
+        ).count() > 0
+        for cluster in db.query(Cluster):
+            used = (
+                db.query(
+                    func.coalesce(func.sum(Deployment.cpu_required * Deployment.replicas), 0),
+                    func.coalesce(func.sum(Deployment.ram_required * Deployment.replicas), 0),
+                    func.coalesce(func.sum(Deployment.gpu_required * Deployment.replicas), 0),
+                )
+                .filter(
+                    Deployment.cluster_id == cluster.id,
+                    Deployment.status == DeploymentStatus.COMPLETED,
+                )
+                .one()
+            )
+            limits = (cluster.cpu_limit, cluster.ram_limit, cluster.gpu_limit)
+            available = (cluster.cpu_available, cluster.ram_available, cluster.gpu_available)
+            for limit, free, taken in zip(limits, available, used):
+                assert free >= 0
+                assert free == pytest.approx(limit - taken)
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from app.core import security
+from app.core.config import settings
+from app.core.security import CredentialCache
+
+
+@pytest.fixture
+def pool_calls(monkeypatch):
+    calls = []
+    run_in_pool = security._run_in_pool
+
+    async def counting_run_in_pool(fn, *args):
+        calls.append(fn.__name__)
+        return await run_in_pool(fn, *args)
+
+    monkeypatch.setattr(security, "_run_in_pool", counting_run_in_pool)
+    yield calls
+    security.shutdown_executor()
+
+
+def test_hashing_runs_in_a_spawned_pool(pool_calls):
+    hashed = asyncio.run(security.get_password_hash_async("s3cret"))
+
+    assert security.verify_password("s3cret", hashed)
+    assert asyncio.run(security.verify_password_async("alice", "s3cret", hashed))
+    assert not asyncio.run(security.verify_password_async("alice", "wrong", hashed))
+    assert pool_calls == ["get_password_hash", "verify_password", "verify_password"]
+    # Forking the API's threads into the pool could deadlock the children
+    assert security._executor._mp_context.get_start_method() == "spawn"
+
+    security.shutdown_executor()
+    assert security._executor is None
+
+
+def test_full_pool_sheds_load(monkeypatch):
+    monkeypatch.setattr(settings, "PASSWORD_HASH_MAX_PENDING", 0)
+
+    with pytest.raises(security.PasswordHashingBusy):
+        asyncio.run(security.get_password_hash_async("s3cret"))
+    assert security._executor is None
+
+
+def test_cached_credentials_skip_the_pool(monkeypatch, pool_calls):
+    monkeypatch.setattr(security, "credential_cache", CredentialCache(ttl_seconds=60))
+    hashed = security.get_password_hash("s3cret")
+
+    def verify(username, password, hashed_password=hashed):
+        return asyncio.run(security.verify_password_async(username, password, hashed_password))
+
+    assert not verify("alice", "wrong")
+    assert verify("alice", "s3cret")
+    assert len(pool_calls) == 2
+    # Only the successful verification was remembered
+    assert verify("alice", "s3cret")
+    assert len(pool_calls) == 2
+    assert not verify("alice", "wrong")
+    assert len(pool_calls) == 3
+
+    # A new password hash or another user is checked again
+    assert verify("alice", "s3cret", security.get_password_hash("s3cret"))
+    assert verify("bob", "s3cret")
+    assert len(pool_calls) == 5
+
+
+def test_credential_cache_expires_and_evicts(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(security.time, "monotonic", lambda: now[0])
+    cache = CredentialCache(ttl_seconds=30, max_entries=2)
+
+    cache.add("alice", "pw", "hash")
+    assert cache.hit("alice", "pw", "hash")
+    assert not cache.hit("alice", "other", "hash")
+    now[0] += 31
+    assert not cache.hit("alice", "pw", "hash")
+    assert len(cache._entries) == 0
+
+    for user in ("alice", "bob", "carol"):
+        cache.add(user, "pw", "hash")
+    assert not cache.hit("alice", "pw", "hash")
+    assert cache.hit("bob", "pw", "hash") and cache.hit("carol", "pw", "hash")
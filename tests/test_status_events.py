@@ -0,0 +1,194 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api.v1 import status_stream as status_stream_module
+from app.api.v1.status_stream import StatusStream, event_stream_response
+from app.core import deps
+from app.core.cluster_limits import cluster_limits_cache
+from app.db.base import Base
+from app.models.cluster import Cluster
+from app.models.deployment import DeploymentStatus
+from app.models.organization import Organization
+from app.queue import events
+from app.queue.events import StatusEvents, stage_status_events
+
+
+class Backend:
+    def __init__(self, in_process):
+        self.in_process = in_process
+        self.published = []
+        self.sent = threading.Event()
+
+    def publish_events(self, events):
+        self.published.append(events)
+        self.sent.set()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Two organizations, with clusters ``a`` and ``b`` and cluster ``c``, in a
+    database of their own that the API's sessions use too.
+    """
+    path = tmp_path / "events.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    clusters = {}
+    with sessionmaker(bind=engine, expire_on_commit=False)() as db:
+        for organization_name, cluster_names in (("first", "ab"), ("second", "c")):
+            organization = Organization(name=organization_name, invite_code=organization_name)
+            db.add(organization)
+            db.flush()
+            for name in cluster_names:
+                clusters[name] = Cluster(
+                    name=name, organization_id=organization.id, cpu_limit=4, ram_limit=8, gpu_limit=0
+                )
+                db.add(clusters[name])
+        db.commit()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(
+        deps, "AsyncSessionLocal", async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    )
+    cluster_limits_cache.clear()
+    yield SimpleNamespace(
+        sync_sessions=sessionmaker(bind=engine),
+        async_sessions=deps.AsyncSessionLocal,
+        clusters=clusters,
+    )
+    cluster_limits_cache.clear()
+    asyncio.run(async_engine.dispose())
+    engine.dispose()
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    """
+    A fresh in-process hub in place of the module's, with its deliveries.
+    """
+    hub = StatusEvents(backend=Backend(in_process=True))
+    hub.delivered = []
+    hub.add_listener(hub.delivered.extend)
+    monkeypatch.setattr(events, "status_events", hub)
+    return hub
+
+
+def deployment(id, cluster):
+    return SimpleNamespace(id=id, cluster_id=cluster.id)
+
+
+def status(id, cluster, status=DeploymentStatus.RUNNING):
+    return {"deployment_id": id, "cluster_id": cluster.id, "status": status.value}
+
+
+def test_events_are_delivered_only_after_commit(database, hub):
+    a = database.clusters["a"]
+    with database.sync_sessions() as db:
+        # Staged alongside the change it describes, as the scheduler does
+        db.get(Cluster, a.id).cpu_available = 1
+        stage_status_events(db, [deployment(1, a)], DeploymentStatus.RUNNING)
+        db.flush()
+        assert hub.delivered == []
+        db.rollback()
+        db.commit()
+        assert hub.delivered == []
+
+        db.get(Cluster, a.id).cpu_available = 2
+        stage_status_events(db, [deployment(2, a), deployment(3, a)], DeploymentStatus.FAILED)
+        db.commit()
+    assert hub.delivered == [
+        status(2, a, DeploymentStatus.FAILED),
+        status(3, a, DeploymentStatus.FAILED),
+    ]
+
+    async def stage_on_async_session():
+        async with database.async_sessions() as db:
+            (await db.get(Cluster, a.id)).cpu_available = 3
+            stage_status_events(db, [deployment(4, a)], DeploymentStatus.COMPLETED)
+            await db.flush()
+            await db.rollback()
+            (await db.get(Cluster, a.id)).cpu_available = 4
+            stage_status_events(db, [deployment(5, a)], DeploymentStatus.COMPLETED)
+            await db.commit()
+
+    hub.delivered.clear()
+    asyncio.run(stage_on_async_session())
+    assert hub.delivered == [status(5, a, DeploymentStatus.COMPLETED)]
+
+
+def test_events_leave_through_the_backend_off_the_caller_thread():
+    backend = Backend(in_process=False)
+    hub = StatusEvents(backend=backend)
+    delivered = []
+    hub.add_listener(delivered.extend)
+    cluster = SimpleNamespace(id=7)
+
+    hub.publish([status(1, cluster)])
+
+    assert backend.sent.wait(5)
+    assert backend.published == [[status(1, cluster)]]
+    # Listeners hear of it when the backend brings it back
+    assert delivered == []
+
+
+def test_stream_fans_out_by_organization_and_cluster(database):
+    a, b, c = (database.clusters[name] for name in "abc")
+    stream = StatusStream(max_pending=10)
+
+    async def scenario():
+        # Nobody is listening yet: dropped
+        stream.publish([status(1, a)])
+        with stream.subscribe(a.organization_id) as organization, stream.subscribe(
+            a.organization_id, cluster_id=b.id
+        ) as only_b, stream.subscribe(c.organization_id) as other:
+            # Changes arrive from the threads that commit them
+            await asyncio.to_thread(stream.publish, [status(2, a), status(3, b), status(4, c)])
+            await asyncio.to_thread(stream.publish, [{**status(5, a), "cluster_id": 999}])
+            await asyncio.to_thread(stream.publish, [status(6, b)])
+            received = {}
+            for name, subscription, count in (
+                ("organization", organization, 3),
+                ("only_b", only_b, 2),
+                ("other", other, 1),
+            ):
+                received[name] = [
+                    (await asyncio.wait_for(subscription.queue.get(), 5))["deployment_id"]
+                    for _ in range(count)
+                ]
+                assert subscription.queue.empty()
+            return received
+
+    assert asyncio.run(scenario()) == {
+        "organization": [2, 3, 6],
+        "only_b": [3, 6],
+        "other": [4],
+    }
+
+
+def test_stream_that_falls_behind_is_closed(database, monkeypatch):
+    a = database.clusters["a"]
+    stream = StatusStream(max_pending=2)
+    monkeypatch.setattr(status_stream_module, "status_stream", stream)
+
+    async def scenario():
+        body = event_stream_response(a.organization_id).body_iterator
+        chunks = [await body.__anext__()]
+        stream.publish([status(1, a), status(2, a)])
+        chunks.append(await asyncio.wait_for(body.__anext__(), 5))
+        # One more than the subscriber may have waiting
+        stream.publish([status(i, a) for i in range(3, 6)])
+        with pytest.raises(StopAsyncIteration):
+            await asyncio.wait_for(body.__anext__(), 5)
+        assert stream._subscribers == {}
+        return chunks
+
+    subscribed, batch = asyncio.run(scenario())
+    assert subscribed == ": subscribed\n\n"
+    assert batch.count("event: status\n") == 2
+    assert '"deployment_id":1' in batch and '"deployment_id":2' in batch
@@ -0,0 +1,183 @@
+import json
+from types import SimpleNamespace
+
+import pika
+import pytest
+from pika.spec import Basic
+from sqlalchemy import func, select
+
+from app.core.cluster_limits import cluster_limits_cache
+from app.models.deployment import Deployment, DeploymentStatus
+from app.models.organization import Organization
+from app.models.user import User
+from app.queue import outbox
+from app.queue.consumer import RabbitMQConsumer
+from app.queue.topology import CAPACITY_FREED
+from app.utils.jwt_utils import create_access_token
+from tests.conftest import TestingSessionLocal
+from tests.test_consumer import Channel
+
+
+@pytest.fixture
+def user(db, monkeypatch):
+    """
+    A user with an organization of their own, and their authorization headers.
+    """
+    organization = Organization(name="usage", invite_code="USAGE")
+    db.add(organization)
+    db.flush()
+    db.add(User(username="usage", email="usage@example.com", organization_id=organization.id))
+    db.commit()
+    # Tasks go to the outbox; the test hands them to the consumer itself
+    monkeypatch.setattr(outbox, "get_queue_backend", lambda: SimpleNamespace(in_process=False))
+    cluster_limits_cache.clear()
+    return SimpleNamespace(
+        organization_id=organization.id,
+        headers={"Authorization": f"Bearer {create_access_token(data={'sub': 'usage'})}"},
+    )
+
+
+def deliver(consumer, *tasks):
+    """
+    Hand ``tasks`` to ``consumer``: one alone, several as a batch.
+    """
+    messages = [
+        (Basic.Deliver(delivery_tag=tag), pika.BasicProperties(headers={}), json.dumps(task))
+        for tag, task in enumerate(tasks, start=1)
+    ]
+    if len(messages) == 1:
+        consumer.process_deployment(Channel(), *messages[0])
+    else:
+        consumer.process_batch(Channel(), messages)
+
+
+def counted(client, headers, cluster_id):
+    response = client.get(f"/api/v1/clusters/{cluster_id}/utilization", headers=headers)
+    assert response.status_code == 200
+    return response.json()["by_status"]
+
+
+def aggregated(cluster_id):
+    by_status = {
+        status.value: {"deployments": 0, "cpu": 0, "ram": 0, "gpu": 0}
+        for status in DeploymentStatus
+    }
+    with TestingSessionLocal() as db:
+        rows = db.execute(
+            select(
+                Deployment.status,
+                func.count(),
+                func.sum(Deployment.cpu_required * Deployment.replicas),
+                func.sum(Deployment.ram_required * Deployment.replicas),
+                func.sum(Deployment.gpu_required * Deployment.replicas),
+            )
+            .where(Deployment.cluster_id == cluster_id)
+            .group_by(Deployment.status)
+        )
+        for status, count, cpu, ram, gpu in rows:
+            by_status[status.value] = {"deployments": count, "cpu": cpu, "ram": ram, "gpu": gpu}
+    return by_status
+
+
+def statuses(*ids):
+    with TestingSessionLocal() as db:
+        return [db.get(Deployment, id).status for id in ids]
+
+
+def test_usage_counters_follow_every_transition(client, user):
+    headers = user.headers
+    response = client.post(
+        "/api/v1/clusters/",
+        json={
+            "name": "usage",
+            "cpu_limit": 4,
+            "ram_limit": 8,
+            "gpu_limit": 1,
+            "organization_id": user.organization_id,
+        },
+        headers=headers,
+    )
+    cluster_id = response.json()["id"]
+    consumer = RabbitMQConsumer(batch_size=10)
+
+    def submit(name, cpu, priority, gpu=0):
+        spec = {
+            "name": name,
+            "docker_image": "image",
+            "cpu_required": cpu,
+            "ram_required": 1,
+            "gpu_required": gpu,
+            "replicas": 1,
+            "priority": priority,
+            "cluster_id": cluster_id,
+        }
+        response = client.post("/api/v1/deployments/", json=spec, headers=headers)
+        assert response.status_code == 200
+        return response.json()["id"]
+
+    def task(id, priority):
+        return {"deployment_id": id, "priority": priority, "attempt": 0}
+
+    def assert_counters_match():
+        assert counted(client, headers, cluster_id) == aggregated(cluster_id)
+
+    assert_counters_match()
+
+    # Created, then scheduled on its own
+    first = submit("first", cpu=2, priority=0, gpu=1)
+    assert_counters_match()
+    deliver(consumer, task(first, 0))
+    assert statuses(first) == [DeploymentStatus.COMPLETED]
+    assert_counters_match()
+
+    # Created in bulk, then scheduled as a batch
+    response = client.post(
+        "/api/v1/deployments/bulk",
+        json=[
+            {
+                "name": f"bulk-{i}",
+                "docker_image": "image",
+                "cpu_required": 1,
+                "ram_required": 2,
+                "gpu_required": 0,
+                "priority": 5,
+                "cluster_id": cluster_id,
+            }
+            for i in range(2)
+        ],
+        headers=headers,
+    )
+    bulk = [result["id"] for result in response.json()["results"]]
+    assert_counters_match()
+    deliver(consumer, *(task(id, 5) for id in bulk))
+    assert statuses(*bulk) == [DeploymentStatus.COMPLETED] * 2
+    assert_counters_match()
+
+    # The cluster is full: the bulk deployments make room for an urgent one
+    urgent = submit("urgent", cpu=2, priority=0)
+    deliver(consumer, task(urgent, 0))
+    assert statuses(urgent, *bulk) == [DeploymentStatus.COMPLETED] + [DeploymentStatus.FAILED] * 2
+    assert_counters_match()
+
+    # Nothing to preempt and no retries left: failed
+    hopeless = submit("hopeless", cpu=3, priority=9)
+    deliver(RabbitMQConsumer(max_retries=0), task(hopeless, 9))
+    assert statuses(hopeless) == [DeploymentStatus.FAILED]
+    assert_counters_match()
+
+    # Parked for a retry, then admitted when a running deployment is terminated
+    waiting = submit("waiting", cpu=2, priority=3)
+    deliver(consumer, task(waiting, 3))
+    assert statuses(waiting) == [DeploymentStatus.PENDING]
+    response = client.post(f"/api/v1/deployments/{first}/terminate", headers=headers)
+    assert response.status_code == 200
+    assert_counters_match()
+    deliver(consumer, {"deployment_id": first, "priority": 0, "event": CAPACITY_FREED})
+    assert statuses(first, waiting) == [DeploymentStatus.TERMINATED, DeploymentStatus.COMPLETED]
+    assert_counters_match()
+
+    # A pending deployment can be terminated too
+    never = submit("never", cpu=1, priority=1)
+    client.post(f"/api/v1/deployments/{never}/terminate", headers=headers)
+    assert statuses(never) == [DeploymentStatus.TERMINATED]
+    assert_counters_match()
@@ -0,0 +1,57 @@
+import json
+import logging
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+from worker.main import RESTART_BACKOFF_SECONDS, WorkerPool
+
+
+def test_unexpected_exit_is_logged_with_its_fields(caplog):
+    pool = WorkerPool(processes=1)
+    process = SimpleNamespace(name="consumer-0", pid=4242, exitcode=-9)
+
+    with caplog.at_level(logging.INFO, logger="worker.main"):
+        pool._schedule_restart(0, process, started=time.monotonic())
+        pool._schedule_restart(0, process, started=time.monotonic())
+
+    first, second = caplog.records
+    assert first.levelname == "WARNING"
+    assert (first.consumer, first.pid, first.exitcode) == ("consumer-0", 4242, -9)
+    # The first restart is immediate, crashes in a row back off
+    assert first.delay_seconds == 0
+    assert second.delay_seconds == RESTART_BACKOFF_SECONDS
+    assert "4242" not in first.getMessage()
+
+
+# Forks a pool child the way WorkerPool does, from a supervisor whose log
+# writer thread is already running, with a consumer that only logs
+_POOL_CHILD = """
+import logging
+import multiprocessing
+
+import worker.main
+
+def run_consumer(metrics_port):
+    logging.getLogger("worker.consumer").error("child says hi")
+
+worker.main.run_consumer = run_consumer
+child = multiprocessing.get_context("fork").Process(target=worker.main._child_main, args=(0,))
+child.start()
+child.join()
+"""
+
+
+def test_pool_child_logs_reach_stdout():
+    result = subprocess.run(
+        [sys.executable, "-c", _POOL_CHILD], capture_output=True, text=True, timeout=60
+    )
+
+    assert result.returncode == 0, result.stderr
+    records = [json.loads(line) for line in result.stdout.splitlines() if line.startswith("{")]
+    assert [
+        (record["level"], record["message"])
+        for record in records
+        if record["logger"] == "worker.consumer"
+    ] == [("error", "child says hi")]
@@ -1,59 +1,163 @@
-import json
 import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
 
-from sqlmodel import Session
-
+from app.core.config import settings
+from app.core.log import configure_logging, stop_logging
+from app.core.metrics import start_metrics_server
 from app.db.session import engine
-from app.models.deployment import DeploymentStatus
+from app.queue.backends import get_queue_backend
 from app.queue.consumer import RabbitMQConsumer
-from app.scheduler.scheduler import Scheduler
 
 # Configure logging
-logging.basicConfig()
+configure_logging()
 logger = logging.getLogger(__name__)
 
-
-def process_deployment(ch, method, properties, body):
-    """Process deployment messages"""
-    try:
-        print("NEW DEPLOYMENT")
-        data = json.loads(body)
-        with Session(engine) as db:
-            scheduler = Scheduler(db)
-            success = scheduler.process_deployment(data["deployment_id"])
-
-            if success:
-                logger.info(
-                    f"Deployment {data['deployment_id']} processed successfully."
-                )
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-            else:
-                # Requeue if failed (with retry limit)
-                if data.get("retry_count", 0) < 3:
-                    data["retry_count"] = data.get("retry_count", 0) + 1
-                    ch.basic_publish(
-                        exchange="",
-                        routing_key=method.routing_key,
-                        body=json.dumps(data),
-                    )
-                    logger.warning(
-                        f"Requeueing deployment {data['deployment_id']} for retry."
-                    )
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-    except Exception as e:
-        logger.error(f"Error processing deployment: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag)
+# Restart delay after a child crash, doubled for each crash in a row
+RESTART_BACKOFF_SECONDS = 1
+MAX_RESTART_BACKOFF_SECONDS = 30
+# A child that ran this long before dying resets the backoff
+STABLE_AFTER_SECONDS = 60
 
 
-def main():
+def run_consumer(metrics_port=None):
+    """
+    Consume until SIGTERM, then finish the message in hand and return.
+    """
+    port = settings.WORKER_METRICS_PORT if metrics_port is None else metrics_port
+    if port:
+        start_metrics_server(port)
     consumer = RabbitMQConsumer()
-
-    # Start consuming from priority queues
+    backend = get_queue_backend()
+    signal.signal(signal.SIGTERM, lambda signum, frame: backend.stop())
     try:
-        consumer.start_consuming()
+        backend.consume(consumer)
     except KeyboardInterrupt:
         logger.info(" [*] Stopping worker...")
 
 
+def _child_main(slot):
+    # The supervisor's log writer thread did not survive the fork
+    configure_logging()
+    # Ctrl+C reaches the whole process group; let the supervisor drive shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Never reuse database connections inherited from the supervisor
+    engine.dispose(close=False)
+    try:
+        # Every child serves its own metrics on the next port up
+        run_consumer(settings.WORKER_METRICS_PORT and settings.WORKER_METRICS_PORT + slot)
+    finally:
+        stop_logging()
+
+
+class WorkerPool:
+    """
+    Supervisor of ``processes`` consumer processes.
+
+    Each child opens its own broker connection and database pool. A child
+    that exits while the pool is running is restarted, with an exponential
+    backoff when it keeps crashing. On SIGTERM or SIGINT every child is asked
+    to drain (finish its current message, return the prefetched ones) and is
+    killed if it has not exited within ``drain_timeout`` seconds.
+    """
+
+    def __init__(self, processes=None, drain_timeout=None):
+        self.processes = processes or settings.WORKER_PROCESSES
+        self.drain_timeout = drain_timeout or settings.WORKER_DRAIN_TIMEOUT_SECONDS
+        self._children = {}  # slot -> (process, started at)
+        self._backoff = {}  # slot -> delay before the next restart
+        self._restart_at = {}  # slot -> when to respawn a dead child
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for slot in range(self.processes):
+            self._spawn(slot)
+        logger.info("Supervising consumer processes", extra={"processes": self.processes})
+
+        while not self._stopping:
+            sentinels = [
+                process.sentinel
+                for slot, (process, _) in self._children.items()
+                if slot not in self._restart_at
+            ]
+            multiprocessing.connection.wait(sentinels, timeout=0.5)
+            now = time.monotonic()
+            for slot, (process, started) in list(self._children.items()):
+                if self._stopping:
+                    break
+                if slot in self._restart_at:
+                    if now >= self._restart_at[slot]:
+                        del self._restart_at[slot]
+                        self._spawn(slot)
+                elif not process.is_alive():
+                    self._schedule_restart(slot, process, started)
+
+        self._drain()
+
+    def _spawn(self, slot):
+        process = multiprocessing.Process(
+            target=_child_main, args=(slot,), name=f"consumer-{slot}", daemon=False
+        )
+        process.start()
+        self._children[slot] = (process, time.monotonic())
+
+    def _schedule_restart(self, slot, process, started):
+        uptime = time.monotonic() - started
+        if uptime >= STABLE_AFTER_SECONDS:
+            self._backoff.pop(slot, None)
+        delay = self._backoff.get(slot, 0)
+        logger.warning(
+            "Consumer exited unexpectedly; restarting",
+            extra={
+                "consumer": process.name,
+                "pid": process.pid,
+                "exitcode": process.exitcode,
+                "uptime_seconds": round(uptime),
+                "delay_seconds": delay,
+            },
+        )
+        self._backoff[slot] = min(
+            max(delay * 2, RESTART_BACKOFF_SECONDS), MAX_RESTART_BACKOFF_SECONDS
+        )
+        self._restart_at[slot] = time.monotonic() + delay
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _drain(self):
+        children = [process for process, _ in self._children.values()]
+        logger.info("Draining consumer processes", extra={"processes": len(children)})
+        for process in children:
+            if process.is_alive():
+                process.terminate()  # SIGTERM: finish the current message
+        deadline = time.monotonic() + self.drain_timeout
+        for process in children:
+            process.join(max(0, deadline - time.monotonic()))
+        for process in children:
+            if process.is_alive():
+                logger.warning(
+                    "Consumer did not drain in time; killing it",
+                    extra={"consumer": process.name, "pid": process.pid},
+                )
+                process.kill()
+                process.join()
+
+
+def main():
+    backend = get_queue_backend()
+    if backend.in_process:
+        raise SystemExit(
+            f"QUEUE_BACKEND={backend.name} schedules inside the API process; no worker is needed"
+        )
+    if settings.WORKER_PROCESSES <= 1:
+        run_consumer()
+        return
+    WorkerPool().run()
+
+
 if __name__ == "__main__":
     main()
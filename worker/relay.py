@@ -0,0 +1,28 @@
+import logging
+
+from app.core.log import configure_logging
+from app.queue.backends import get_queue_backend
+from app.queue.outbox import OutboxRelay
+
+# Configure logging
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+def main():
+    backend = get_queue_backend()
+    if backend.in_process:
+        raise SystemExit(
+            f"QUEUE_BACKEND={backend.name} hands tasks over inside the API process; no relay is needed"
+        )
+    relay = OutboxRelay()
+
+    # Publish outbox rows until interrupted
+    try:
+        relay.run()
+    except KeyboardInterrupt:
+        logger.info(" [*] Stopping outbox relay...")
+
+
+if __name__ == "__main__":
+    main()